@@ -2,40 +2,88 @@
 aggregator.py — Calculates all metrics from parsed DataFrames.
 All contact references use column 'contact_name' consistently.
 """
+import numpy as np
 import pandas as pd
+from datetime import date
+from timeline import encode_daily
+import call_analytics, coactivity
 
 def aggregate(messages: pd.DataFrame, calls: pd.DataFrame, metadata: dict) -> dict:
+    return finalize(accumulate(new_state(), messages, calls), metadata)
+
+# ── Mergeable state ───────────────────────────────────
+# Everything the metrics need, as counts that add up across batches of
+# records and survive a JSON round trip. incremental.py keeps one per device
+# and folds only a re-extraction's new records into it; bump STATE_VERSION
+# when the layout changes so stored states are rebuilt.
+STATE_VERSION = 3
+
+def new_state() -> dict:
+    return {"v": STATE_VERSION, "messages": 0, "calls": 0, "first": None, "last": None,
+            "contacts": {}, "call_contacts": {}, "hourly": [0] * 24, "daily": {},
+            "call_detail": call_analytics.new_state(), "coactivity": coactivity.new_state()}
+
+def _add(d, counts):
+    for k, v in counts.items():
+        d[k] = d.get(k, 0) + int(v)
+
+def accumulate(state: dict, messages: pd.DataFrame, calls: pd.DataFrame) -> dict:
+    """Adds a batch of parsed records to state (in place) and returns it."""
+    state["messages"] += len(messages)
+    state["calls"]    += len(calls)
+    if not calls.empty:
+        _add(state["call_contacts"], calls["contact_name"].value_counts())
+        call_analytics.accumulate(state["call_detail"], calls)
+    if messages.empty:
+        return state
+    ts = pd.to_datetime(messages["timestamp"], errors="coerce")
+    ok = ts.notna()
+    ts = ts[ok]
+    if ts.empty:
+        return state
+    mn, mx = ts.min(), ts.max()
+    if state["first"] is None or mn < pd.Timestamp(state["first"]): state["first"] = mn.isoformat()
+    if state["last"] is None or mx > pd.Timestamp(state["last"]):   state["last"]  = mx.isoformat()
+    _add(state["contacts"], messages.loc[ok, "contact_name"].value_counts())
+    state["hourly"] = (np.asarray(state["hourly"]) + np.bincount(ts.dt.hour, minlength=24)).tolist()
+    _add(state["daily"], {str(d): n for d, n in ts.dt.date.value_counts().items()})
+    coactivity.accumulate(state["coactivity"], messages)
+    return state
+
+def _counts(d, col):
+    names = sorted(d)
+    return pd.DataFrame({"contact_name": pd.Series(names, dtype=object),
+                         col: pd.Series([d[n] for n in names], dtype="int64")})
+
+def finalize(state: dict, metadata: dict) -> dict:
+    """The metrics dict for everything accumulated in state."""
     m = {}
     m["metadata"]       = metadata
-    m["total_messages"] = len(messages)
-    m["total_calls"]    = len(calls)
+    m["total_messages"] = state["messages"]
+    m["total_calls"]    = state["calls"]
+    if state["calls"]:
+        m["call_stats"], m["call_contacts"] = call_analytics.finalize(state["call_detail"])
 
-    if messages.empty:
+    if not state["messages"] or state["first"] is None:
         return m
 
-    messages = messages.copy()
-    messages["timestamp"] = pd.to_datetime(messages["timestamp"], errors="coerce")
-    messages = messages.dropna(subset=["timestamp"])
-
     # Date range
-    mn, mx = messages["timestamp"].min(), messages["timestamp"].max()
+    mn, mx = pd.Timestamp(state["first"]), pd.Timestamp(state["last"])
     m["date_range"]       = f"{mn.strftime('%b %d, %Y')} to {mx.strftime('%b %d, %Y')}"
     m["days_active"]      = max((mx - mn).days + 1, 1)
     m["avg_daily_messages"] = round(m["total_messages"] / m["days_active"], 1)
 
     # Unique contacts (excluding Subject)
-    all_c = messages["contact_name"].dropna()
-    if not calls.empty:
-        all_c = pd.concat([all_c, calls["contact_name"].dropna()])
-    unique = [c for c in all_c.unique() if str(c).lower() not in ("subject","","nan")]
+    unique = [c for c in set(state["contacts"]) | set(state["call_contacts"])
+              if str(c).lower() not in ("subject","","nan")]
     m["unique_contacts"] = len(unique)
 
     # Top contacts
-    msg_cnt  = messages.groupby("contact_name").size().reset_index(name="messages")
+    msg_cnt  = _counts(state["contacts"], "messages")
     msg_cnt  = msg_cnt[~msg_cnt["contact_name"].str.lower().isin(["subject",""])]
 
-    if not calls.empty:
-        call_cnt = calls.groupby("contact_name").size().reset_index(name="calls")
+    if state["calls"]:
+        call_cnt = _counts(state["call_contacts"], "calls")
     else:
         call_cnt = pd.DataFrame(columns=["contact_name","calls"])
 
@@ -49,21 +97,21 @@ def aggregate(messages: pd.DataFrame, calls: pd.DataFrame, metadata: dict) -> di
     m["top_contact"]  = top.iloc[0].to_dict() if not top.empty else {}
 
     # Night activity
-    messages["hour"] = messages["timestamp"].dt.hour
-    night = messages[messages["hour"].between(0,4)]
-    m["night_activity_pct"]  = round(len(night) / max(m["total_messages"],1) * 100, 1)
-    m["night_message_count"] = len(night)
+    hourly = pd.Series(state["hourly"], index=range(24), dtype="int64")
+    night  = int(hourly.iloc[:5].sum())
+    m["night_activity_pct"]  = round(night / max(m["total_messages"],1) * 100, 1)
+    m["night_message_count"] = night
 
     # Hourly distribution
-    hourly = messages.groupby("hour").size().reindex(range(24), fill_value=0)
     m["hourly_distribution"] = hourly.to_dict()
     m["peak_hour"]            = int(hourly.idxmax())
     m["peak_hour_label"]      = f"{m['peak_hour']:02d}:00–{m['peak_hour']+1:02d}:00"
 
     # Daily volume + spike
-    messages["date"] = messages["timestamp"].dt.date
-    daily = messages.groupby("date").size()
-    m["daily_volume"]       = {str(k): int(v) for k, v in daily.items()}
+    days  = sorted(state["daily"])
+    daily = pd.Series([state["daily"][d] for d in days], dtype="int64",
+                      index=pd.Index([date.fromisoformat(d) for d in days], name="date"))
+    m["daily_series"]       = encode_daily(daily)   # older rows carry "daily_volume"
     m["avg_daily_messages"] = round(daily.mean(), 1)
     spike_date  = daily.idxmax()
     spike_count = int(daily.max())
@@ -90,4 +138,7 @@ def aggregate(messages: pd.DataFrame, calls: pd.DataFrame, metadata: dict) -> di
         {"source":"Subject","target":r["contact_name"],"weight":int(r["messages"])}
         for r in top.head(10).to_dict("records")
     ]
+
+    # Co-activity (second edge type: contact ↔ contact)
+    m["coactivity"] = coactivity.finalize(state["coactivity"])
     return m
@@ -0,0 +1,91 @@
+"""
+ai_stub.py — Local stand-in for the Gemini REST API (generateContent).
+Lets summary latency, hedging, failures and quotas be exercised offline.
+
+Run: python ai_stub.py --port 8790 --latency gemini-2.0-flash-lite=8 --fail gemini-pro
+     GEMINI_API_KEY=test GEMINI_API_BASE=http://127.0.0.1:8790 python -m streamlit run app.py
+"""
+import argparse, hashlib, json, random, re, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class StubState:
+    def __init__(self, latency=None, default_latency=0.2, jitter=0.0, fail=(), rpm=0):
+        self.latency, self.default_latency, self.jitter = latency or {}, default_latency, jitter
+        self.fail, self.rpm = set(fail), rpm
+        self.lock, self.recent, self.calls = threading.Lock(), [], {}
+
+    def admit(self):
+        """False when the requests-per-minute quota is exhausted (→ 429)."""
+        if not self.rpm:
+            return True
+        now = time.monotonic()
+        with self.lock:
+            self.recent = [t for t in self.recent if now - t < 60]
+            if len(self.recent) >= self.rpm:
+                return False
+            self.recent.append(now)
+            return True
+
+class Handler(BaseHTTPRequestHandler):
+    state: StubState = None
+    protocol_version = "HTTP/1.1"
+
+    def _json(self, code, obj):
+        body = json.dumps(obj).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers(); self.wfile.write(body)
+
+    def do_POST(self):
+        req = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        m = re.search(r"/models/([^/:]+):generateContent", self.path)
+        if not m:
+            return self._json(404, {"error": {"code": 404, "message": "not found"}})
+        model, st = m.group(1), self.state
+        with st.lock: st.calls[model] = st.calls.get(model, 0) + 1
+        if not st.admit():
+            return self._json(429, {"error": {"code": 429, "status": "RESOURCE_EXHAUSTED",
+                                              "message": "quota exceeded"}})
+        time.sleep(max(st.latency.get(model, st.default_latency) + random.uniform(0, st.jitter), 0))
+        if model in st.fail:
+            return self._json(500, {"error": {"code": 500, "status": "INTERNAL", "message": "stub failure"}})
+        prompt = " ".join(p.get("text", "") for c in req.get("contents", []) for p in c.get("parts", []))
+        digest = hashlib.sha256(prompt.encode()).hexdigest()[:8]
+        text = "\n\n".join(f"[{model}] Stub paragraph {i} for prompt {digest}." for i in (1, 2, 3))
+        self._json(200, {"candidates": [{"content": {"parts": [{"text": text}], "role": "model"},
+                                         "finishReason": "STOP", "index": 0}],
+                         "usageMetadata": {"promptTokenCount": len(prompt) // 4,
+                                           "candidatesTokenCount": len(text) // 4,
+                                           "totalTokenCount": (len(prompt) + len(text)) // 4}})
+
+    def log_message(self, *a):
+        pass
+
+def serve(port=0, **state):
+    """Starts the stub on a daemon thread; returns (server, base_url)."""
+    Handler.state = StubState(**state)
+    srv = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv, f"http://127.0.0.1:{srv.server_port}"
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--port", type=int, default=8790)
+    ap.add_argument("--latency", action="append", default=[], metavar="MODEL=SECONDS")
+    ap.add_argument("--default-latency", type=float, default=0.2)
+    ap.add_argument("--jitter", type=float, default=0.0, help="extra random latency, seconds")
+    ap.add_argument("--fail", action="append", default=[], metavar="MODEL", help="answer 500")
+    ap.add_argument("--rpm", type=int, default=0, help="requests per minute before 429 (0 = off)")
+    args = ap.parse_args()
+    latency = {k: float(v) for k, v in (x.split("=", 1) for x in args.latency)}
+    srv, url = serve(args.port, latency=latency, default_latency=args.default_latency,
+                     jitter=args.jitter, fail=args.fail, rpm=args.rpm)
+    print(f"[Stub] Gemini stand-in at {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        srv.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,71 @@
 """
 ai_summary.py — Gemini AI summary with template fallback.
 Works even without an API key.
+
+Summaries are cached in the database by hash of (model, prompt). Models are
+raced with hedging: the next model starts if the current one hasn't answered
+within HEDGE_AFTER seconds (or as soon as it fails), the first answer wins,
+and after DEADLINE seconds the template is used. GEMINI_API_BASE points the
+client at another endpoint, e.g. the local stand-in `python ai_stub.py`.
 """
-import os
+import os, time, hashlib, threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 try:
     from dotenv import load_dotenv
     load_dotenv()
 except: pass
 
-def generate_summary(metrics: dict) -> str:
-    key = os.getenv("GEMINI_API_KEY","")
-    if key and key != "paste_your_key_here":
-        try:
+MODELS      = ["gemini-2.0-flash-lite", "gemini-1.5-flash", "gemini-pro"]
+HEDGE_AFTER = float(os.getenv("UFDR_AI_HEDGE_S", "4"))      # seconds before racing the next model
+DEADLINE    = float(os.getenv("UFDR_AI_DEADLINE_S", "20"))  # hard cap, then the template
+CACHE_TTL   = float(os.getenv("UFDR_AI_CACHE_TTL_S", str(30 * 86400)))
+CACHE_ROWS  = 2000
+
+_pool   = ThreadPoolExecutor(max_workers=2 * len(MODELS), thread_name_prefix="ai")
+_lock   = threading.Lock()
+_models = {}        # (api key, endpoint, model name) -> GenerativeModel
+
+def _reset_after_fork():
+    global _pool, _lock
+    _pool, _lock = ThreadPoolExecutor(max_workers=2 * len(MODELS), thread_name_prefix="ai"), threading.Lock()
+    _models.clear()                  # clients hold sockets; never share them across fork()
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+def api_key():
+    """The configured Gemini key, or "" when summaries fall back to the template."""
+    key = os.getenv("GEMINI_API_KEY", "")
+    return key if key and key != "paste_your_key_here" else ""
+
+def _model(name):
+    """One configured client per process, reused across calls."""
+    ident = (api_key(), os.getenv("GEMINI_API_BASE", ""), name)
+    with _lock:
+        if ident not in _models:
             import google.generativeai as genai
-            genai.configure(api_key=key)
-            top = metrics.get("top_contact",{})
-            contacts_text = "\n".join(
-                f"  #{c['rank']} {c['contact_name']}: {c['messages']} msgs, {c['calls']} calls ({c['msg_pct']}%)"
-                for c in metrics.get("top_contacts",[])[:5]
-            )
-            prompt = f"""You are a forensic intelligence analyst. Write a professional executive summary in exactly 3 short paragraphs based on these metrics from a phone forensic extraction:
+            if not any(k[:2] == ident[:2] for k in _models):
+                opts = {"api_endpoint": ident[1]} if ident[1] else None
+                genai.configure(api_key=ident[0], transport="rest" if ident[1] else None,
+                                client_options=opts)
+                _models.clear()
+            _models[ident] = genai.GenerativeModel(name)
+        return _models[ident]
+
+def ask(name, prompt, timeout):
+    """One uncached model call; raises on API errors (callers retry or hedge)."""
+    return _model(name).generate_content(prompt, request_options={"timeout": timeout}).text.strip()
+
+def cache_key(model, prompt):
+    """summary_cache key of a (model, prompt) answer."""
+    return hashlib.sha256(f"{model}\0{prompt}".encode()).hexdigest()
+
+def build_prompt(metrics: dict) -> str:
+    top = metrics.get("top_contact",{})
+    contacts_text = "\n".join(
+        f"  #{c['rank']} {c['contact_name']}: {c['messages']} msgs, {c['calls']} calls ({c['msg_pct']}%)"
+        for c in metrics.get("top_contacts",[])[:5]
+    )
+    return f"""You are a forensic intelligence analyst. Write a professional executive summary in exactly 3 short paragraphs based on these metrics from a phone forensic extraction:
 
 Total messages: {metrics.get('total_messages')}
 Total calls: {metrics.get('total_calls')}
@@ -35,16 +81,60 @@ Top contacts:
 {contacts_text}
 
 Rules: Paragraph 1 = most critical finding. Paragraph 2 = patterns and timeline. Paragraph 3 = risk indicators. Objective tone, plain language, 2-3 sentences each."""
-            for model_name in ["gemini-2.0-flash-lite","gemini-1.5-flash","gemini-pro"]:
-                try:
-                    model = genai.GenerativeModel(model_name)
-                    return model.generate_content(prompt).text.strip()
-                except: continue
-        except Exception as e:
-            print(f"[AI] Gemini failed: {e}")
-    return _fallback(metrics)
-
-def _fallback(m):
+
+def generate_summary(metrics: dict) -> str:
+    if not api_key():
+        return template_summary(metrics)
+    import database
+    prompt = build_prompt(metrics)
+    try:
+        hit = database.summary_cache_get([cache_key(m, prompt) for m in MODELS], CACHE_TTL)
+        if hit:
+            return hit[2]
+    except Exception as e:
+        print(f"[AI] Cache unavailable: {e}")
+
+    text, model = _race(prompt)
+    if text:
+        try: database.summary_cache_put(cache_key(model, prompt), model, text, CACHE_ROWS)
+        except Exception as e: print(f"[AI] Cache write failed: {e}")
+        return text
+    return template_summary(metrics)
+
+def _race(prompt, models=MODELS, hedge_after=None, deadline=None):
+    """Hedged model calls. Returns (text, model) or (None, None) when every
+    model failed or the deadline passed. Calls still running at the deadline
+    are abandoned; their own request timeout ends them."""
+    hedge_after = HEDGE_AFTER if hedge_after is None else hedge_after
+    deadline    = DEADLINE if deadline is None else deadline
+    t_end   = time.monotonic() + deadline
+    waiting = list(models)
+    running = {}
+    next_at = time.monotonic()
+    while True:
+        now = time.monotonic()
+        if waiting and now >= next_at:
+            name = waiting.pop(0)
+            running[_pool.submit(ask, name, prompt, max(t_end - now, 0.1))] = name
+            next_at = now + hedge_after
+        if not running or now >= t_end:
+            break
+        timeout = min(t_end, next_at if waiting else t_end) - now
+        done, _ = wait(running, timeout=max(timeout, 0), return_when=FIRST_COMPLETED)
+        for fut in done:
+            name = running.pop(fut)
+            try:
+                text = fut.result()
+                if text:
+                    return text, name
+            except Exception as e:
+                print(f"[AI] {name} failed: {e}")
+            next_at = time.monotonic()          # failure → hedge immediately
+    if running:
+        print(f"[AI] No answer within the {deadline:g}s deadline — using template")
+    return None, None
+
+def template_summary(m):
     top   = m.get("top_contact",{})
     name  = top.get("contact_name","an unidentified contact")
     pct   = top.get("msg_pct",0)
@@ -4,18 +4,29 @@ Run: python -m streamlit run app.py
 Login: admin / admin123
 """
 import streamlit as st
-import time, base64, pandas as pd
-import matplotlib
-matplotlib.use("Agg")
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
-from datetime import datetime
+import os, io, time, base64, hashlib, threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+# pandas / matplotlib are imported where charts are drawn; startup.prewarm()
+# loads them (and the rest of the pipeline) in the background at login.
 
-from database import init_db, login_user, register_user, save_analysis, get_history, get_pdf, delete_analysis
+from database import (login_user, register_user, get_history_page,
+                      count_history, get_pdf_status, delete_analysis,
+                      backfill_stats, missing_stats_count, cross_case_summary,
+                      cross_case_list, flag_frequencies, init_db, query_messages,
+                      contact_activity, message_directions, analysis_owner, get_analysis,
+                      get_timings, slowest_analyses, stage_breakdown)
+from pdf_jobs import submit_pdf, pdf_bytes
+from export import export_zip
+from pipeline import PIPELINE_VERSION
+
+# When set, uploads are queued on a running service.py instead of analyzed in-process
+SERVICE_URL = os.getenv("UFDR_SERVICE_URL")
+# Accounts that see the Performance page (stage timings across every user's cases)
+ADMINS = {u.strip() for u in os.getenv("UFDR_ADMINS", "admin").split(",") if u.strip()}
 
 st.set_page_config(page_title="UFDRINSIGHT", page_icon="🔍", layout="wide",
                    initial_sidebar_state="collapsed")
-init_db()
 
 # ══════════════════════════════════════════════════════
 # SHARED CSS
@@ -61,17 +72,147 @@ def goto(page):
     st.rerun()
 
 # ══════════════════════════════════════════════════════
-# NAVBAR (shown on dashboard + history)
+# CACHING (keyed by content hash / analysis id + PIPELINE_VERSION)
+# ══════════════════════════════════════════════════════
+CACHE_TTL       = 3600               # seconds
+PIPELINE_MAX    = 8                  # cached pipeline results per server
+PIPELINE_MAX_MB = 512
+
+class _ResultLRU:
+    """Pipeline outputs by (upload sha256, PIPELINE_VERSION, owners), and the
+    parse of device archives by ("parse", sha256, PIPELINE_VERSION), shared by all
+    sessions. Evicts least-recently-used entries beyond max_entries/max_bytes
+    and anything older than ttl. Values are shared: treat them as read-only."""
+    def __init__(self, max_entries, max_bytes, ttl):
+        self.max_entries, self.max_bytes, self.ttl = max_entries, max_bytes, ttl
+        self.items, self.bytes, self.lock = OrderedDict(), 0, threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            hit = self.items.get(key)
+            if hit and time.time() - hit[2] > self.ttl:
+                self._drop(key); hit = None
+            if hit:
+                self.items.move_to_end(key)
+            return hit[0] if hit else None
+
+    def put(self, key, value, size):
+        with self.lock:
+            if key in self.items: self._drop(key)
+            self.items[key] = (value, size, time.time()); self.bytes += size
+            while len(self.items) > self.max_entries or \
+                  (self.bytes > self.max_bytes and len(self.items) > 1):
+                self._drop(next(iter(self.items)))
+
+    def _drop(self, key):
+        self.bytes -= self.items.pop(key)[1]
+
+def _result_size(out):
+    p = out["parsed"]
+    return int(p["messages"].memory_usage(deep=True).sum() + p["calls"].memory_usage(deep=True).sum()
+               + len(out.get("graph", "")))
+
+@st.cache_resource
+def _pipeline_cache():
+    return _ResultLRU(PIPELINE_MAX, PIPELINE_MAX_MB * 1024**2, CACHE_TTL)
+
+@st.cache_resource
+def _db_ready():
+    init_db()            # migrations + WAL setup once per server process
+    return True
+_db_ready()
+
+@st.cache_resource
+def _prewarm():
+    import startup
+    startup.prewarm()
+    return True
+_prewarm()
+
+def _style_axes(fig, ax):
+    fig.patch.set_facecolor("#111936"); ax.set_facecolor("#111936")
+    ax.tick_params(colors="#8892b0", labelsize=7)
+    for sp in ax.spines.values(): sp.set_edgecolor("#1a2550")
+    ax.set_ylabel("Messages", color="#8892b0", fontsize=7)
+
+def _png(fig):
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png", dpi=100, facecolor=fig.get_facecolor())
+    return buf.getvalue()
+
+def _content_version(metrics):
+    """Short hash of an analysis' metrics. A follow-up extraction folded into a
+    case (incremental.py) rewrites them under the same id, so cache keys
+    for anything drawn from them carry this too."""
+    import json
+    return hashlib.sha256(json.dumps(metrics, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+# Charts are cached on (analysis id, PIPELINE_VERSION, content version); the
+# metrics/graph arguments are excluded from hashing (leading underscore).
+@st.cache_data(max_entries=128, ttl=CACHE_TTL, show_spinner=False)
+def _timeline_png(key, zoom, _m):
+    import matplotlib.dates as mdates
+    from matplotlib.figure import Figure
+    import numpy as np
+    from timeline import daily_series, window, downsample
+    days, counts = window(*daily_series(_m), *zoom)
+    x, y = downsample(days, counts)
+    fig = Figure(figsize=(9,3)); ax = fig.subplots()
+    avg = _m.get("avg_daily_messages",0)
+    ax.axhline(avg, color="#8892b0", linestyle="--", linewidth=0.8, alpha=0.6)
+    ax.fill_between(x, y, alpha=0.15, color="#00d9ff")
+    ax.plot(x, y, color="#00d9ff", linewidth=2 if len(x) < 120 else 1)
+    spike_date = _m.get("spike_date")
+    if spike_date and len(days):
+        sd = np.datetime64(spike_date, "D")
+        if days[0] <= sd <= days[-1]:
+            sv = counts[int((sd - days[0]).astype(int))]
+            ax.scatter([sd],[sv],color="#ff4757",s=80,zorder=5)
+            ax.annotate(f"SPIKE +{_m.get('spike_increase_pct',0)}%",
+                xy=(sd,sv),xytext=(0,10),textcoords="offset points",
+                color="#ff4757",fontsize=7,ha="center",
+                arrowprops=dict(arrowstyle="->",color="#ff4757",lw=0.8))
+    locator = mdates.AutoDateLocator(maxticks=10)
+    ax.xaxis.set_major_locator(locator)
+    ax.xaxis.set_major_formatter(mdates.ConciseDateFormatter(locator))
+    _style_axes(fig, ax)
+    fig.tight_layout(pad=0.5)
+    return _png(fig)
+
+@st.cache_data(max_entries=64, ttl=CACHE_TTL, show_spinner=False)
+def _hourly_png(key, _m):
+    from matplotlib.figure import Figure
+    hourly = _m.get("hourly_distribution",{})
+    hrs = list(range(24))
+    cts = [hourly.get(h, hourly.get(str(h), 0)) for h in hrs]
+    cb  = ["#ff475780" if h<=4 else "#00d9ff60" for h in hrs]
+    ce  = ["#ff4757"   if h<=4 else "#00d9ff"   for h in hrs]
+    fig = Figure(figsize=(9,2.5)); ax = fig.subplots()
+    ax.bar(hrs,cts,color=cb,edgecolor=ce,linewidth=0.5,width=0.7)
+    ax.axvspan(-0.5,4.5,alpha=0.08,color="#ff4757")
+    ax.set_xticks(hrs)
+    _style_axes(fig, ax)
+    ax.set_xticklabels([f"{h:02d}h" for h in hrs],rotation=45,fontsize=6,color="#8892b0")
+    fig.tight_layout(pad=0.5)
+    return _png(fig)
+
+@st.cache_data(max_entries=64, ttl=CACHE_TTL, show_spinner=False)
+def _graph_png(key, _graph):
+    return base64.b64decode(_graph)
+
+# ══════════════════════════════════════════════════════
+# NAVBAR (shown on every page after login)
 # ══════════════════════════════════════════════════════
 def navbar():
-    l, _, r = st.columns([3, 4, 3])
+    l, _, r = st.columns([3, 2, 5])
     with l:
         st.markdown("""<div style='padding:10px 0 2px 0'>
           <span style='font-size:1.4rem;font-weight:900;color:#fff'>🔍 UFDR<span style='color:#00d9ff'>INSIGHT</span></span><br>
           <span style='font-size:.7rem;color:#8892b0;text-transform:uppercase;letter-spacing:.08em'>
             Forensic Intelligence Platform</span></div>""", unsafe_allow_html=True)
     with r:
-        c1,c2,c3 = st.columns(3)
+        admin = st.session_state.username in ADMINS
+        c1,c2,c3,c5,*c6,c4 = st.columns(6 if admin else 5)
         with c1:
             if st.button("🏠 Home", use_container_width=True):
                 st.session_state.result = None
@@ -80,6 +221,16 @@ def navbar():
             if st.button("🗄️ History", use_container_width=True):
                 goto("history")
         with c3:
+            if st.button("📊 Insights", use_container_width=True):
+                goto("insights")
+        with c5:
+            if st.button("💬 Messages", use_container_width=True):
+                goto("messages")
+        if admin:
+            with c6[0]:
+                if st.button("⏱️ Perf", use_container_width=True):
+                    goto("performance")
+        with c4:
             if st.button("↩️ Logout", use_container_width=True):
                 st.session_state.logged_in = False
                 st.session_state.username  = ""
@@ -150,6 +301,29 @@ def page_login():
 # ══════════════════════════════════════════════════════
 # PAGE: DASHBOARD
 # ══════════════════════════════════════════════════════
+def _analyze_via_service(step, data, file_name, description, full_log):
+    """Queues the upload on the analysis service and follows it to completion.
+    The service saves into the shared database, so History/PDFs work as usual."""
+    import service
+    phases = {"queued":  ("⏳ Queued on analysis service...", 0.2),
+              "running": ("⚙️  Analyzing on service...", 0.6)}
+    try:
+        step("📤 Uploading to analysis service...", 0.1)
+        job = service.submit(SERVICE_URL, data, user=st.session_state.username,
+                             file_name=file_name, description=description, appendix=full_log)
+        done = service.wait(SERVICE_URL, job["id"],
+                            on_status=lambda s: step(*phases[s["status"]]) if s["status"] in phases else None)
+        if done["status"] == "failed":
+            st.error(f"❌ Analysis failed: {done['error']}")
+            return None
+        step("📥 Fetching results...", 0.95)
+        r = service.job_result(SERVICE_URL, job["id"])
+    except OSError as e:
+        st.error(f"❌ Analysis service unavailable at {SERVICE_URL}: {e}")
+        return None
+    return {"metrics": r["metrics"], "summary": r["summary"], "risks": r["risks"],
+            "graph": r["graph"], "analysis_id": r["analysis_id"], "file_name": file_name}
+
 def page_dashboard():
     if not st.session_state.logged_in:
         goto("login")
@@ -184,13 +358,29 @@ def page_dashboard():
                       placeholder="e.g. iPhone extracted from suspect on Jan 15. Fraud case.",
                       key="inp_desc", height=80)
     with col3:
-        box("📁","Upload UFDR File","Drag & drop or click (.zip)")
+        box("📁","Upload UFDR File","Drag & drop or click (.zip) — several phones make one case")
         uploaded = st.file_uploader("uploader", label_visibility="collapsed",
-                   type=["zip"], key="uploader")
+                   type=["zip"], key="uploader", accept_multiple_files=True)
+
+    owners = {}
+    if uploaded and len(uploaded) > 1:
+        # the case subject's number on each phone; blank = read it from the extraction
+        ocols = st.columns(min(len(uploaded), 4))
+        for i, f in enumerate(uploaded):
+            with ocols[i % len(ocols)]:
+                num = st.text_input(f"Owner number — {f.name}", key=f"inp_owner_{i}_{f.name}",
+                                    placeholder="from extraction metadata")
+            if num.strip():
+                owners[f.name] = num.strip()
+        if SERVICE_URL:
+            st.info("Several files make one merged case, which the analysis service does not "
+                    "handle — it will be analyzed here in the app instead.")
 
     st.markdown("<br>", unsafe_allow_html=True)
     _, bcol, _ = st.columns([1,2,1])
     with bcol:
+        full_log = st.checkbox("Include full chronological evidence log as PDF appendix",
+                               key="inp_appendix")
         go = st.button("🔍  Analyze UFDR File", use_container_width=True, key="btn_analyze")
 
     if go:
@@ -209,52 +399,92 @@ def page_dashboard():
             stat.markdown(f"<div style='color:#8892b0;font-size:.85rem'>{msg}</div>",
                           unsafe_allow_html=True)
             prog.progress(val)
-            time.sleep(0.2)
 
-        step("📦 Extracting archive...", 0.1)
-        from parser import parse_ufdr
-        parsed = parse_ufdr(uploaded.read())
+        if SERVICE_URL and len(uploaded) == 1:
+            result = _analyze_via_service(step, uploaded[0].read(), file_name.strip(),
+                                          description.strip(), full_log)
+            prog.empty(); stat.empty()
+            if result:
+                st.session_state.result = result
+                st.rerun()
+            return
+
+        # Risks, summary and graph run concurrently once metrics exist;
+        # the bar advances as each stage actually finishes.
+        labels = {"parse": "📊 Aggregating metrics...",
+                  "aggregate": "🤖 Generating summary, risks & network graph..."}
+        finished = []
+        def on_stage(name, done, total):
+            finished.append(name)
+            msg = labels.get(name) or "✔ " + ", ".join(
+                n for n in finished if n not in labels) + " ready"
+            step(msg, 0.05 + 0.85 * done / total)
+
+        step("📦 Extracting archive...", 0.05)
+        from pipeline import analyze, analyze_case
+        files = [(f.name, f.read()) for f in uploaded]
+        if len(files) == 1:
+            sha = hashlib.sha256(files[0][1]).hexdigest()
+        else:
+            from case_merge import case_sha256
+            sha = case_sha256(data for _, data in files)
+        cache = _pipeline_cache()
+        ckey  = (sha, PIPELINE_VERSION, tuple(sorted(owners.items())))
+        out   = cache.get(ckey)
+        fresh = out is None
+        if fresh:
+            if len(files) == 1:
+                # a device's result is only valid against its stored case as it
+                # is now, so for those only the archive's parse is reused
+                pkey  = ("parse", sha, PIPELINE_VERSION)
+                whole = cache.get(pkey)
+                out = analyze(files[0][1], with_pdf=False, progress=on_stage,
+                              user=st.session_state.username, parsed=whole, keep_archive=True)
+                if "archive" in out and whole is None:
+                    cache.put(pkey, out["archive"], _result_size({"parsed": out["archive"]}))
+                out.pop("archive", None)
+            else:
+                out = analyze_case(files, owners=owners, with_pdf=False, progress=on_stage)
+            if "error" not in out and not out.get("device"):
+                cache.put(ckey, out, _result_size(out))
+        else:
+            step("⚡ Same archive analyzed recently — reusing results...", 0.9)
+        parsed = out["parsed"]
 
-        if parsed["messages"].empty:
+        if "error" in out:
             prog.empty(); stat.empty()
             st.error("❌ No messages found in this file.")
             with st.expander("🔍 Technical details"):
                 for e in parsed["errors"]: st.code(e)
                 st.info("Try: python generate_ufdr.py — then upload sample_ufdr.zip")
             return
+        metrics, summary, risks, graph = out["metrics"], out["summary"], out["risks"], out["graph"]
 
-        step("📊 Aggregating metrics...", 0.35)
-        from aggregator import aggregate
-        metrics = aggregate(parsed["messages"], parsed["calls"], parsed["metadata"])
-
-        step("🤖 Generating AI summary...", 0.55)
-        from ai_summary import generate_summary
-        summary = generate_summary(metrics)
-
-        step("⚠️  Detecting risk signals...", 0.72)
-        from risk_detector import detect_risks
-        risks = detect_risks(metrics)
-
-        step("🕸️  Building network graph...", 0.85)
-        from network_graph import generate_network_graph
-        graph = generate_network_graph(metrics)
-
-        step("📄  Generating PDF...", 0.95)
-        from pdf_generator import generate_pdf
-        pdf = generate_pdf(metrics, summary, risks, graph)
-
-        save_analysis(st.session_state.username, file_name.strip(),
-                      description.strip(), metrics, summary, risks, pdf)
+        step("💾  Saving analysis...", 0.95)
+        import incremental
+        if not fresh:
+            out = dict(out, spans=None, profile=None)
+        try:
+            aid, folded = incremental.save(out, st.session_state.username, file_name.strip(),
+                                           description.strip(), sha)
+        except incremental.StaleDelta:
+            prog.empty(); stat.empty()
+            st.warning("This device's case was updated while the archive was being analyzed — "
+                       "please analyze it again.")
+            return
+        from pdf_generator import evidence_rows
+        from database import iter_evidence
+        rows = None
+        if full_log:
+            rows = iter_evidence(aid) if folded else evidence_rows(parsed["messages"], parsed["calls"])
+        submit_pdf(aid, metrics, summary, risks, graph, appendix=rows)
 
-        prog.progress(1.0)
-        stat.markdown("<div style='color:#2ed573;font-size:.85rem'>✅ Done!</div>",
-                      unsafe_allow_html=True)
-        time.sleep(0.4)
         prog.empty(); stat.empty()
 
         st.session_state.result = {
             "metrics": metrics, "summary": summary, "risks": risks,
-            "graph": graph, "pdf": pdf, "file_name": file_name.strip()
+            "graph": graph, "analysis_id": aid, "file_name": file_name.strip(),
+            "folded": (out["device"]["new_messages"], out["device"]["new_calls"]) if folded else None
         }
         st.rerun()
 
@@ -272,11 +502,15 @@ def page_dashboard():
 
     m      = res["metrics"]
     graph  = res["graph"]
-    pdf    = res["pdf"]
+    aid    = res["analysis_id"]
+    ver    = res.setdefault("version", _content_version(m))
 
     st.markdown(f"<div style='text-align:right;font-size:.78rem;color:#2ed573;margin-bottom:14px'>"
                 f"✅ Analysis: <span style='color:#8892b0'>{res['file_name']}</span></div>",
                 unsafe_allow_html=True)
+    if res.get("folded"):
+        st.info(f"📲 Follow-up extraction of a device already on file — {res['folded'][0]:,} new "
+                f"messages and {res['folded'][1]:,} new calls were added to case #{aid}.")
 
     # KPI cards
     kpis = [
@@ -318,57 +552,24 @@ def page_dashboard():
                     "text-transform:uppercase;letter-spacing:.08em;margin:16px 0 10px 0;"
                     "padding-bottom:6px;border-bottom:1px solid #1a2550'>"
                     "📈 Message Volume Timeline</div>", unsafe_allow_html=True)
-        daily_raw = m.get("daily_volume",{})
-        if daily_raw:
-            df = pd.DataFrame([{"date":pd.to_datetime(k),"count":v}
-                                for k,v in daily_raw.items()]).sort_values("date")
-            fig, ax = plt.subplots(figsize=(9,3))
-            fig.patch.set_facecolor("#111936"); ax.set_facecolor("#111936")
-            avg = m.get("avg_daily_messages",0)
-            ax.axhline(avg, color="#8892b0", linestyle="--", linewidth=0.8, alpha=0.6)
-            ax.fill_between(df["date"], df["count"], alpha=0.15, color="#00d9ff")
-            ax.plot(df["date"], df["count"], color="#00d9ff", linewidth=2)
-            spike_date = m.get("spike_date")
-            if spike_date:
-                sd  = pd.to_datetime(spike_date)
-                sv  = df[df["date"].dt.date == pd.to_datetime(spike_date).date()]["count"]
-                if not sv.empty:
-                    ax.scatter([sd],[sv.values[0]],color="#ff4757",s=80,zorder=5)
-                    ax.annotate(f"SPIKE +{m.get('spike_increase_pct',0)}%",
-                        xy=(sd,sv.values[0]),xytext=(0,10),textcoords="offset points",
-                        color="#ff4757",fontsize=7,ha="center",
-                        arrowprops=dict(arrowstyle="->",color="#ff4757",lw=0.8))
-            ax.xaxis.set_major_formatter(mdates.DateFormatter("%b %d"))
-            ax.xaxis.set_major_locator(mdates.WeekdayLocator(interval=1))
-            plt.xticks(rotation=30,color="#8892b0",fontsize=7)
-            plt.yticks(color="#8892b0",fontsize=7)
-            for sp in ax.spines.values(): sp.set_edgecolor("#1a2550")
-            ax.set_ylabel("Messages",color="#8892b0",fontsize=7)
-            plt.tight_layout(pad=0.5)
-            st.pyplot(fig, use_container_width=True); plt.close()
+        from timeline import daily_series
+        days, _ = daily_series(m)
+        if len(days):
+            first, last = days[0].item(), days[-1].item()
+            zoom = (first, last)
+            if last > first:
+                zoom = st.slider("Zoom", min_value=first, max_value=last, value=(first, last),
+                                 format="MMM D, YYYY", key=f"zoom_{aid}",
+                                 label_visibility="collapsed")
+            st.image(_timeline_png((aid, PIPELINE_VERSION, ver), zoom, m), use_container_width=True)
 
         # Hourly chart
         st.markdown("<div style='font-size:.9rem;font-weight:700;color:#00d9ff;"
                     "text-transform:uppercase;letter-spacing:.08em;margin:16px 0 10px 0;"
                     "padding-bottom:6px;border-bottom:1px solid #1a2550'>"
                     "🕐 Hourly Activity</div>", unsafe_allow_html=True)
-        hourly = m.get("hourly_distribution",{})
-        if hourly:
-            hrs = list(range(24))
-            cts = [hourly.get(h,0) for h in hrs]
-            cb  = ["#ff475780" if h<=4 else "#00d9ff60" for h in hrs]
-            ce  = ["#ff4757"   if h<=4 else "#00d9ff"   for h in hrs]
-            fig2,ax2 = plt.subplots(figsize=(9,2.5))
-            fig2.patch.set_facecolor("#111936"); ax2.set_facecolor("#111936")
-            ax2.bar(hrs,cts,color=cb,edgecolor=ce,linewidth=0.5,width=0.7)
-            ax2.axvspan(-0.5,4.5,alpha=0.08,color="#ff4757")
-            ax2.set_xticks(hrs)
-            ax2.set_xticklabels([f"{h:02d}h" for h in hrs],rotation=45,fontsize=6,color="#8892b0")
-            plt.yticks(color="#8892b0",fontsize=7)
-            for sp in ax2.spines.values(): sp.set_edgecolor("#1a2550")
-            ax2.set_ylabel("Messages",color="#8892b0",fontsize=7)
-            plt.tight_layout(pad=0.5)
-            st.pyplot(fig2, use_container_width=True); plt.close()
+        if m.get("hourly_distribution"):
+            st.image(_hourly_png((aid, PIPELINE_VERSION, ver), m), use_container_width=True)
 
     with right:
         # Risk signals
@@ -414,6 +615,44 @@ def page_dashboard():
             <th style='padding:7px 8px'>Priority</th></tr></thead>
           <tbody>{rows_html}</tbody></table>""", unsafe_allow_html=True)
 
+    # Devices (merged multi-device case)
+    if m.get("devices"):
+        import pandas as pd
+        d = m.get("dedupe", {})
+        st.markdown("<br>", unsafe_allow_html=True)
+        st.markdown("<div style='font-size:.9rem;font-weight:700;color:#00d9ff;"
+                    "text-transform:uppercase;letter-spacing:.08em;margin-bottom:10px;"
+                    "padding-bottom:6px;border-bottom:1px solid #1a2550'>"
+                    "📱 Devices</div>", unsafe_allow_html=True)
+        st.dataframe(pd.DataFrame(m["devices"])[["device", "model", "owner", "messages",
+                     "duplicate_messages", "calls", "duplicate_calls", "first", "last",
+                     "top_contact", "night_pct"]], use_container_width=True, hide_index=True)
+        st.caption(f"{d.get('messages_in',0):,} messages → {d.get('messages_out',0):,} after removing "
+                   f"records seen on more than one device · {d.get('calls_in',0):,} calls → "
+                   f"{d.get('calls_out',0):,} · clock-skew window {d.get('window_s')}s")
+
+    # Call activity
+    if m.get("call_stats"):
+        import pandas as pd
+        cs = m["call_stats"]
+        st.markdown("<br>", unsafe_allow_html=True)
+        st.markdown("<div style='font-size:.9rem;font-weight:700;color:#00d9ff;"
+                    "text-transform:uppercase;letter-spacing:.08em;margin-bottom:10px;"
+                    "padding-bottom:6px;border-bottom:1px solid #1a2550'>"
+                    "📞 Call Activity</div>", unsafe_allow_html=True)
+        k1, k2, k3, k4 = st.columns(4)
+        k1.metric("Talk Time", cs["talk_time"], f"avg {cs['avg_duration_s']}s", delta_color="off")
+        k2.metric("Missed / Unanswered", f"{cs['missed'] + cs['unanswered']:,}",
+                  f"{cs['missed_pct']}%", delta_color="off")
+        k3.metric("Night Calls", f"{cs['night_calls']:,}", f"{cs['short_night_calls']:,} short",
+                  delta_color="off")
+        k4.metric("Call Bursts", f"{cs['bursts']:,}",
+                  f"longest {cs['longest_burst']['calls']} · {cs['longest_burst']['contact_name']}",
+                  delta_color="off")
+        st.dataframe(pd.DataFrame(m.get("call_contacts", []))[["contact_name", "calls", "talk_time",
+                     "avg_s", "missed", "unanswered", "night", "short_night", "bursts", "longest_run"]],
+                     use_container_width=True, hide_index=True)
+
     # Network graph
     st.markdown("<br>", unsafe_allow_html=True)
     st.markdown("<div style='font-size:.9rem;font-weight:700;color:#00d9ff;"
@@ -423,20 +662,34 @@ def page_dashboard():
     if graph:
         _, gc, _ = st.columns([1,3,1])
         with gc:
-            st.image(base64.b64decode(graph), use_container_width=True,
-                     caption="Node size = interaction volume · Edge = frequency")
+            st.image(_graph_png((aid, PIPELINE_VERSION, ver), graph), use_container_width=True,
+                     caption="Node size = interaction volume · Edge = frequency · "
+                             "Dashed = contacts active within the same minutes")
 
     # Download PDF
     st.markdown("<br>", unsafe_allow_html=True)
     _, dlc, _ = st.columns([1,2,1])
     with dlc:
-        if pdf:
+        status = get_pdf_status(aid)
+        if status == "failed":
+            st.warning("PDF generation failed — check reportlab is installed.")
+        else:
             fname = f"UFDRINSIGHT_{res['file_name'].replace(' ','_')}_{datetime.now().strftime('%Y%m%d')}.pdf"
+            # Deferred: the report is fetched (or finished) only when clicked.
             st.download_button("⬇️  Download Forensic Intelligence Report (PDF)",
-                               data=pdf, file_name=fname,
+                               data=lambda: pdf_bytes(aid), file_name=fname,
                                mime="application/pdf", use_container_width=True)
-        else:
-            st.warning("PDF generation failed — check reportlab is installed.")
+            if status != "done":
+                st.markdown("<div style='text-align:center;font-size:.75rem;color:#4a5580'>"
+                            "⏳ Report is being generated in the background</div>",
+                            unsafe_allow_html=True)
+        if st.button("💬 Browse Messages", use_container_width=True, key="dash_msgs"):
+            st.session_state.m_case = aid
+            goto("messages")
+        # Deferred like the PDF: the Parquet files are written only when clicked.
+        st.download_button("📦 Export Evidence (Parquet)", data=lambda: export_zip(aid),
+                           file_name=f"UFDRINSIGHT_{res['file_name'].replace(' ','_')}_parquet.zip",
+                           mime="application/zip", use_container_width=True, key="dash_export")
 
     st.markdown("<div style='text-align:center;padding:24px 0 10px;color:#1a2550;font-size:.7rem'>"
                 "UFDRINSIGHT · Forensic Intelligence Platform · For Authorized Use Only</div>",
@@ -457,9 +710,10 @@ def page_history():
         View, download and delete your past forensic analyses</div></div>""",
       unsafe_allow_html=True)
 
-    history = get_history(st.session_state.username)
+    user = st.session_state.username
+    total, latest = count_history(user)
 
-    if not history:
+    if not total:
         st.markdown("""<div style='text-align:center;padding:60px 0;color:#2a3060'>
           <div style='font-size:3.5rem'>🗄️</div>
           <div style='margin-top:10px;font-size:.9rem;color:#4a5580'>No analyses yet.</div>
@@ -472,10 +726,25 @@ def page_history():
         return
 
     st.markdown(f"<div style='margin-bottom:16px;font-size:.8rem;color:#4a5580'>"
-                f"<span style='color:#00d9ff;font-weight:600'>{len(history)}</span> analyses · "
-                f"Latest: <span style='color:#8892b0'>{history[0]['analyzed_at']}</span></div>",
+                f"<span style='color:#00d9ff;font-weight:600'>{total}</span> analyses · "
+                f"Latest: <span style='color:#8892b0'>{latest}</span></div>",
                 unsafe_allow_html=True)
 
+    # ── Filters + keyset paging ────────────────────────
+    f1, f2, f3 = st.columns([2,1,1])
+    with f1: search = st.text_input("Search name or description", key="h_search")
+    with f2: dfrom  = st.date_input("From", value=None, key="h_from")
+    with f3: dto    = st.date_input("To",   value=None, key="h_to")
+    filt = (search, dfrom, dto)
+    if st.session_state.get("h_filter") != filt:
+        st.session_state.h_filter  = filt
+        st.session_state.h_cursors = [None]      # cursor stack: one per visited page
+    cursors = st.session_state.h_cursors
+    history, next_cursor = get_history_page(user, cursor=cursors[-1], search=search.strip(),
+                                            date_from=dfrom, date_to=dto)
+    if not history:
+        st.info("No analyses match these filters.")
+
     for item in history:
         m   = item.get("metrics",{})
         rid = item["id"]
@@ -490,6 +759,8 @@ def page_history():
             💬 <span style='color:#00d9ff'>{m.get('total_messages','—')}</span> messages &nbsp;·&nbsp;
             📞 <span style='color:#00d9ff'>{m.get('total_calls','—')}</span> calls &nbsp;·&nbsp;
             👤 <span style='color:#00d9ff'>{m.get('unique_contacts','—')}</span> contacts
+            {"&nbsp;·&nbsp; 🧊 <span title='In cold storage — restored when opened'>archived</span>"
+             if item.get("archived") else ""}
           </div></div>""", unsafe_allow_html=True)
 
         with st.expander("📄 View Summary & Risks"):
@@ -511,12 +782,16 @@ def page_history():
                             f"<br><span style='color:#8892b0'>{r['detail']}</span></div>",
                             unsafe_allow_html=True)
 
-        a1, a2 = st.columns([2,1])
+        a1, a3, a2 = st.columns([2,1,1])
+        with a3:
+            if st.button("💬 Messages", key=f"msg_{rid}", use_container_width=True):
+                st.session_state.m_case = rid
+                goto("messages")
         with a1:
-            pdf_data = get_pdf(rid)
-            if pdf_data:
+            if item["pdf_status"] != "failed":
+                # Deferred: the blob is opened only when this button is clicked.
                 st.download_button("⬇️ Download PDF",
-                    data=pdf_data,
+                    data=lambda rid=rid: pdf_bytes(rid),
                     file_name=f"UFDRINSIGHT_{item['file_name'].replace(' ','_')}.pdf",
                     mime="application/pdf",
                     key=f"dl_{rid}", use_container_width=True)
@@ -530,10 +805,256 @@ def page_history():
         st.markdown("<hr style='border-color:#1a2550;margin:6px 0 14px 0'>",
                     unsafe_allow_html=True)
 
+    p1, pc, p2 = st.columns([1,2,1])
+    with p1:
+        if len(cursors) > 1 and st.button("← Newer", use_container_width=True):
+            cursors.pop(); st.rerun()
+    with pc:
+        st.markdown(f"<div style='text-align:center;font-size:.78rem;color:#4a5580;padding-top:8px'>"
+                    f"Page {len(cursors)}</div>", unsafe_allow_html=True)
+    with p2:
+        if next_cursor and st.button("Older →", use_container_width=True):
+            cursors.append(next_cursor); st.rerun()
+
     st.markdown("<div style='text-align:center;padding:20px 0 8px;color:#1a2550;font-size:.7rem'>"
                 "UFDRINSIGHT · Forensic Intelligence Platform · For Authorized Use Only</div>",
                 unsafe_allow_html=True)
 
+# ══════════════════════════════════════════════════════
+# PAGE: MESSAGE BROWSER
+# ══════════════════════════════════════════════════════
+# A follow-up extraction folded into a case appends evidence under the same
+# id and restamps analyzed_at, so per-case lookups cache on (id, analyzed_at).
+@st.cache_data(max_entries=32, ttl=CACHE_TTL, show_spinner=False)
+def _case_contacts(aid, stamp):
+    return [(name, n) for name, n, *_ in contact_activity(aid) if n]
+
+@st.cache_data(max_entries=32, ttl=CACHE_TTL, show_spinner=False)
+def _case_directions(aid, stamp):
+    return message_directions(aid)
+
+def page_messages():
+    if not st.session_state.logged_in:
+        goto("login")
+
+    navbar()
+
+    st.markdown("""<div style='text-align:center;padding:0 0 24px 0'>
+      <div style='font-size:1.7rem;font-weight:800;color:#fff'>💬 Message Browser</div>
+      <div style='font-size:.9rem;color:#8892b0;margin-top:6px'>
+        Page through the stored evidence of a case — only the visible page is fetched</div></div>""",
+      unsafe_allow_html=True)
+
+    user = st.session_state.username
+    cases, _ = get_history_page(user, limit=100)
+    labels = {c["id"]: f"{c['file_name']} · {c['analyzed_at']}" for c in cases}
+    stamps = {c["id"]: c["analyzed_at"] for c in cases}
+    want = st.session_state.get("m_case")
+    if want is not None and want not in labels:
+        rec = get_analysis(want) if analysis_owner(want) == user else None
+        if rec:
+            labels[want] = f"{rec['file_name']} · {rec['analyzed_at']}"
+            stamps[want] = rec["analyzed_at"]
+        else:   st.session_state.pop("m_case")
+    if not labels:
+        st.info("No analyses yet — analyze a UFDR file first.")
+        return
+    aid = st.selectbox("Case", list(labels), format_func=labels.get, key="m_case")
+
+    f1, f2, f3, f4, f5 = st.columns([2,1,1,1,2])
+    contacts = _case_contacts(aid, stamps[aid])
+    with f1: contact = st.selectbox("Contact", [None] + [c for c, _ in contacts], key="m_contact",
+                                    format_func=lambda c: "All contacts" if c is None else
+                                    f"{c} ({dict(contacts)[c]})")
+    with f2: direction = st.selectbox("Direction", [None] + _case_directions(aid, stamps[aid]),
+                                      key="m_dir",
+                                      format_func=lambda d: "All" if d is None else d.title())
+    with f3: dfrom = st.date_input("From", value=None, key="m_from")
+    with f4: dto   = st.date_input("To",   value=None, key="m_to")
+    with f5: keyword = st.text_input("Keyword", key="m_kw").strip()
+    size = st.radio("Rows per page", [50, 100, 250], index=1, horizontal=True, key="m_size")
+
+    filt = (aid, contact, direction, dfrom, dto, keyword, size)
+    if st.session_state.get("m_filter") != filt:
+        st.session_state.m_filter  = filt
+        st.session_state.m_cursors = [None]      # cursor stack: one per visited page
+    cursors = st.session_state.m_cursors
+    rows, next_cursor = query_messages(aid, contact=contact, start=dfrom, end=dto,
+                                       direction=direction, keyword=keyword or None,
+                                       after=cursors[-1], limit=size)
+    if not rows:
+        if not contacts and len(cursors) == 1:
+            st.info("No stored messages for this case (analyzed before evidence was kept).")
+        else:
+            st.info("No messages match these filters.")
+    else:
+        first = (len(cursors) - 1) * size + 1
+        st.markdown(f"<div style='font-size:.78rem;color:#4a5580;margin-bottom:6px'>"
+                    f"Messages {first:,}–{first + len(rows) - 1:,}</div>", unsafe_allow_html=True)
+        st.dataframe([{k: r[k] for k in ("timestamp","contact_name","direction","type","body")}
+                      for r in rows], hide_index=True, use_container_width=True,
+                     height=min(38 + 35 * len(rows), 640),
+                     column_config={"timestamp": "Time", "contact_name": "Contact",
+                                    "direction": "Direction", "type": "Type",
+                                    "body": st.column_config.TextColumn("Message", width="large")})
+
+    p1, pc, p2 = st.columns([1,2,1])
+    with p1:
+        if len(cursors) > 1 and st.button("← Previous", use_container_width=True):
+            cursors.pop(); st.rerun()
+    with pc:
+        st.markdown(f"<div style='text-align:center;font-size:.78rem;color:#4a5580;padding-top:8px'>"
+                    f"Page {len(cursors)}</div>", unsafe_allow_html=True)
+    with p2:
+        if next_cursor and st.button("Next →", use_container_width=True):
+            cursors.append(next_cursor); st.rerun()
+
+# ══════════════════════════════════════════════════════
+# PAGE: CROSS-CASE INSIGHTS
+# ══════════════════════════════════════════════════════
+def page_insights():
+    if not st.session_state.logged_in:
+        goto("login")
+
+    navbar()
+
+    st.markdown("""<div style='text-align:center;padding:0 0 24px 0'>
+      <div style='font-size:1.7rem;font-weight:800;color:#fff'>📊 Cross-Case Insights</div>
+      <div style='font-size:.9rem;color:#8892b0;margin-top:6px'>
+        Aggregates across all of your analyses</div></div>""",
+      unsafe_allow_html=True)
+
+    missing = missing_stats_count()
+    if missing:
+        st.info(f"{missing} older analyses are not indexed yet.")
+        if st.button("Index older analyses"):
+            with st.spinner("Backfilling..."):
+                backfill_stats()
+            st.rerun()
+
+    f1, f2, f3 = st.columns(3)
+    with f1:
+        period = st.selectbox("Period", ["All time","This quarter","Last 30 days"], key="x_period")
+    with f2:
+        min_night = st.slider("Min. night activity %", 0, 100, 0, key="x_night")
+    with f3:
+        flags = ["Any"] + sorted({f for f, _, _ in flag_frequencies(username=st.session_state.username)})
+        flag = st.selectbox("Risk flag", flags, key="x_flag")
+    now = datetime.now()
+    since = {"This quarter": datetime(now.year, 3*((now.month-1)//3)+1, 1).strftime("%Y-%m-%d"),
+             "Last 30 days": (now - timedelta(days=30)).strftime("%Y-%m-%d")}.get(period)
+    filters = dict(username=st.session_state.username, since=since,
+                   min_night_pct=min_night or None, flag=None if flag == "Any" else flag)
+
+    agg = cross_case_summary(**filters)
+    kpis = [("Cases", agg["cases"]), ("Avg Messages / Case", agg["avg_messages"]),
+            ("Total Messages", agg["total_messages"]), ("Avg Night %", agg["avg_night_pct"]),
+            ("Max Night %", agg["max_night_pct"]), ("High-Risk Cases", agg["high_risk_cases"])]
+    for col, (lbl, val) in zip(st.columns(6), kpis):
+        with col:
+            st.markdown(f"""<div style='background:#111936;border:1px solid #1a2550;
+              border-radius:8px;padding:14px 10px;text-align:center;border-top:3px solid #00d9ff'>
+              <div style='font-size:1.6rem;font-weight:700;color:#00d9ff;line-height:1'>{val}</div>
+              <div style='font-size:.68rem;color:#8892b0;margin-top:4px;
+                text-transform:uppercase;letter-spacing:.05em'>{lbl}</div></div>""",
+              unsafe_allow_html=True)
+
+    st.markdown("<br>", unsafe_allow_html=True)
+    left, right = st.columns([3,2])
+    with left:
+        st.markdown("<div style='font-size:.9rem;font-weight:700;color:#00d9ff;"
+                    "text-transform:uppercase;letter-spacing:.08em;margin-bottom:10px;"
+                    "padding-bottom:6px;border-bottom:1px solid #1a2550'>"
+                    "🗂️ Matching Cases</div>", unsafe_allow_html=True)
+        cases = cross_case_list(**filters)
+        if cases:
+            st.dataframe([{k: v for k, v in c.items() if k != "id"} for c in cases], hide_index=True,
+                         use_container_width=True)
+        else:
+            st.markdown("<div style='color:#4a5580;font-size:.85rem'>No matching cases.</div>",
+                        unsafe_allow_html=True)
+    with right:
+        st.markdown("<div style='font-size:.9rem;font-weight:700;color:#00d9ff;"
+                    "text-transform:uppercase;letter-spacing:.08em;margin-bottom:10px;"
+                    "padding-bottom:6px;border-bottom:1px solid #1a2550'>"
+                    "⚠️ Flag Frequency</div>", unsafe_allow_html=True)
+        sc = {"HIGH":"#ff4757","MEDIUM":"#ffa502","INFO":"#00d9ff"}
+        for f, sev, n in flag_frequencies(**filters):
+            col = sc.get(sev, "#00d9ff")
+            st.markdown(f"<div style='border-left:3px solid {col};padding:6px 12px;margin:5px 0;"
+                        f"background:#111936;border-radius:0 6px 6px 0;font-size:.8rem'>"
+                        f"<strong style='color:{col}'>{f}</strong> "
+                        f"<span style='color:#8892b0'>[{sev}] · {n} cases</span></div>",
+                        unsafe_allow_html=True)
+
+    st.markdown("<div style='text-align:center;padding:20px 0 8px;color:#1a2550;font-size:.7rem'>"
+                "UFDRINSIGHT · Forensic Intelligence Platform · For Authorized Use Only</div>",
+                unsafe_allow_html=True)
+
+# ══════════════════════════════════════════════════════
+# PAGE: PERFORMANCE (admins)
+# ══════════════════════════════════════════════════════
+def page_performance():
+    if not st.session_state.logged_in:
+        goto("login")
+    if st.session_state.username not in ADMINS:
+        goto("dashboard")
+
+    navbar()
+
+    st.markdown("""<div style='text-align:center;padding:0 0 24px 0'>
+      <div style='font-size:1.7rem;font-weight:800;color:#fff'>⏱️ Pipeline Performance</div>
+      <div style='font-size:.9rem;color:#8892b0;margin-top:6px'>
+        Stage timings recorded with every analysis · set UFDR_PROFILE=cpu,mem for profiles</div></div>""",
+      unsafe_allow_html=True)
+
+    def heading(txt):
+        st.markdown("<div style='font-size:.9rem;font-weight:700;color:#00d9ff;"
+                    "text-transform:uppercase;letter-spacing:.08em;margin-bottom:10px;"
+                    "padding-bottom:6px;border-bottom:1px solid #1a2550'>" + txt + "</div>",
+                    unsafe_allow_html=True)
+
+    stages = stage_breakdown()
+    if not stages:
+        st.info("No timings yet — they are recorded for analyses run from now on.")
+        return
+    heading("📊 Stage Breakdown")
+    st.dataframe(stages, hide_index=True, use_container_width=True,
+                 column_config={"avg_wall_s": "Avg wall s", "max_wall_s": "Max wall s",
+                                "avg_cpu_s": "Avg CPU s", "s_per_1k_msgs": "Wall s / 1k msgs",
+                                "max_rss_mb": "Peak RSS MB"})
+
+    st.markdown("<br>", unsafe_allow_html=True)
+    left, right = st.columns([3,2])
+    with left:
+        heading("🐢 Slowest Cases")
+        stage = st.selectbox("Ranked by", [s["stage"] for s in stages], key="perf_stage",
+                             index=[s["stage"] for s in stages].index("total")
+                             if any(s["stage"] == "total" for s in stages) else 0)
+        slow = slowest_analyses(stage, limit=25)
+        st.dataframe(slow, hide_index=True, use_container_width=True)
+    with right:
+        heading("🔬 Case Detail")
+        if slow:
+            aid = st.selectbox("Case", [r["id"] for r in slow], key="perf_case",
+                               format_func=lambda i: next(f"#{r['id']} {r['file_name']}"
+                                                          for r in slow if r["id"] == i))
+            spans, profile = get_timings(aid)
+            for r in spans:
+                depth = r["stage"].count("/")
+                name  = r["stage"].rsplit("/", 1)[-1]
+                extra = f" · {r['alloc_mb']} MB alloc" if r["alloc_mb"] is not None else ""
+                st.markdown(f"<div style='padding:3px 0 3px {12 + 18 * depth}px;font-size:.8rem;"
+                            f"border-left:3px solid {'#00d9ff' if not depth else '#1a2550'};"
+                            f"background:#111936;margin:2px 0'>"
+                            f"<strong style='color:#ccd6f6'>{name}</strong> "
+                            f"<span style='color:#8892b0'>{r['wall_s']:.3f}s wall · "
+                            f"{r['cpu_s'] or 0:.3f}s cpu · +{r['start_s'] or 0:.2f}s{extra}</span></div>",
+                            unsafe_allow_html=True)
+            if profile:
+                with st.expander("cProfile (top functions by cumulative time)"):
+                    st.code(profile, language=None)
+
 # ══════════════════════════════════════════════════════
 # ROUTER
 # ══════════════════════════════════════════════════════
@@ -541,4 +1062,7 @@ page = st.session_state.page
 if page == "login":     page_login()
 elif page == "dashboard": page_dashboard()
 elif page == "history":   page_history()
+elif page == "insights":  page_insights()
+elif page == "messages":  page_messages()
+elif page == "performance": page_performance()
 else:                     page_login()
@@ -0,0 +1,252 @@
+"""
+batch.py — Headless bulk analysis of UFDR archives.
+Walks directories (or a manifest) for .zip extractions, analyzes them in a
+process pool and saves results through incremental.save in batched
+transactions; a newer extraction of a phone already on file is folded into
+that case. Archives whose SHA-256 is already stored are skipped, so an
+interrupted run resumes where it stopped.
+
+Run: python batch.py extractions/ --user admin --workers 8
+     python batch.py --manifest cases.csv     (path[,file_name[,description]])
+     python batch.py extractions/ --service http://127.0.0.1:8765
+     python batch.py extractions/ --ai-rpm 15 --ai-tpm 250000 --ai-concurrency 4
+
+With GEMINI_API_KEY set, workers save the template summary and the parent
+feeds each saved case to summary_queue.py, which replaces it with the model's
+answer under the given rate limits.
+"""
+import argparse, csv, hashlib, os, sys, time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+def find_archives(paths, manifest=None):
+    """[(path, file_name, description)] from directories/files and an optional
+    manifest (one path per line, or CSV path,file_name,description)."""
+    out = []
+    for p in paths:
+        if os.path.isdir(p):
+            for root, _, files in sorted(os.walk(p)):
+                out += [(os.path.join(root, f), None, None) for f in sorted(files)
+                        if f.lower().endswith(".zip")]
+        elif os.path.isfile(p):
+            out.append((p, None, None))
+        else:
+            print(f"[Batch] Skipping missing path: {p}")
+    if manifest:
+        base = os.path.dirname(os.path.abspath(manifest))
+        with open(manifest, newline="", encoding="utf-8") as f:
+            for row in csv.reader(f):
+                if not row or not row[0].strip() or row[0].startswith("#"):
+                    continue
+                path = row[0].strip()
+                if not os.path.isabs(path):
+                    path = os.path.join(base, path)
+                out.append((path, (row[1].strip() or None) if len(row) > 1 else None,
+                            row[2].strip() if len(row) > 2 else None))
+    return out
+
+def sha256_file(path, chunk=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for b in iter(lambda: f.read(chunk), b""):
+            h.update(b)
+    return h.hexdigest()
+
+def _work(path, with_pdf, appendix, keep_evidence, ai=True, user=None):
+    """Runs in a pool process; returns only picklable results."""
+    from pipeline import analyze
+    t0 = time.perf_counter()
+    with open(path, "rb") as f:
+        res = analyze(f.read(), with_pdf=with_pdf, appendix=appendix, ai=ai, user=user)
+    res.pop("graph", None)
+    if not keep_evidence:
+        res.pop("parsed", None)
+    res["timings"]["total"] = round(time.perf_counter() - t0, 4)
+    res["work_args"] = (with_pdf, appendix, keep_evidence, ai, user)
+    return res
+
+def _flush(pending, user, summaries=None, pool=None):
+    """Writes finished results in one transaction, then hands the saved cases
+    to the summary queue, if any. Follow-up extractions are folded into their
+    device's case; one whose case moved on since the worker read it (two
+    extractions of a phone in one run) is analyzed again once the others are
+    committed — in `pool` when given — and saved on its own. Returns how many
+    of those failed."""
+    import database, incremental
+    batch, saved, stale, failed = list(pending), [], [], 0
+    pending.clear()                     # never flushed twice, even if this raises
+    with database.transaction():
+        for item, sha, res in batch:
+            try:
+                saved.append(_save(item, sha, res, user))
+            except incremental.StaleDelta:
+                stale.append((item, sha, res["work_args"]))
+    for item, sha, work_args in stale:
+        try:
+            for attempt in range(3):
+                fut = pool.submit(_work, item[0], *work_args) if pool else None
+                res = fut.result() if fut else _work(item[0], *work_args)
+                try:
+                    saved.append(_save(item, sha, res, user))
+                    break
+                except incremental.StaleDelta:
+                    if attempt == 2:
+                        raise
+        except Exception as e:
+            failed += 1
+            print(f"[Batch] FAILED {item[0]} (re-analysis of a follow-up): {e}")
+    if summaries:
+        for aid, metrics in saved:
+            summaries.submit(aid, metrics)
+    return failed
+
+def _save(item, sha, res, user):
+    import incremental
+    path, name, desc = item
+    aid, folded = incremental.save(res, user, name or os.path.splitext(os.path.basename(path))[0],
+                                   desc or f"Batch import: {path}", sha)
+    if folded:
+        print(f"[Batch] {os.path.basename(path)}: folded {res['device']['new_messages']} "
+              f"new messages into analysis #{aid}")
+    return aid, res["metrics"]
+
+def run(items, user="admin", workers=None, commit_every=20, with_pdf=True, appendix=False,
+        keep_evidence=True, ai_limits=None):
+    """ai_limits: SummaryQueue kwargs (rpm, tpm, concurrency); None calls the
+    model inline in each worker, unthrottled."""
+    import database
+    t_start = time.perf_counter()
+    summaries = None
+    if ai_limits is not None:
+        from ai_summary import api_key
+        if api_key():
+            from summary_queue import SummaryQueue
+            summaries = SummaryQueue(**ai_limits)
+            # Reports would be rendered with the template text; build them on download.
+            with_pdf = False
+        else:
+            print("[Batch] GEMINI_API_KEY not set — saving template summaries")
+    hashed  = [(it, sha256_file(it[0])) for it in items]
+    done    = database.processed_archives((sha for _, sha in hashed), user)
+    todo, seen = [], set(done)
+    for it, sha in hashed:
+        if sha in seen:
+            why = "already analyzed" if sha in done else "duplicate in this run"
+            print(f"[Batch] skip ({why}) {it[0]}")
+        else:
+            seen.add(sha); todo.append((it, sha))
+    print(f"[Batch] {len(todo)} to analyze, {len(hashed) - len(todo)} skipped, "
+          f"{workers or os.cpu_count()} workers")
+
+    pending, ok, failed, n_msgs = [], 0, 0, 0
+    import startup
+    with ProcessPoolExecutor(max_workers=workers, initializer=startup.warm,
+                             initargs=(startup.WORKER_STEPS, False)) as pool:
+        futs = {pool.submit(_work, it[0], with_pdf, appendix, keep_evidence, summaries is None, user):
+                (it, sha)
+                for it, sha in todo}
+        try:
+            for i, fut in enumerate(as_completed(futs), 1):
+                it, sha = futs[fut]
+                try:
+                    res = fut.result()
+                except Exception as e:
+                    failed += 1
+                    print(f"[Batch] {i}/{len(todo)} FAILED {it[0]}: {e}")
+                    continue
+                if res.get("error"):
+                    failed += 1
+                    print(f"[Batch] {i}/{len(todo)} FAILED {it[0]}: {res['error']}")
+                    continue
+                ok += 1
+                n_msgs += res["metrics"].get("total_messages", 0)
+                stages = " ".join(f"{k}={v:.2f}s" for k, v in res["timings"].items())
+                print(f"[Batch] {i}/{len(todo)} {os.path.basename(it[0])}: "
+                      f"{res['metrics'].get('total_messages', 0)} msgs  {stages}")
+                pending.append((it, sha, res))
+                if len(pending) >= commit_every:
+                    n = _flush(pending, user, summaries, pool)
+                    ok, failed = ok - n, failed + n
+        except KeyboardInterrupt:
+            print("[Batch] Interrupted — saving finished results; re-run to resume.")
+            for f in futs: f.cancel()
+        finally:
+            if pending:
+                n = _flush(pending, user, summaries, pool)
+                ok, failed = ok - n, failed + n
+
+    if summaries:
+        print("[Batch] Waiting for AI summaries…")
+        s = summaries.join()
+        print(f"[Batch] summaries: {s['done']} generated, {s['cached']} cached, "
+              f"{s['failed']} kept template, {s['retries']} retries, "
+              f"{s['throttled_s']:.1f}s throttled")
+    wall = time.perf_counter() - t_start
+    print(f"[Batch] {ok} analyzed, {failed} failed in {wall:.1f}s — "
+          f"{ok / wall if wall else 0:.2f} archives/s, {n_msgs / wall if wall else 0:,.0f} msgs/s")
+    return ok, failed
+
+def run_service(items, url, user="admin", with_pdf=True):
+    """Queues archives on a running service.py instead of a local pool; the
+    service dedupes already-analyzed archives and pushes back when full."""
+    import service
+    t_start = time.perf_counter()
+    jobs, seen = [], set()
+    for it in items:
+        sha = sha256_file(it[0])
+        if sha in seen:
+            print(f"[Batch] skip (duplicate in this run) {it[0]}"); continue
+        seen.add(sha)
+        path, name, desc = it
+        with open(path, "rb") as f:
+            job = service.submit(url, f.read(), user=user,
+                                 file_name=name or os.path.splitext(os.path.basename(path))[0],
+                                 description=desc or f"Batch import: {path}", pdf=with_pdf)
+        if job.get("skipped"):
+            print(f"[Batch] skip (already analyzed) {path}")
+        else:
+            jobs.append((path, job["id"]))
+    print(f"[Batch] {len(jobs)} queued on {url}")
+
+    ok = failed = 0
+    for i, (path, job_id) in enumerate(jobs, 1):
+        st = service.wait(url, job_id)
+        if st["status"] == "done":
+            ok += 1
+            stages = " ".join(f"{k}={v:.2f}s" for k, v in st["timings"].items())
+            print(f"[Batch] {i}/{len(jobs)} {os.path.basename(path)}: #{st['analysis_id']}  {stages}")
+        else:
+            failed += 1
+            print(f"[Batch] {i}/{len(jobs)} FAILED {path}: {st['error']}")
+    print(f"[Batch] {ok} analyzed, {failed} failed in {time.perf_counter() - t_start:.1f}s")
+    return ok, failed
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("paths", nargs="*", help="archives or directories to scan for .zip files")
+    ap.add_argument("--manifest", help="text/CSV file: path[,file_name[,description]] per line")
+    ap.add_argument("--user", default="admin", help="owner of the saved analyses")
+    ap.add_argument("--workers", type=int, default=None, help="pool size (default: CPU count)")
+    ap.add_argument("--commit-every", type=int, default=20, help="analyses per DB transaction")
+    ap.add_argument("--no-pdf", action="store_true", help="skip reports (built lazily on download)")
+    ap.add_argument("--appendix", action="store_true", help="include the full evidence log in PDFs")
+    ap.add_argument("--no-evidence", action="store_true", help="don't persist parsed rows")
+    ap.add_argument("--service", metavar="URL", help="submit to a running service.py instead")
+    ap.add_argument("--ai-rpm", type=int, default=15, help="model requests per minute")
+    ap.add_argument("--ai-tpm", type=int, default=250_000, help="model tokens per minute")
+    ap.add_argument("--ai-concurrency", type=int, default=4, help="model calls in flight")
+    args = ap.parse_args(argv)
+    items = find_archives(args.paths, args.manifest)
+    if not items:
+        ap.error("no archives found")
+    if args.service:
+        ok, failed = run_service(items, args.service, user=args.user, with_pdf=not args.no_pdf)
+        return 1 if failed and not ok else 0
+    ok, failed = run(items, user=args.user, workers=args.workers, commit_every=args.commit_every,
+                     with_pdf=not args.no_pdf, appendix=args.appendix,
+                     keep_evidence=not args.no_evidence,
+                     ai_limits={"rpm": args.ai_rpm, "tpm": args.ai_tpm,
+                                "concurrency": args.ai_concurrency})
+    return 1 if failed and not ok else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,98 @@
+"""
+bench_db.py — Concurrency benchmark for the database layer.
+Simulates N analysts hammering history/status/lookup reads with periodic
+saves, comparing the pooled WAL layer against connect-per-call with the
+default rollback journal (the previous access pattern).
+
+Run: python bench_db.py --analysts 1 4 16 32 --seconds 5
+"""
+import argparse, json, os, random, shutil, sqlite3, tempfile, threading, time
+import database
+
+READ_RATIO = 0.9   # 9 reads per write, roughly what the UI does
+
+def _seed(n_rows, users):
+    metrics = {"total_messages": 500, "total_calls": 20, "unique_contacts": 5,
+               "daily_volume": {f"2024-01-{d:02d}": d for d in range(1, 31)}}
+    with database.transaction() as con:
+        for i in range(n_rows):
+            con.execute("""INSERT INTO analyses(username,file_name,description,analyzed_at,
+                metrics_json,summary,risks_json,pdf_status) VALUES(?,?,?,?,?,?,?,?)""",
+                (random.choice(users), f"case{i}", "", f"2024-01-01 00:00:{i % 60:02d}",
+                 json.dumps(metrics), "summary", "[]", "done"))
+
+def _pooled_ops(user):
+    if random.random() < READ_RATIO:
+        r = random.random()
+        if r < 0.5:   database.get_history(user)
+        elif r < 0.8: database.get_pdf_status(random.randint(1, 200))
+        else:         database.login_user(user, "x")
+    else:
+        database.save_analysis(user, "bench", "", {"total_messages": 1}, "s", [])
+
+def _legacy_ops(user, path):
+    con = sqlite3.connect(path, timeout=30)
+    try:
+        if random.random() < READ_RATIO:
+            r = random.random()
+            if r < 0.5:
+                rows = con.execute("SELECT id,file_name,description,analyzed_at,metrics_json,"
+                                   "summary,risks_json FROM analyses WHERE username=? "
+                                   "ORDER BY analyzed_at DESC", (user,)).fetchall()
+                [database._analysis_dict(r) for r in rows]
+            elif r < 0.8:
+                con.execute("SELECT pdf_status FROM analyses WHERE id=?",
+                            (random.randint(1, 200),)).fetchone()
+            else:
+                con.execute("SELECT id FROM users WHERE username=? AND password=?",
+                            (user, "x")).fetchone()
+        else:
+            con.execute("INSERT INTO analyses(username,file_name,description,analyzed_at,"
+                        "metrics_json,summary,risks_json) VALUES(?,?,?,?,?,?,?)",
+                        (user, "bench", "", time.strftime("%Y-%m-%d %H:%M:%S"),
+                         '{"total_messages":1}', "s", "[]"))
+            con.commit()
+    finally:
+        con.close()
+
+def _run(n_threads, seconds, op):
+    stop, counts, errors = time.perf_counter() + seconds, [0] * n_threads, [0]
+    def worker(i):
+        user = f"analyst{i % 8}"
+        while time.perf_counter() < stop:
+            try: op(user); counts[i] += 1
+            except sqlite3.OperationalError: errors[0] += 1
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(n_threads)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    return sum(counts) / seconds, errors[0]
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--analysts", type=int, nargs="+", default=[1, 4, 16, 32])
+    ap.add_argument("--seconds",  type=float, default=3.0)
+    ap.add_argument("--rows",     type=int, default=2000, help="pre-seeded analyses")
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="ufdr_bench_")
+    try:
+        database.DB = os.path.join(tmp, "pooled.db")
+        _seed(args.rows, [f"analyst{i}" for i in range(8)])
+        legacy = os.path.join(tmp, "legacy.db")
+        src = sqlite3.connect(database.DB); dst = sqlite3.connect(legacy)
+        src.backup(dst); src.close()
+        dst.execute("PRAGMA journal_mode=DELETE")
+        dst.execute("DROP INDEX IF EXISTS idx_analyses_user_time"); dst.close()
+
+        print(f"{'analysts':>8} | {'pooled+WAL ops/s':>16} | {'legacy ops/s':>12} | speed-up")
+        print("-" * 56)
+        for n in args.analysts:
+            pooled, e1 = _run(n, args.seconds, _pooled_ops)
+            old,    e2 = _run(n, args.seconds, lambda u: _legacy_ops(u, legacy))
+            err = f"  (busy errors: {e1}/{e2})" if e1 or e2 else ""
+            print(f"{n:>8} | {pooled:>16,.0f} | {old:>12,.0f} | {pooled / max(old, 1):>6.1f}x{err}")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""
+bench_pipeline.py — Performance budgets for the analysis stages.
+Runs parse_ufdr → aggregate → generate_network_graph → generate_pdf over
+fixed, seeded corpora from generate_ufdr.py (1k to 10M messages) and records
+wall time, peak RSS and throughput per stage. Every corpus runs in a fresh
+process so memory numbers don't bleed between sizes. The parser still builds
+whole XML trees: 1m peaks around 2 GB, so 10m needs a large machine.
+
+A run is compared with a saved baseline: a stage slower than its threshold
+allows, a process that peaks higher than the RSS threshold, or any change to
+the metrics dict (SHA-256 of its canonical JSON) fails with exit code 1, so
+an optimization can't quietly change what investigators see. The metrics are
+also checked against the generator's ground truth.
+
+Run: python bench_pipeline.py --save                      (record bench_baseline.json)
+     python bench_pipeline.py                             (compare with it)
+     python bench_pipeline.py --sizes 1k 100k 1m 10m --repeat 1 --threshold parse=0.3
+"""
+import argparse, contextlib, hashlib, io, json, os, platform, subprocess, sys, tempfile, time
+
+SIZES    = {"1k": 1_000, "10k": 10_000, "100k": 100_000, "1m": 1_000_000, "10m": 10_000_000}
+STAGES   = ("parse", "aggregate", "graph", "pdf")
+SEED     = 2024
+BASELINE = "bench_baseline.json"
+SLOWDOWN = 0.20      # default allowed wall-time growth per stage
+RSS_GROW = 0.25      # allowed growth of the process's peak RSS
+NOISE_S  = 0.10      # slowdowns smaller than this are timer noise, not regressions
+
+def _corpus_args(n):
+    return dict(seed=SEED, messages=n, calls=max(n // 25, 20), contacts=min(5 + n // 2000, 5000),
+                days=365, members=max(1, n // 2_000_000), dialect="standard", level=1)
+
+def corpus(label, directory):
+    """Path and id of the corpus for a size label, generated on first use. The
+    id covers the generator's source, so a changed generator gets new files."""
+    import generate_ufdr
+    with open(generate_ufdr.__file__, "rb") as f:
+        gen = hashlib.sha256(f.read()).hexdigest()[:8]
+    cid  = f"{label}-s{SEED}-g{gen}"
+    path = os.path.join(directory, cid + ".zip")
+    if not os.path.exists(path):
+        os.makedirs(directory, exist_ok=True)
+        print(f"[Bench] generating {label} corpus → {path}")
+        generate_ufdr.generate(path + ".part", **_corpus_args(SIZES[label]))
+        os.replace(path + ".part.truth.json", path + ".truth.json")
+        os.replace(path + ".part", path)
+    return path, cid
+
+def digest(metrics):
+    return hashlib.sha256(json.dumps(metrics, sort_keys=True, default=str).encode()).hexdigest()
+
+def _peak_mb():
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / 1024
+
+def _child(path, repeat):
+    """Runs in a fresh interpreter; prints one JSON line. Libraries are warmed
+    the way pool workers are, so stages are timed at steady state."""
+    import startup
+    startup.warm(startup.WORKER_STEPS, False)
+    from parser import parse_ufdr
+    from aggregator import aggregate
+    from network_graph import generate_network_graph
+    from pdf_generator import generate_pdf
+    from risk_detector import detect_risks
+    from ai_summary import template_summary
+    with open(path, "rb") as f:
+        data = f.read()
+    base, stages = _peak_mb(), {}
+
+    def stage(name, fn, *a):
+        before, best, v = _peak_mb(), None, None
+        for _ in range(repeat):
+            v = None
+            with contextlib.redirect_stdout(io.StringIO()):
+                t0 = time.perf_counter()
+                v  = fn(*a)
+                dt = time.perf_counter() - t0
+            best = dt if best is None else min(best, dt)
+        stages[name] = {"wall_s": round(best, 4), "peak_rss_mb": round(_peak_mb(), 1),
+                        "rss_growth_mb": round(_peak_mb() - before, 1)}
+        return v
+
+    parsed  = stage("parse", parse_ufdr, data)
+    del data
+    n       = len(parsed["messages"])
+    metrics = stage("aggregate", aggregate, parsed["messages"], parsed["calls"], parsed["metadata"])
+    del parsed
+    graph   = stage("graph", generate_network_graph, metrics)
+    risks   = detect_risks(metrics)
+    stage("pdf", generate_pdf, metrics, template_summary(metrics), risks, graph)
+    for s in stages.values():
+        s["msgs_per_s"] = round(n / s["wall_s"]) if s["wall_s"] else None
+    metrics = json.loads(json.dumps(metrics, default=str))
+    print(json.dumps({"messages": n, "repeat": repeat, "baseline_rss_mb": round(base, 1),
+                      "peak_rss_mb": round(_peak_mb(), 1), "stages": stages, "digest": digest(metrics), "metrics": metrics}))
+
+def truth_mismatches(metrics, path):
+    """Ground-truth fields from generate_ufdr.py that the metrics disagree with."""
+    try:
+        with open(path + ".truth.json") as f:
+            expected = json.load(f)["expected"]
+    except (OSError, KeyError, ValueError):
+        return []
+    bad = [k for k, v in expected.items() if k != "top_contacts" and metrics.get(k) != v]
+    top = [(c["contact_name"], c["messages"]) for c in metrics.get("top_contacts", [])[:5]]
+    if top != [(c["contact_name"], c["messages"]) for c in expected["top_contacts"][:5]]:
+        bad.append("top_contacts")
+    return bad
+
+def measure(label, directory, repeat):
+    path, cid = corpus(label, directory)
+    r = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", path,
+                        "--repeat", str(repeat)], capture_output=True, text=True,
+                       cwd=os.path.dirname(os.path.abspath(__file__)))
+    if r.returncode:
+        raise RuntimeError(f"{label} corpus failed:\n{r.stderr[-2000:]}")
+    res = json.loads(r.stdout.strip().splitlines()[-1])
+    res["corpus"], res["truth_mismatches"] = cid, truth_mismatches(res["metrics"], path)
+    return res
+
+def compare(label, res, base, thresholds, rss_grow):
+    """[(stage, message)] for each budget the run breaks against its baseline."""
+    fails = []
+    if res["repeat"] != base.get("repeat", res["repeat"]):
+        print(f"[Bench] {label}: baseline used --repeat {base['repeat']}, this run {res['repeat']}")
+    for st in STAGES:
+        b, c = base["stages"][st]["wall_s"], res["stages"][st]["wall_s"]
+        limit = thresholds.get(st, SLOWDOWN)
+        if c - b > NOISE_S and c > b * (1 + limit):
+            fails.append((st, f"{c:.3f}s vs {b:.3f}s (+{(c / b - 1) * 100:.0f}%, budget +{limit * 100:.0f}%)"))
+    if res["peak_rss_mb"] > base["peak_rss_mb"] * (1 + rss_grow):
+        fails.append(("rss", f"peak {res['peak_rss_mb']:.0f} MB vs {base['peak_rss_mb']:.0f} MB "
+                             f"(budget +{rss_grow * 100:.0f}%)"))
+    if res["corpus"] == base["corpus"] and res["digest"] != base["digest"]:
+        keys = sorted(k for k in set(res["metrics"]) | set(base.get("metrics", {}))
+                      if res["metrics"].get(k) != base.get("metrics", {}).get(k))
+        fails.append(("metrics", f"output changed: {', '.join(keys) or 'digest only'}"))
+    elif res["corpus"] != base["corpus"]:
+        print(f"[Bench] {label}: corpus changed since the baseline — metrics not compared")
+    return fails
+
+def _machine():
+    return {"python": platform.python_version(), "platform": platform.platform(),
+            "cpus": os.cpu_count()}
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--sizes", nargs="+", default=["1k", "10k", "100k"], choices=list(SIZES))
+    ap.add_argument("--repeat", type=int, default=3, help="runs per stage; the fastest counts")
+    ap.add_argument("--baseline", default=BASELINE)
+    ap.add_argument("--save", action="store_true", help="write this run as the baseline")
+    ap.add_argument("--threshold", action="append", default=[], metavar="STAGE=FRACTION",
+                    help=f"allowed slowdown per stage (default {SLOWDOWN})")
+    ap.add_argument("--rss-threshold", type=float, default=RSS_GROW)
+    ap.add_argument("--corpora", default=os.path.join(tempfile.gettempdir(), "ufdr_bench_corpora"))
+    ap.add_argument("--json", metavar="PATH", help="also write this run's results here")
+    ap.add_argument("--child", help=argparse.SUPPRESS)
+    args = ap.parse_args(argv)
+    if args.child:
+        return _child(args.child, args.repeat)
+    try:
+        thresholds = {k: float(v) for k, v in (t.split("=", 1) for t in args.threshold)}
+    except ValueError:
+        ap.error("--threshold takes STAGE=FRACTION, e.g. parse=0.3")
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("machine") != _machine():
+            print(f"[Bench] Baseline was recorded on {baseline.get('machine')}; timings may not compare")
+
+    print(f"{'corpus':>6} | {'stage':>9} | {'wall s':>8} | {'peak MB':>7} | {'msgs/s':>12} | vs baseline")
+    print("-" * 72)
+    results, failures, compared = {}, [], 0
+    for label in args.sizes:
+        res = results[label] = measure(label, args.corpora, args.repeat)
+        base = baseline.get("results", {}).get(label)
+        for st in STAGES:
+            s = res["stages"][st]
+            vs = f"{s['wall_s'] / max(base['stages'][st]['wall_s'], 1e-6):.2f}x" if base else "-"
+            print(f"{label:>6} | {st:>9} | {s['wall_s']:>8.3f} | {s['peak_rss_mb']:>7.0f} | "
+                  f"{s['msgs_per_s'] or 0:>12,} | {vs}")
+        if res["truth_mismatches"]:
+            failures.append((label, "truth", f"metrics disagree with ground truth: "
+                                             f"{', '.join(res['truth_mismatches'])}"))
+        if base and not args.save:
+            compared += 1
+            failures += [(label, st, msg) for st, msg in compare(label, res, base, thresholds,
+                                                                 args.rss_threshold)]
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"machine": _machine(), "results": results}, f, indent=1)
+    if args.save:
+        merged = baseline.get("results", {}) if baseline.get("machine") == _machine() else {}
+        merged.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump({"machine": _machine(), "saved": time.strftime("%Y-%m-%d %H:%M:%S"),
+                       "results": merged}, f, indent=1)
+        print(f"[Bench] Baseline saved to {args.baseline} ({', '.join(merged)})")
+    for label, st, msg in failures:
+        print(f"[Bench] REGRESSION {label}/{st}: {msg}")
+    if not failures and compared:
+        print(f"[Bench] {compared} corpora within budget; metrics unchanged.")
+    elif not baseline and not args.save:
+        print(f"[Bench] No baseline at {args.baseline}; record one with --save")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,35 @@
+"""
+blobstore.py — Content-addressed file store for report PDFs.
+Blobs live at blobs/<sha[:2]>/<sha[2:]> keyed by SHA-256, so identical
+reports are stored once and the SQLite file only carries hash + size.
+"""
+import os, hashlib, tempfile
+
+BLOB_DIR = os.getenv("UFDR_BLOB_DIR", "blobs")
+
+def put(data: bytes):
+    """Stores data (no-op if already present) and returns (sha256, size)."""
+    sha  = hashlib.sha256(data).hexdigest()
+    path = _path(sha)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f: f.write(data)
+            os.replace(tmp, path)   # atomic: readers never see a partial blob
+        except BaseException:
+            if os.path.exists(tmp): os.remove(tmp)
+            raise
+    return sha, len(data)
+
+def open_blob(sha):
+    """Binary file handle for sha, or None if it is not stored."""
+    try: return open(_path(sha), "rb")
+    except (FileNotFoundError, TypeError): return None
+
+def delete(sha):
+    try: os.remove(_path(sha))
+    except FileNotFoundError: pass
+
+def _path(sha):
+    return os.path.join(BLOB_DIR, sha[:2], sha[2:])
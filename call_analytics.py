@@ -0,0 +1,143 @@
+"""
+call_analytics.py — Call-detail metrics from the parsed calls frame.
+Talk time, missed/unanswered calls, the hour-of-day distribution, late-night
+short calls and bursts, per contact and overall. Everything is bincounts
+over factorized contact codes and one lexsort for bursts, so it stays
+linear (and fast) for millions of call records.
+
+The state is mergeable counts like aggregator's: accumulate() folds in a
+batch, finalize() produces the metrics. Bursts continue across batches
+through a per-contact tail (last call time, current run), which is exact
+when a later batch only adds newer calls.
+"""
+import numpy as np
+import pandas as pd
+
+MISSED      = {"missed", "rejected", "declined", "blocked", "busy", "no answer", "unanswered",
+               "3", "5", "6"}     # Android CallLog types 3 missed, 5 rejected, 6 blocked
+SHORT_S     = 30          # a call this long or shorter is "short"
+NIGHT       = (0, 4)      # hours, inclusive — same window as message night activity
+BURST_GAP_S = 600         # calls with one contact this close together chain into a run
+BURST_MIN   = 3           # a run of at least this many calls is a burst
+# per-contact columns kept in the state
+COLS = ("calls", "talk_s", "missed", "unanswered", "night", "short_night", "bursts", "longest_run")
+
+def new_state() -> dict:
+    return {"contacts": {}, "tail": {}, "hourly": [0] * 24, "types": {}}
+
+def accumulate(cs: dict, calls: pd.DataFrame) -> dict:
+    """Adds a batch of calls (parse_ufdr() frame) to cs in place; returns it."""
+    if calls.empty:
+        return cs
+    ts   = pd.to_datetime(calls["timestamp"], errors="coerce")
+    dur  = pd.to_numeric(calls["duration"], errors="coerce").fillna(0).clip(lower=0) \
+               .to_numpy(np.int64) if "duration" in calls else np.zeros(len(calls), np.int64)
+    typ  = calls["type"].fillna("unknown").astype(str).str.strip().str.lower() \
+               if "type" in calls else pd.Series("unknown", index=calls.index)
+    missed     = typ.isin(MISSED).to_numpy()
+    dur        = np.where(missed, 0, dur)            # a missed call has no talk time
+    unanswered = (dur == 0) & ~missed
+    hour  = ts.dt.hour.fillna(-1).to_numpy(np.int64)
+    night = (hour >= NIGHT[0]) & (hour <= NIGHT[1])
+    codes, names = pd.factorize(calls["contact_name"].fillna("Unknown").astype(str))
+    k = len(names)
+
+    def count(mask=None, weights=None):
+        c = codes if mask is None else codes[mask]
+        w = None if weights is None else (weights if mask is None else weights[mask])
+        return np.bincount(c, weights=w, minlength=k).astype(np.int64)
+
+    cols = [count(), count(weights=dur), count(missed), count(unanswered), count(night),
+            count(night & (dur <= SHORT_S))]
+    bursts, longest = _runs(cs["tail"], codes, names, ts)
+    table = np.column_stack(cols + [bursts, longest])
+    for name, row in zip(names, table.tolist()):
+        old = cs["contacts"].get(name)
+        if old is None:
+            cs["contacts"][name] = row
+        else:
+            cs["contacts"][name] = [a + b for a, b in zip(old[:-1], row[:-1])] + [max(old[-1], row[-1])]
+    cs["hourly"] = (np.asarray(cs["hourly"]) + np.bincount(hour[hour >= 0], minlength=24)).tolist()
+    for t, n in typ.value_counts().items():
+        cs["types"][t] = cs["types"].get(t, 0) + int(n)
+    return cs
+
+def _runs(tail, codes, names, ts):
+    """Per contact code: new bursts and the longest run in this batch,
+    continuing runs left open in tail (updated in place)."""
+    k = len(names)
+    bursts, longest = np.zeros(k, np.int64), np.zeros(k, np.int64)
+    dated = ts.notna().to_numpy()
+    if not dated.any():
+        return bursts, longest
+    c = codes[dated]
+    s = ts[dated].to_numpy().astype("datetime64[s]").astype(np.int64)
+    order = np.lexsort((s, c))
+    c, s  = c[order], s[order]
+    first = np.r_[True, c[1:] != c[:-1]]
+    brk   = first | np.r_[False, np.diff(s) > BURST_GAP_S]
+    run   = np.cumsum(brk) - 1
+    size  = np.bincount(run)
+    owner = c[brk]
+    carry = np.zeros(len(size), np.int64)         # calls already in the run before this batch
+    for i in np.flatnonzero(first):
+        t = tail.get(names[c[i]])
+        if t and 0 <= s[i] - t[0] <= BURST_GAP_S:
+            carry[run[i]] = t[1]
+    total = size + carry
+    bursts += np.bincount(owner, weights=(total >= BURST_MIN) & (carry < BURST_MIN),
+                          minlength=k).astype(np.int64)
+    starts = np.flatnonzero(np.r_[True, owner[1:] != owner[:-1]])   # runs are grouped by contact
+    longest[owner[starts]] = np.maximum.reduceat(total, starts)
+    last = np.r_[first[1:], True]                  # last call of each contact
+    for i in np.flatnonzero(last):
+        name = names[c[i]]
+        if name not in tail or s[i] >= tail[name][0]:
+            tail[name] = [int(s[i]), int(total[run[i]])]
+    return bursts, longest
+
+def _hm(seconds):
+    h, m = divmod(int(seconds) // 60, 60)
+    return f"{h}h {m:02d}m"
+
+def finalize(cs: dict, top=10):
+    """(overall call stats, per-contact rows for the `top` busiest contacts)."""
+    names = sorted(cs["contacts"])
+    if not names:
+        return {}, []
+    t = np.array([cs["contacts"][n] for n in names], dtype=np.int64).reshape(len(names), len(COLS))
+    tot = dict(zip(COLS, t.sum(0).tolist()))
+    answered = tot["calls"] - tot["missed"] - tot["unanswered"]
+    hourly = np.asarray(cs["hourly"], np.int64)
+    lr = int(t[:, COLS.index("longest_run")].argmax())
+    sn = int(t[:, COLS.index("short_night")].argmax())      # over every contact, not just the top rows
+    stats = {
+        "total_talk_s":      tot["talk_s"],
+        "talk_time":         _hm(tot["talk_s"]),
+        "answered":          answered,
+        "avg_duration_s":    round(tot["talk_s"] / answered, 1) if answered else 0.0,
+        "missed":            tot["missed"],
+        "unanswered":        tot["unanswered"],
+        "missed_pct":        round((tot["missed"] + tot["unanswered"]) / max(tot["calls"], 1) * 100, 1),
+        "night_calls":       tot["night"],
+        "short_night_calls": tot["short_night"],
+        "hourly_distribution": {h: int(n) for h, n in enumerate(hourly)},
+        "peak_hour":         int(hourly.argmax()),
+        "bursts":            tot["bursts"],
+        "longest_burst":     {"contact_name": names[lr], "calls": int(t[lr, COLS.index("longest_run")])},
+        "top_short_night":   {"contact_name": names[sn], **{c: int(t[sn, COLS.index(c)])
+                              for c in ("short_night", "missed", "unanswered")}},
+        "by_type":           dict(sorted(cs["types"].items(), key=lambda kv: (-kv[1], kv[0]))),
+    }
+    order = np.lexsort((-t[:, 1], -t[:, 0]))[:top]           # most calls, then most talk time
+    rows = []
+    for i in order:
+        r = dict(zip(COLS, t[i].tolist()))
+        ans = r["calls"] - r["missed"] - r["unanswered"]
+        rows.append({"contact_name": names[i], **r, "talk_time": _hm(r["talk_s"]),
+                     "avg_s": round(r["talk_s"] / ans, 1) if ans else 0.0})
+    return stats, rows
+
+def analyze_calls(calls: pd.DataFrame, top=10):
+    """finalize() of a single calls frame."""
+    return finalize(accumulate(new_state(), calls), top)
@@ -0,0 +1,211 @@
+"""
+case_merge.py — One case built from several UFDR extractions.
+Phones on both ends of a conversation, and repeated extractions of one phone,
+hold the same records. merge() stacks the parsed archives and keeps a record
+only if no other archive already contributed it, keyed on
+
+    hash(participants, body)  +  timestamp bucket of `window` seconds
+
+participants is the unordered pair (device owner, counterparty), with phone
+numbers cut to their last 10 digits, so the sender's and the receiver's copy
+of a message agree. A record also matches the neighbouring earlier bucket
+when the stamps are within the window, so clock skew across a bucket edge is
+caught. Repeats inside one archive are numbered, not merged: two identical
+"Ok"s on one phone stay two. Keys come from pd.util.hash_pandas_object and
+matching is hash-table lookups, so the cost is linear in combined records.
+
+Owner numbers come from device metadata (phone_number, msisdn, ...) or
+`owners`. Without one, a device is keyed by IMEI/model and only
+re-extractions of the same phone collapse.
+
+Run: python case_merge.py phoneA.zip phoneB.zip --owner phoneA.zip=+15550100 --name "Op X"
+"""
+import argparse, os, sys
+import numpy as np
+import pandas as pd
+from instrument import span
+
+WINDOW     = 2          # seconds of clock skew tolerated between devices
+OWNER_KEYS = ("phone_number", "msisdn", "own_number", "owner_number", "line_number")
+
+def _digits(s):
+    return s.str.replace(r"\D", "", regex=True).str[-10:]
+
+def _counterparty(names, book):
+    """Stable ids for the other party: phone digits via the contact book (or
+    the name itself when it is a number), else the casefolded name."""
+    names = names.fillna("Unknown").astype(str)
+    phone = names.map(book) if book else pd.Series(None, index=names.index, dtype=object)
+    phone = phone.fillna(names.where(names.str.fullmatch(r"\+?[\d\s\-().]{6,}")))
+    d = _digits(phone.fillna("").astype(str))
+    return d.where(d.str.len() >= 6, "n:" + names.str.strip().str.casefold())
+
+def device_owner(meta, label, owners=None):
+    """Owner id for a device: an explicit number, a metadata number, or the
+    device identity (IMEI, model) when no number is known."""
+    num = (owners or {}).get(label) or next((meta[k] for k in OWNER_KEYS if meta.get(k)), None)
+    if num:
+        d = _digits(pd.Series([str(num)]))[0]
+        if len(d) >= 6:
+            return d
+    return "dev:" + str(meta.get("imei") or meta.get("serial") or meta.get("model") or label)
+
+def _keys(df, owner, book, window, with_body):
+    """Per-row (content hash, bucket, epoch seconds, occurrence) for one archive."""
+    secs  = df["timestamp"].to_numpy().astype("datetime64[s]").astype("int64")
+    other = _counterparty(df["contact_name"], book).to_numpy(dtype=object)
+    own   = np.full(len(df), owner, dtype=object)
+    first = own < other
+    parts = pd.DataFrame({"lo": np.where(first, own, other), "hi": np.where(first, other, own)})
+    if with_body:
+        parts["body"] = df["body"].fillna("").astype(str).str.strip().str.casefold().to_numpy()
+    content = pd.util.hash_pandas_object(parts, index=False).to_numpy()
+    bucket  = secs // window
+    bk      = _hash(content, bucket)
+    occ     = pd.Series(bk).groupby(bk).cumcount().to_numpy()
+    return content, bucket, secs, occ
+
+def _hash(*cols):
+    return pd.util.hash_pandas_object(pd.DataFrame({i: c for i, c in enumerate(cols)}),
+                                      index=False).to_numpy()
+
+def dedupe(frames, owners, books, window=WINDOW, with_body=True):
+    """Stacks frames (one per device, timestamps parsed) and returns
+    (combined frame with a 'device' column, keep mask, per-device kept counts)."""
+    parts, keys = [], []
+    for i, df in enumerate(frames):
+        df = df.dropna(subset=["timestamp"]) if len(df) else df
+        if not len(df):
+            continue
+        parts.append(df.assign(device=i))
+        keys.append(_keys(df, owners[i], books[i], window, with_body))
+    if not parts:
+        return pd.DataFrame(), np.array([], bool), [0] * len(frames)
+    allf = pd.concat(parts, ignore_index=True)
+    content, bucket, secs, occ = (np.concatenate(k) for k in zip(*keys))
+    dev   = allf["device"].to_numpy()
+    key   = _hash(content, bucket, occ)
+    first = ~pd.Series(key).duplicated().to_numpy()
+    seen  = pd.DataFrame({"secs": secs[first], "dev": dev[first]}, index=key[first])
+    prev  = seen.reindex(_hash(content, bucket - 1, occ))
+    near  = (prev["dev"].to_numpy() != dev) & (secs - prev["secs"].to_numpy() <= window)
+    keep  = first & ~near
+    kept  = np.bincount(dev[keep], minlength=len(frames)).tolist()
+    return allf, keep, kept
+
+def _book(contacts):
+    if contacts is None or contacts.empty or "name" not in contacts:
+        return {}
+    return {str(n): str(p) for n, p in zip(contacts["name"], contacts.get("phone", []))
+            if p and str(p).strip()}
+
+def merge(parsed, labels, owners=None, window=WINDOW):
+    """parse_ufdr() results of several archives → one parse_ufdr()-shaped dict
+    of deduplicated records, plus 'case': {"devices": [...], "dedupe": {...}}
+    for the metrics."""
+    metas  = [p["metadata"] for p in parsed]
+    own    = [device_owner(m, l, owners) for m, l in zip(metas, labels)]
+    books  = [_book(p["contacts"]) for p in parsed]
+    msgs, mkeep, mkept = dedupe([p["messages"] for p in parsed], own, books, window)
+    calls, ckeep, ckept = dedupe([p["calls"] for p in parsed], own, books, window, with_body=False)
+
+    devices = []
+    for i, (p, label, meta) in enumerate(zip(parsed, labels, metas)):
+        m = p["messages"]
+        d = {"device": label, "model": meta.get("model", "Unknown"), "imei": meta.get("imei", ""),
+             "owner": own[i], "messages": len(m), "calls": len(p["calls"]),
+             "unique_messages": mkept[i], "duplicate_messages": len(m) - mkept[i],
+             "unique_calls": ckept[i], "duplicate_calls": len(p["calls"]) - ckept[i],
+             "first": None, "last": None, "top_contact": None, "night_pct": 0.0}
+        if len(m) and m["timestamp"].notna().any():
+            d["first"], d["last"] = str(m["timestamp"].min()), str(m["timestamp"].max())
+            d["top_contact"] = str(m["contact_name"].value_counts().index[0])
+            d["night_pct"]   = round(float(m["timestamp"].dt.hour.between(0, 4).mean() * 100), 1)
+        devices.append(d)
+
+    def combined(df, keep):
+        if not len(df):
+            return pd.DataFrame()
+        df = df[keep].sort_values("timestamp", kind="stable").reset_index(drop=True)
+        df["device"] = np.asarray(labels, dtype=object)[df["device"].to_numpy()]
+        return df
+    book = pd.concat([p["contacts"] for p in parsed if not p["contacts"].empty], ignore_index=True) \
+        if any(not p["contacts"].empty for p in parsed) else pd.DataFrame()
+    if not book.empty:
+        book = book.drop_duplicates(subset=["name"]).reset_index(drop=True)
+
+    meta = dict(metas[0]) if metas else {}
+    models = list(dict.fromkeys(m.get("model", "Unknown") for m in metas))
+    if len(parsed) > 1:
+        meta["model"] = f"{len(parsed)} devices: " + ", ".join(models)
+    out_msgs = combined(msgs, mkeep)
+    return {"messages": out_msgs, "calls": combined(calls, ckeep), "contacts": book, "metadata": meta,
+            "errors": [f"{l}: {e}" for p, l in zip(parsed, labels) for e in p["errors"]
+                       if not (len(out_msgs) and e == "No messages found in ZIP")],
+            "case": {"devices": devices,
+                     "dedupe": {"messages_in": int(len(msgs)), "messages_out": int(mkeep.sum()),
+                                "calls_in": int(len(calls)), "calls_out": int(ckeep.sum()),
+                                "window_s": window}}}
+
+def parse_and_merge(files, owners=None, window=WINDOW):
+    """files: [(label, zip bytes)] → merge() result; one parse span per archive."""
+    from parser import parse_ufdr
+    parsed = []
+    for label, data in files:
+        with span(label):
+            parsed.append(parse_ufdr(data))
+    with span("merge") as sp:
+        res = merge(parsed, [l for l, _ in files], owners, window)
+        sp.attrs.update(res["case"]["dedupe"])
+    d = res["case"]["dedupe"]
+    print(f"[Merge] {len(files)} archives: {d['messages_in']} → {d['messages_out']} messages, "
+          f"{d['calls_in']} → {d['calls_out']} calls")
+    return res
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("archives", nargs="+")
+    ap.add_argument("--owner", action="append", default=[], metavar="ARCHIVE=NUMBER",
+                    help="the extracted phone's own number, when metadata lacks it")
+    ap.add_argument("--window", type=int, default=WINDOW, help="clock-skew tolerance, seconds")
+    ap.add_argument("--user", default="admin")
+    ap.add_argument("--name", help="case name (default: the archive names)")
+    ap.add_argument("--no-pdf", action="store_true")
+    args = ap.parse_args(argv)
+    owners = {}
+    for o in args.owner:
+        k, _, v = o.partition("=")
+        owners[os.path.basename(k)] = v
+    files = []
+    for path in args.archives:
+        with open(path, "rb") as f:
+            files.append((os.path.basename(path), f.read()))
+
+    import database
+    from pipeline import analyze_case
+    res = analyze_case(files, owners=owners, with_pdf=not args.no_pdf, window=args.window)
+    if res.get("error"):
+        print(f"[Merge] FAILED: {res['error']}")
+        return 1
+    sha = case_sha256(data for _, data in files)
+    with database.transaction():
+        aid = database.save_analysis(args.user, args.name or " + ".join(l for l, _ in files),
+                                     f"Merged case: {len(files)} extractions", res["metrics"],
+                                     res["summary"], res["risks"], res.get("pdf") or None,
+                                     archive_sha256=sha)
+        database.store_parsed(aid, res["parsed"])
+        database.save_timings(aid, res.get("spans"), res.get("profile"))
+    for d in res["metrics"]["devices"]:
+        print(f"[Merge] {d['device']}: {d['messages']} msgs ({d['duplicate_messages']} duplicate), "
+              f"{d['calls']} calls ({d['duplicate_calls']} duplicate), owner {d['owner']}")
+    print(f"[Merge] Saved analysis #{aid}")
+    return 0
+
+def case_sha256(blobs):
+    """Order-independent id of a set of archives, stored as the case's archive_sha256."""
+    import hashlib
+    shas = sorted(hashlib.sha256(b).hexdigest() for b in blobs)
+    return hashlib.sha256(("case:" + ",".join(shas)).encode()).hexdigest()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,143 @@
+"""
+coactivity.py — Contacts active in the same short time windows.
+Sweeps the timestamp-sorted message stream once: each message is paired with
+every other contact that had a message in the preceding WINDOW_S seconds
+(their latest one only, looking back at most MAX_LOOKBACK messages), so a
+burst of 50 messages between two people still counts as steady co-activity,
+not 2,500 pairs. Cost is O(n log n) for the sort plus O(n · lookback).
+
+A pair where the earlier message came in from A and the later one went out
+to B is a relay candidate (A → B): the subject passing something on. Each
+relay chain gets a lift — observed count over what A's incoming and B's
+outgoing volume would give by chance over the case's time span — so two
+busy conversations held side by side don't look like relaying.
+
+The state is mergeable like aggregator's: a per-batch tail of recent
+messages carries the window across batches, exact when later batches only
+add newer messages.
+"""
+import heapq, os
+import numpy as np
+import pandas as pd
+
+WINDOW_S     = int(os.getenv("UFDR_COACTIVITY_WINDOW_S", "300"))
+MAX_LOOKBACK = 64         # earlier messages examined per message, whatever the density
+DENSE_PAIRS  = 1 << 23    # up to this many contact pairs, count into a flat array
+INCOMING     = {"incoming", "received", "inbox", "in"}
+OUTGOING     = {"outgoing", "sent", "outbox", "out"}
+SKIP         = {"subject", "", "nan"}
+
+def new_state(window=None) -> dict:
+    return {"window": window or WINDOW_S, "pairs": {}, "relays": {}, "inbound": {}, "outbound": {},
+            "first": None, "last": None, "tail": []}
+
+def _reduce(keys, counts):
+    """keys/counts lists collapsed to one sorted (unique keys, summed counts) pair."""
+    u, inv = np.unique(np.concatenate(keys), return_inverse=True)
+    return [u], [np.bincount(inv, weights=np.concatenate(counts), minlength=len(u)).astype(np.int64)]
+
+def accumulate(cs: dict, messages: pd.DataFrame) -> dict:
+    """Adds a batch of messages (parse_ufdr() frame) to cs in place; returns it."""
+    if messages.empty:
+        return cs
+    ts    = pd.to_datetime(messages["timestamp"], errors="coerce")
+    name  = messages["contact_name"].fillna("Unknown").astype(str)
+    dirn  = messages["direction"].fillna("").astype(str).str.lower() \
+                if "direction" in messages else pd.Series("", index=messages.index)
+    ok    = (ts.notna() & ~name.str.lower().isin(SKIP)).to_numpy()
+    if not ok.any():
+        return cs
+    s     = ts[ok].to_numpy().astype("datetime64[s]").astype(np.int64)
+    flag  = np.where(dirn[ok].isin(INCOMING), 1, np.where(dirn[ok].isin(OUTGOING), 2, 0))
+    cs["first"] = int(s.min()) if cs["first"] is None else min(cs["first"], int(s.min()))
+    cs["last"]  = int(s.max()) if cs["last"] is None else max(cs["last"], int(s.max()))
+
+    # the previous batch's tail goes first: it is looked back into, never swept
+    t = len(cs["tail"])
+    s    = np.r_[np.array([e[0] for e in cs["tail"]], np.int64), s]
+    flag = np.r_[np.array([e[2] for e in cs["tail"]], np.int64), flag]
+    codes, names = pd.factorize(pd.concat([pd.Series([e[1] for e in cs["tail"]], dtype=object),
+                                           name[ok].astype(object)], ignore_index=True))
+    names, k = names.tolist(), len(names)
+    for f, counts in ((1, cs["inbound"]), (2, cs["outbound"])):
+        per = np.bincount(codes[t:][flag[t:] == f], minlength=k)
+        for c in np.flatnonzero(per).tolist():
+            counts[names[c]] = counts.get(names[c], 0) + int(per[c])
+    order = np.argsort(s, kind="stable")
+    fresh = order >= t
+    s, flag, codes = s[order], flag[order], codes[order]
+
+    w  = cs["window"]
+    n  = len(s)
+    lo = np.searchsorted(s, s - w, side="left")
+    depth = np.where(fresh, np.minimum(np.arange(n) - lo, MAX_LOOKBACK), 0)
+    # distance to the same contact's next message: j is that contact's latest
+    # before i = j + d iff gap[j] > d
+    by_c = np.argsort(codes, kind="stable")
+    gap  = np.full(n, n, np.int64)
+    same = codes[by_c[1:]] == codes[by_c[:-1]]
+    gap[by_c[:-1][same]] = by_c[1:][same] - by_c[:-1][same]
+    dense = k * k <= DENSE_PAIRS
+    codes = codes.astype(np.int32 if dense else np.int64)
+    pair_n, relay_n = np.zeros(k * k if dense else 0, np.int64), np.zeros(k * k if dense else 0, np.int64)
+    sparse = {"pairs": ([], []), "relays": ([], [])}      # (keys, counts) when not dense
+    for d in range(1, int(depth.max()) + 1):
+        # message i = j + d against message j, as aligned slices (no gathers)
+        ci, cj = codes[d:], codes[:-d]
+        ok = (depth[d:] >= d) & (gap[:-d] > d) & (ci != cj)
+        relay = ok & (flag[:-d] == 1) & (flag[d:] == 2)
+        a, b = ci[ok], cj[ok]
+        pk = np.minimum(a, b) * k + np.maximum(a, b)
+        rk = cj[relay] * k + ci[relay]
+        if dense:
+            pair_n  += np.bincount(pk, minlength=k * k)
+            relay_n += np.bincount(rk, minlength=k * k)
+            continue
+        for kind, new in (("pairs", pk), ("relays", rk)):
+            keys, counts = sparse[kind]
+            keys.append(new); counts.append(np.ones(len(new), np.int64))
+            if sum(map(len, keys)) > 1 << 23:             # bound memory on long dense cases
+                sparse[kind] = _reduce(keys, counts)
+    for kind, dense_n, ordered in (("pairs", pair_n, False), ("relays", relay_n, True)):
+        if dense:
+            u = np.flatnonzero(dense_n); c = dense_n[u]
+        elif sparse[kind][0]:
+            (u,), (c,) = _reduce(*sparse[kind])
+        else:
+            continue
+        d = cs[kind]
+        for key, m in zip(u.tolist(), c.tolist()):
+            a, b = names[key // k], names[key % k]
+            if not ordered and b < a:
+                a, b = b, a
+            row = d.setdefault(a, {})
+            row[b] = row.get(b, 0) + m
+
+    keep = np.flatnonzero(s >= s[-1] - w)[-MAX_LOOKBACK:]
+    cs["tail"] = [[int(s[i]), names[codes[i]], int(flag[i])] for i in keep]
+    return cs
+
+def finalize(cs: dict, top=15) -> dict:
+    """{"window_s", "pair_count", "pairs": busiest co-active pairs,
+    "relays": relay chains by count, with their lift}."""
+    span  = max((cs["last"] or 0) - (cs["first"] or 0), cs["window"])
+    relay = cs["relays"]
+    order = lambda p: (-p[0], p[1], p[2])
+    pairs = heapq.nsmallest(top, ((n, a, b) for a, row in cs["pairs"].items() for b, n in row.items()),
+                            key=order)
+    chains = heapq.nsmallest(top, ((n, a, b) for a, row in relay.items() for b, n in row.items()),
+                             key=order)
+    relays = []
+    for n, src, dst in chains:
+        chance = cs["inbound"].get(src, 0) * cs["outbound"].get(dst, 0) * cs["window"] / span
+        relays.append({"source": src, "target": dst, "count": n,
+                       "lift": round(n / chance, 1) if chance else None})
+    return {"window_s": cs["window"], "pair_count": sum(map(len, cs["pairs"].values())),
+            "pairs": [{"a": a, "b": b, "count": n,
+                       "relays": relay.get(a, {}).get(b, 0) + relay.get(b, {}).get(a, 0)}
+                      for n, a, b in pairs],
+            "relays": relays}
+
+def analyze_coactivity(messages: pd.DataFrame, window=None, top=15) -> dict:
+    """finalize() of a single messages frame."""
+    return finalize(accumulate(new_state(window), messages), top)
@@ -1,20 +1,92 @@
 """
 database.py — SQLite storage for users + analysis history
+
+Access goes through one pooled connection per thread (WAL journal, tuned
+pragmas). The schema is versioned with PRAGMA user_version: init_db() applies
+any pending MIGRATIONS once per process and is a no-op afterwards.
 """
-import sqlite3, json
+import sqlite3, json, os, threading, time
+from contextlib import contextmanager
 from datetime import datetime
+import blobstore
 
 DB = "ufdrinsight.db"
 
-def init_db():
-    con = sqlite3.connect(DB)
-    c   = con.cursor()
-    c.execute("""CREATE TABLE IF NOT EXISTS users(
+PRAGMAS = [
+    "PRAGMA journal_mode=WAL",       # readers never block the single writer
+    "PRAGMA synchronous=NORMAL",     # durable at checkpoints; safe with WAL
+    "PRAGMA busy_timeout=10000",
+    "PRAGMA cache_size=-16000",      # 16 MB page cache per connection
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=134217728",
+    "PRAGMA foreign_keys=ON",
+]
+
+_local      = threading.local()
+_init_lock  = threading.Lock()
+_ready      = set()                  # DB paths migrated by this process
+
+def _reset_after_fork():
+    global _local
+    _local = threading.local()       # never share a connection across fork()
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+def _connect():
+    con = sqlite3.connect(DB, timeout=10)
+    for p in PRAGMAS:
+        con.execute(p)
+    return con
+
+def _conn():
+    """This thread's pooled connection, opened (and the schema migrated) on first use."""
+    con = getattr(_local, "con", None)
+    if con is None or _local.path != DB:
+        if DB not in _ready:
+            init_db()
+        con = _connect()
+        _local.con, _local.path = con, DB
+    return con
+
+@contextmanager
+def transaction(immediate=False):
+    """Commits on success, rolls back on error. Nested blocks join the
+    outermost one, so wrapping several save_analysis()/store_parsed() calls in
+    a transaction() batches them into a single commit. immediate=True takes
+    the write lock now (BEGIN IMMEDIATE) unless the transaction already holds
+    it, so what it reads stays current until commit — for check-then-write."""
+    con   = _conn()
+    depth = getattr(_local, "depth", 0)
+    _local.depth = depth + 1
+    try:
+        if depth:
+            # sqlite3 only opens a transaction before a write: none open = no lock held
+            if immediate and not con.in_transaction:
+                con.execute("BEGIN IMMEDIATE")
+            yield con
+        else:
+            with con:
+                if immediate:
+                    con.execute("BEGIN IMMEDIATE")
+                yield con
+    finally:
+        _local.depth = depth
+
+# ── Schema migrations ─────────────────────────────────
+# Append only; never edit an entry that has shipped. Each runs once per DB.
+
+def _add_column(con, table, coldef):
+    name = coldef.split()[0]
+    if name not in {r[1] for r in con.execute(f"PRAGMA table_info({table})")}:
+        con.execute(f"ALTER TABLE {table} ADD COLUMN {coldef}")
+
+def _m1_base(con):
+    con.execute("""CREATE TABLE IF NOT EXISTS users(
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         username TEXT UNIQUE NOT NULL,
         password TEXT NOT NULL,
         created  TEXT NOT NULL)""")
-    c.execute("""CREATE TABLE IF NOT EXISTS analyses(
+    con.execute("""CREATE TABLE IF NOT EXISTS analyses(
         id          INTEGER PRIMARY KEY AUTOINCREMENT,
         username    TEXT NOT NULL,
         file_name   TEXT NOT NULL,
@@ -24,12 +96,214 @@ def init_db():
         summary     TEXT,
         risks_json  TEXT,
         pdf_bytes   BLOB)""")
+    con.execute("INSERT OR IGNORE INTO users(username,password,created) VALUES(?,?,?)",
+                ("admin","admin123",datetime.now().isoformat()))
+
+def _m2_pdf_blobstore(con):
+    """Background PDF status + blob-store columns; moves legacy BLOBs out."""
+    for col in ("pdf_status TEXT", "pdf_sha256 TEXT", "pdf_size INTEGER"):
+        _add_column(con, "analyses", col)
+    ids = [r[0] for r in con.execute("SELECT id FROM analyses WHERE pdf_bytes IS NOT NULL")]
+    for aid in ids:
+        data = con.execute("SELECT pdf_bytes FROM analyses WHERE id=?", (aid,)).fetchone()[0]
+        sha, size = blobstore.put(data)
+        con.execute("UPDATE analyses SET pdf_sha256=?, pdf_size=?, pdf_bytes=NULL, "
+                    "pdf_status='done' WHERE id=?", (sha, size, aid))
+    if ids:
+        print(f"[DB] Moved {len(ids)} PDFs to {blobstore.BLOB_DIR}/")
+    return bool(ids)   # True → VACUUM once the migration is committed
+
+def _m3_indexes(con):
+    con.execute("CREATE INDEX IF NOT EXISTS idx_analyses_user_time "
+                "ON analyses(username, analyzed_at DESC, id DESC)")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_analyses_pdf_sha ON analyses(pdf_sha256)")
+
+def _m4_evidence_store(con):
+    """Normalized parsed evidence, keyed by analysis (deleted with it)."""
+    con.execute("""CREATE TABLE IF NOT EXISTS contacts(
+        id          INTEGER PRIMARY KEY,
+        analysis_id INTEGER NOT NULL REFERENCES analyses(id) ON DELETE CASCADE,
+        name        TEXT NOT NULL,
+        phone       TEXT,
+        UNIQUE(analysis_id, name))""")
+    con.execute("""CREATE TABLE IF NOT EXISTS messages(
+        id          INTEGER PRIMARY KEY,
+        analysis_id INTEGER NOT NULL REFERENCES analyses(id) ON DELETE CASCADE,
+        ts          TEXT,
+        contact_id  INTEGER REFERENCES contacts(id),
+        direction   TEXT,
+        type        TEXT,
+        body        TEXT)""")
+    con.execute("""CREATE TABLE IF NOT EXISTS calls(
+        id          INTEGER PRIMARY KEY,
+        analysis_id INTEGER NOT NULL REFERENCES analyses(id) ON DELETE CASCADE,
+        ts          TEXT,
+        contact_id  INTEGER REFERENCES contacts(id),
+        duration    INTEGER,
+        type        TEXT)""")
+    for t in ("messages", "calls"):
+        con.execute(f"CREATE INDEX IF NOT EXISTS idx_{t}_case_ts ON {t}(analysis_id, ts)")
+        con.execute(f"CREATE INDEX IF NOT EXISTS idx_{t}_case_contact ON {t}(analysis_id, contact_id, ts)")
+
+def _m5_analysis_stats(con):
+    """Typed per-analysis scalars + risk flags for SQL-side cross-case analytics.
+    Existing rows are filled by backfill_stats()."""
+    con.execute("""CREATE TABLE IF NOT EXISTS analysis_stats(
+        analysis_id        INTEGER PRIMARY KEY REFERENCES analyses(id) ON DELETE CASCADE,
+        username           TEXT NOT NULL,
+        analyzed_at        TEXT NOT NULL,
+        total_messages     INTEGER,
+        total_calls        INTEGER,
+        unique_contacts    INTEGER,
+        days_active        INTEGER,
+        avg_daily_messages REAL,
+        night_activity_pct REAL,
+        night_message_count INTEGER,
+        peak_hour          INTEGER,
+        spike_count        INTEGER,
+        spike_increase_pct INTEGER,
+        max_gap_days       INTEGER,
+        top_contact        TEXT,
+        top_contact_pct    REAL,
+        risk_high          INTEGER,
+        risk_medium        INTEGER)""")
+    con.execute("""CREATE TABLE IF NOT EXISTS analysis_flags(
+        analysis_id INTEGER NOT NULL REFERENCES analyses(id) ON DELETE CASCADE,
+        flag        TEXT NOT NULL,
+        severity    TEXT NOT NULL,
+        PRIMARY KEY(analysis_id, flag))""")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_stats_user_time ON analysis_stats(username, analyzed_at)")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_stats_night ON analysis_stats(night_activity_pct)")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_flags_flag ON analysis_flags(flag, severity)")
+
+def _m6_archive_hash(con):
+    """SHA-256 of the source archive, so bulk imports can skip what they've seen."""
+    _add_column(con, "analyses", "archive_sha256 TEXT")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_analyses_archive ON analyses(archive_sha256)")
+
+def _m7_message_direction(con):
+    """Lets the message browser list/filter directions without scanning a case."""
+    con.execute("CREATE INDEX IF NOT EXISTS idx_messages_case_dir ON messages(analysis_id, direction)")
+
+def _m8_summary_cache(con):
+    """AI summaries by hash of (model, prompt), shared by every process."""
+    con.execute("""CREATE TABLE IF NOT EXISTS summary_cache(
+        key       TEXT PRIMARY KEY,
+        model     TEXT NOT NULL,
+        summary   TEXT NOT NULL,
+        created   REAL NOT NULL,
+        last_used REAL NOT NULL)""")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_summary_cache_used ON summary_cache(last_used)")
+
+def _m9_analysis_timings(con):
+    """Per-stage spans of each analysis (instrument.py) and optional cProfile text."""
+    con.execute("""CREATE TABLE IF NOT EXISTS analysis_timings(
+        analysis_id INTEGER NOT NULL REFERENCES analyses(id) ON DELETE CASCADE,
+        stage       TEXT NOT NULL,
+        start_s     REAL,
+        wall_s      REAL,
+        cpu_s       REAL,
+        rss_mb      REAL,
+        alloc_mb    REAL,
+        attrs       TEXT,
+        PRIMARY KEY(analysis_id, stage))""")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_timings_stage_wall ON analysis_timings(stage, wall_s)")
+    con.execute("""CREATE TABLE IF NOT EXISTS analysis_profiles(
+        analysis_id INTEGER PRIMARY KEY REFERENCES analyses(id) ON DELETE CASCADE,
+        profile     TEXT NOT NULL)""")
+
+def _m10_device_state(con):
+    """Running aggregates per extracted device (incremental.py): the case a
+    re-extraction is folded into, the aggregator state, the newest record
+    time and the sorted uint64 hashes of every record seen."""
+    con.execute("""CREATE TABLE IF NOT EXISTS device_state(
+        username    TEXT NOT NULL,
+        device_key  TEXT NOT NULL,
+        analysis_id INTEGER NOT NULL REFERENCES analyses(id) ON DELETE CASCADE,
+        version     INTEGER NOT NULL DEFAULT 1,
+        high_water  TEXT,
+        state       TEXT NOT NULL,
+        hashes      BLOB NOT NULL,
+        updated_at  TEXT NOT NULL,
+        PRIMARY KEY(username, device_key))""")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_device_state_analysis ON device_state(analysis_id)")
+
+def _m11_retention(con):
+    """When retention.py moved a case to cold storage (its row is then a stub)
+    and when it was last brought back."""
+    for col in ("archived_at TEXT", "restored_at TEXT"):
+        _add_column(con, "analyses", col)
+
+def _m12_contact_fk_indexes(con):
+    """messages/calls.contact_id REFERENCES contacts: without an index leading
+    with it, every contact delete (a cascading case delete) scans both tables."""
+    for t in ("messages", "calls"):
+        con.execute(f"CREATE INDEX IF NOT EXISTS idx_{t}_contact ON {t}(contact_id)")
+
+def _m13_case_archives(con):
+    """Every archive folded into a case (incremental.py), not just the first,
+    so re-runs skip any of them; analyses.archive_sha256 keeps the first."""
+    con.execute("""CREATE TABLE IF NOT EXISTS case_archives(
+        analysis_id INTEGER NOT NULL REFERENCES analyses(id) ON DELETE CASCADE,
+        sha256      TEXT NOT NULL,
+        PRIMARY KEY(analysis_id, sha256))""")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_case_archives_sha ON case_archives(sha256)")
+    con.execute("""INSERT OR IGNORE INTO case_archives(analysis_id, sha256)
+        SELECT id, archive_sha256 FROM analyses WHERE archive_sha256 IS NOT NULL""")
+
+MIGRATIONS = [_m1_base, _m2_pdf_blobstore, _m3_indexes, _m4_evidence_store, _m5_analysis_stats,
+              _m6_archive_hash, _m7_message_direction, _m8_summary_cache, _m9_analysis_timings,
+              _m10_device_state, _m11_retention, _m12_contact_fk_indexes, _m13_case_archives]
+
+def init_db():
+    """Applies pending migrations. Safe to call repeatedly and from several
+    processes: each step runs in a BEGIN IMMEDIATE transaction that re-checks
+    user_version, so only one process performs it."""
+    with _init_lock:
+        if DB in _ready:
+            return
+        con = _connect()
+        con.isolation_level = None   # explicit transactions below
+        try:
+            vacuum = False
+            while True:
+                con.execute("BEGIN IMMEDIATE")
+                version = con.execute("PRAGMA user_version").fetchone()[0]
+                if version >= len(MIGRATIONS):
+                    con.execute("COMMIT")
+                    break
+                try:
+                    vacuum |= bool(MIGRATIONS[version](con))
+                    con.execute(f"PRAGMA user_version={version + 1}")
+                    con.execute("COMMIT")
+                except BaseException:
+                    con.execute("ROLLBACK")
+                    raise
+                print(f"[DB] Migrated schema to v{version + 1}")
+            if vacuum:
+                con.execute("VACUUM")
+        finally:
+            con.close()
+        _ready.add(DB)
+
+def vacuum():
+    """Rewrites the file so pages freed by deleted rows (a retention sweep)
+    go back to the filesystem."""
+    con = _connect()
     try:
-        c.execute("INSERT INTO users(username,password,created) VALUES(?,?,?)",
-                  ("admin","admin123",datetime.now().isoformat()))
-    except sqlite3.IntegrityError:
-        pass
-    con.commit(); con.close()
+        con.execute("VACUUM")
+    finally:
+        con.close()
+
+def _ensure_hot(analysis_id):
+    """Restores an analysis retention.py archived before anything reads or
+    extends it; one primary-key lookup when it is hot."""
+    r = _conn().execute("SELECT archived_at FROM analyses WHERE id=?", (analysis_id,)).fetchone()
+    if r and r[0]:
+        import retention
+        retention.restore(analysis_id)
+
+# ── Users ─────────────────────────────────────────────
 
 def register_user(username, password):
     if not username or not password:
@@ -37,58 +311,513 @@ def register_user(username, password):
     if len(password) < 4:
         return False, "Password must be 4+ characters."
     try:
-        con = sqlite3.connect(DB)
-        con.execute("INSERT INTO users(username,password,created) VALUES(?,?,?)",
-                    (username.strip(), password, datetime.now().isoformat()))
-        con.commit(); con.close()
+        with transaction() as con:
+            con.execute("INSERT INTO users(username,password,created) VALUES(?,?,?)",
+                        (username.strip(), password, datetime.now().isoformat()))
         return True, "Account created!"
     except sqlite3.IntegrityError:
         return False, "Username already taken."
 
 def login_user(username, password):
-    con = sqlite3.connect(DB)
-    row = con.execute("SELECT id FROM users WHERE username=? AND password=?",
-                      (username.strip(), password)).fetchone()
-    con.close()
+    row = _conn().execute("SELECT id FROM users WHERE username=? AND password=?",
+                          (username.strip(), password)).fetchone()
     return row is not None
 
-def save_analysis(username, file_name, description, metrics, summary, risks, pdf_bytes):
-    con = sqlite3.connect(DB)
-    con.execute("""INSERT INTO analyses
-        (username,file_name,description,analyzed_at,metrics_json,summary,risks_json,pdf_bytes)
-        VALUES(?,?,?,?,?,?,?,?)""",
-        (username, file_name, description or "",
-         datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-         json.dumps(metrics), summary, json.dumps(risks), pdf_bytes))
-    con.commit(); con.close()
+# ── Analyses ──────────────────────────────────────────
+
+def save_analysis(username, file_name, description, metrics, summary, risks, pdf_bytes=None,
+                  archive_sha256=None):
+    """Inserts an analysis and returns its id. Without pdf_bytes the row is
+    marked 'pending' until attach_pdf() stores the report."""
+    sha, size = blobstore.put(pdf_bytes) if pdf_bytes else (None, None)
+    analyzed_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    with transaction() as con:
+        cur = con.execute("""INSERT INTO analyses
+            (username,file_name,description,analyzed_at,metrics_json,summary,risks_json,
+             pdf_sha256,pdf_size,pdf_status,archive_sha256)
+            VALUES(?,?,?,?,?,?,?,?,?,?,?)""",
+            (username, file_name, description or "", analyzed_at,
+             json.dumps(metrics), summary, json.dumps(risks), sha, size,
+             "done" if pdf_bytes else "pending", archive_sha256))
+        _write_stats(con, cur.lastrowid, username, analyzed_at, metrics, risks)
+        if archive_sha256:
+            con.execute("INSERT OR IGNORE INTO case_archives(analysis_id, sha256) VALUES(?,?)",
+                        (cur.lastrowid, archive_sha256))
+    return cur.lastrowid
+
+def attach_pdf(analysis_id, pdf_bytes):
+    sha, size = blobstore.put(pdf_bytes) if pdf_bytes else (None, None)
+    with transaction() as con:
+        con.execute("UPDATE analyses SET pdf_sha256=?, pdf_size=?, pdf_status=? WHERE id=?",
+                    (sha, size, "done" if pdf_bytes else "failed", analysis_id))
+
+def set_pdf_status(analysis_id, status):
+    with transaction() as con:
+        con.execute("UPDATE analyses SET pdf_status=? WHERE id=?", (status, analysis_id))
+
+def processed_archives(shas, username):
+    """The subset of archive hashes already in one of username's analyses."""
+    shas, seen = list(shas), set()
+    for i in range(0, len(shas), 500):
+        chunk = shas[i:i+500]
+        seen.update(r[0] for r in _conn().execute(
+            f"""SELECT DISTINCT x.sha256 FROM case_archives x JOIN analyses a ON a.id=x.analysis_id
+                WHERE a.username=? AND x.sha256 IN ({','.join('?' * len(chunk))})""",
+            [username, *chunk]))
+    return seen
+
+def analysis_for_archive(sha, username):
+    """username's latest analysis id holding an archive hash, or None."""
+    r = _conn().execute("""SELECT a.id FROM case_archives x JOIN analyses a ON a.id=x.analysis_id
+        WHERE x.sha256=? AND a.username=? ORDER BY a.id DESC LIMIT 1""", (sha, username)).fetchone()
+    return r[0] if r else None
+
+def get_pdf_status(analysis_id):
+    """'pending' | 'queued' | 'running' | 'done' | 'failed' (rows predating
+    background generation report 'done' when they carry a PDF)."""
+    row = _conn().execute("SELECT pdf_status, pdf_sha256 IS NOT NULL FROM analyses WHERE id=?",
+                          (analysis_id,)).fetchone()
+    if not row: return None
+    return row[0] or ("done" if row[1] else "pending")
+
+def get_analysis(analysis_id):
+    _ensure_hot(analysis_id)
+    r = _conn().execute("""SELECT id,file_name,description,analyzed_at,
+        metrics_json,summary,risks_json FROM analyses WHERE id=?""",
+        (analysis_id,)).fetchone()
+    return _analysis_dict(r) if r else None
+
+def analysis_owner(analysis_id):
+    r = _conn().execute("SELECT username FROM analyses WHERE id=?", (analysis_id,)).fetchone()
+    return r[0] if r else None
 
 def get_history(username):
-    con = sqlite3.connect(DB)
-    rows = con.execute("""SELECT id,file_name,description,analyzed_at,
+    rows = _conn().execute("""SELECT id,file_name,description,analyzed_at,
         metrics_json,summary,risks_json
-        FROM analyses WHERE username=? ORDER BY analyzed_at DESC""",
+        FROM analyses WHERE username=? ORDER BY analyzed_at DESC, id DESC""",
         (username,)).fetchall()
-    con.close()
-    out = []
-    for r in rows:
-        try: metrics = json.loads(r[4]) if r[4] else {}
-        except: metrics = {}
-        try: risks = json.loads(r[6]) if r[6] else []
+    return [_analysis_dict(r) for r in rows]
+
+HISTORY_PAGE = 10
+
+def get_history_page(username, limit=HISTORY_PAGE, cursor=None, search="",
+                     date_from=None, date_to=None):
+    """One page of history cards, newest first, via keyset pagination on
+    (analyzed_at, id) — cost is independent of how many analyses exist.
+    Only card columns are read: scalar metrics come from json_extract and PDFs
+    are not touched. Returns (items, next_cursor); next_cursor is None on the
+    last page. date_from/date_to are inclusive 'YYYY-MM-DD' strings."""
+    where, args = ["username=?"], [username]
+    if cursor:
+        where.append("(analyzed_at, id) < (?, ?)"); args += list(cursor)
+    if search:
+        where.append("(file_name LIKE ? OR description LIKE ?)"); args += [f"%{search}%"] * 2
+    if date_from:
+        where.append("analyzed_at >= ?"); args.append(str(date_from))
+    if date_to:
+        where.append("analyzed_at < date(?, '+1 day')"); args.append(str(date_to))
+    rows = _conn().execute(f"""SELECT id,file_name,description,analyzed_at,
+        json_extract(metrics_json,'$.total_messages'), json_extract(metrics_json,'$.total_calls'),
+        json_extract(metrics_json,'$.unique_contacts'), summary, risks_json,
+        COALESCE(pdf_status, CASE WHEN pdf_sha256 IS NULL THEN 'pending' ELSE 'done' END),
+        archived_at IS NOT NULL
+        FROM analyses WHERE {' AND '.join(where)}
+        ORDER BY analyzed_at DESC, id DESC LIMIT ?""", args + [limit + 1]).fetchall()
+    items = []
+    for r in rows[:limit]:
+        try: risks = json.loads(r[8]) if r[8] else []
         except: risks = []
-        out.append({"id":r[0],"file_name":r[1],"description":r[2],
-                    "analyzed_at":r[3],"metrics":metrics,"summary":r[5] or "","risks":risks})
-    return out
+        items.append({"id":r[0],"file_name":r[1],"description":r[2],"analyzed_at":r[3],
+                      "metrics":{"total_messages":r[4],"total_calls":r[5],"unique_contacts":r[6]},
+                      "summary":r[7] or "","risks":risks,"pdf_status":r[9],"archived":bool(r[10])})
+    next_cursor = (items[-1]["analyzed_at"], items[-1]["id"]) if len(rows) > limit else None
+    return items, next_cursor
+
+def count_history(username):
+    """(count, latest analyzed_at) — answered from the history index alone."""
+    return _conn().execute("SELECT COUNT(*), MAX(analyzed_at) FROM analyses WHERE username=?",
+                           (username,)).fetchone()
+
+def _analysis_dict(r):
+    try: metrics = json.loads(r[4]) if r[4] else {}
+    except: metrics = {}
+    try: risks = json.loads(r[6]) if r[6] else []
+    except: risks = []
+    return {"id":r[0],"file_name":r[1],"description":r[2],
+            "analyzed_at":r[3],"metrics":metrics,"summary":r[5] or "","risks":risks}
 
 def get_pdf(analysis_id):
-    con = sqlite3.connect(DB)
-    row = con.execute("SELECT pdf_bytes FROM analyses WHERE id=?",
-                      (analysis_id,)).fetchone()
-    con.close()
-    return row[0] if row and row[0] else b""
+    """Open binary file handle on the stored report, or None. Callers close it
+    (`with get_pdf(aid) as fh:`); pdf_jobs.pdf_bytes() reads and closes it for you."""
+    row = _conn().execute("SELECT pdf_sha256 FROM analyses WHERE id=?",
+                          (analysis_id,)).fetchone()
+    return blobstore.open_blob(row[0]) if row and row[0] else None
+
+# ── Cross-case statistics ─────────────────────────────
+
+STAT_COLS = ["total_messages","total_calls","unique_contacts","days_active",
+             "avg_daily_messages","night_activity_pct","night_message_count","peak_hour",
+             "spike_count","spike_increase_pct","max_gap_days"]
+
+def _write_stats(con, analysis_id, username, analyzed_at, metrics, risks):
+    top  = metrics.get("top_contact") or {}
+    sevs = [r.get("severity") for r in risks]
+    con.execute(f"""INSERT OR REPLACE INTO analysis_stats
+        (analysis_id,username,analyzed_at,{','.join(STAT_COLS)},top_contact,top_contact_pct,
+         risk_high,risk_medium) VALUES({','.join('?' * (len(STAT_COLS) + 7))})""",
+        [analysis_id, username, analyzed_at] + [metrics.get(c) for c in STAT_COLS] +
+        [top.get("contact_name"), top.get("msg_pct"), sevs.count("HIGH"), sevs.count("MEDIUM")])
+    con.execute("DELETE FROM analysis_flags WHERE analysis_id=?", (analysis_id,))
+    con.executemany("INSERT OR IGNORE INTO analysis_flags(analysis_id,flag,severity) VALUES(?,?,?)",
+                    [(analysis_id, r["flag"], r.get("severity", "INFO")) for r in risks])
+
+def backfill_stats(batch=500):
+    """Fills analysis_stats/analysis_flags for rows saved before they existed.
+    Runs in batched transactions; safe to interrupt and re-run. Returns the count."""
+    done = 0
+    while True:
+        rows = _conn().execute("""SELECT a.id,a.username,a.analyzed_at,a.metrics_json,a.risks_json
+            FROM analyses a LEFT JOIN analysis_stats s ON s.analysis_id=a.id
+            WHERE s.analysis_id IS NULL LIMIT ?""", (batch,)).fetchall()
+        if not rows:
+            return done
+        with transaction() as con:
+            for aid, user, at, mj, rj in rows:
+                try: metrics = json.loads(mj) if mj else {}
+                except: metrics = {}
+                try: risks = json.loads(rj) if rj else []
+                except: risks = []
+                _write_stats(con, aid, user, at, metrics, risks)
+        done += len(rows)
+        print(f"[DB] Backfilled stats for {done} analyses")
+
+def missing_stats_count():
+    return _conn().execute("""SELECT COUNT(*) FROM analyses a
+        LEFT JOIN analysis_stats s ON s.analysis_id=a.id WHERE s.analysis_id IS NULL""").fetchone()[0]
+
+def _stats_where(username=None, since=None, min_night_pct=None, flag=None):
+    where, args = ["1=1"], []
+    if username:      where.append("s.username=?");            args.append(username)
+    if since:         where.append("s.analyzed_at>=?");        args.append(str(since))
+    if min_night_pct is not None:
+        where.append("s.night_activity_pct>=?"); args.append(min_night_pct)
+    if flag:
+        where.append("EXISTS(SELECT 1 FROM analysis_flags f WHERE f.analysis_id=s.analysis_id "
+                     "AND f.flag=?)"); args.append(flag)
+    return " AND ".join(where), args
+
+def cross_case_summary(**filters):
+    """SQL aggregates over analysis_stats. Filters: username, since, min_night_pct, flag."""
+    where, args = _stats_where(**filters)
+    r = _conn().execute(f"""SELECT COUNT(*), AVG(total_messages), SUM(total_messages),
+        AVG(total_calls), AVG(night_activity_pct), MAX(night_activity_pct),
+        SUM(risk_high > 0), AVG(days_active)
+        FROM analysis_stats s WHERE {where}""", args).fetchone()
+    keys = ["cases","avg_messages","total_messages","avg_calls","avg_night_pct",
+            "max_night_pct","high_risk_cases","avg_days_active"]
+    return {k: (round(v, 1) if isinstance(v, float) else (v or 0)) for k, v in zip(keys, r)}
+
+def cross_case_list(limit=200, **filters):
+    """Matching cases, newest first, with their key scalars."""
+    where, args = _stats_where(**filters)
+    rows = _conn().execute(f"""SELECT s.analysis_id, a.file_name, s.analyzed_at, s.total_messages,
+        s.total_calls, s.night_activity_pct, s.spike_increase_pct, s.top_contact, s.risk_high
+        FROM analysis_stats s JOIN analyses a ON a.id=s.analysis_id
+        WHERE {where} ORDER BY s.analyzed_at DESC LIMIT ?""", args + [limit]).fetchall()
+    keys = ["id","file_name","analyzed_at","total_messages","total_calls","night_activity_pct",
+            "spike_increase_pct","top_contact","risk_high"]
+    return [dict(zip(keys, r)) for r in rows]
+
+def flag_frequencies(**filters):
+    """[(flag, severity, cases)] across the matching analyses."""
+    where, args = _stats_where(**filters)
+    return _conn().execute(f"""SELECT f.flag, f.severity, COUNT(*) FROM analysis_flags f
+        JOIN analysis_stats s ON s.analysis_id=f.analysis_id WHERE {where}
+        GROUP BY f.flag, f.severity ORDER BY 3 DESC""", args).fetchall()
+
+# ── Parsed evidence ───────────────────────────────────
+
+TS_FMT = "%Y-%m-%d %H:%M:%S"
+
+def store_parsed(analysis_id, parsed):
+    """Persists parse_ufdr() output for analysis_id in one transaction using
+    executemany, so later questions never need the original ZIP."""
+    _ensure_hot(analysis_id)
+    msgs, calls, book = parsed["messages"], parsed["calls"], parsed["contacts"]
+    phones = {}
+    if not book.empty:
+        phones = {str(n): (str(p) if p else None) for n, p in zip(book["name"], book["phone"])}
+    names = set(phones)
+    for df in (msgs, calls):
+        if not df.empty:
+            names.update(df["contact_name"].fillna("Unknown").astype(str).unique())
+    with transaction() as con:
+        con.executemany("INSERT OR IGNORE INTO contacts(analysis_id,name,phone) VALUES(?,?,?)",
+                        ((analysis_id, n, phones.get(n)) for n in sorted(names)))
+        cid = dict(con.execute("SELECT name, id FROM contacts WHERE analysis_id=?", (analysis_id,)))
+        if not msgs.empty:
+            con.executemany("""INSERT INTO messages(analysis_id,ts,contact_id,direction,type,body)
+                VALUES(?,?,?,?,?,?)""",
+                zip([analysis_id] * len(msgs), _ts_strings(msgs["timestamp"]),
+                    msgs["contact_name"].fillna("Unknown").astype(str).map(cid).tolist(),
+                    msgs["direction"].tolist(), msgs["type"].tolist(), msgs["body"].tolist()))
+        if not calls.empty:
+            con.executemany("""INSERT INTO calls(analysis_id,ts,contact_id,duration,type)
+                VALUES(?,?,?,?,?)""",
+                zip([analysis_id] * len(calls), _ts_strings(calls["timestamp"]),
+                    calls["contact_name"].fillna("Unknown").astype(str).map(cid).tolist(),
+                    calls["duration"].astype(int).tolist(), calls["type"].tolist()))
+
+def _ts_strings(col):
+    return col.dt.strftime(TS_FMT).astype(object).where(col.notna(), None).tolist()
+
+def load_parsed(analysis_id):
+    """Rebuilds the parse_ufdr() result for a stored analysis."""
+    import pandas as pd
+    _ensure_hot(analysis_id)
+    con = _conn()
+    msgs = pd.read_sql_query("""SELECT c.name AS contact_name, m.ts AS timestamp, m.body,
+        m.direction, m.type FROM messages m JOIN contacts c ON c.id=m.contact_id
+        WHERE m.analysis_id=? ORDER BY m.id""", con, params=(analysis_id,))
+    calls = pd.read_sql_query("""SELECT c.name AS contact_name, k.ts AS timestamp, k.duration,
+        k.type FROM calls k JOIN contacts c ON c.id=k.contact_id
+        WHERE k.analysis_id=? ORDER BY k.id""", con, params=(analysis_id,))
+    book = pd.read_sql_query("SELECT name, phone FROM contacts WHERE analysis_id=? "
+                             "AND phone IS NOT NULL ORDER BY id", con, params=(analysis_id,))
+    if not msgs.empty:
+        msgs["timestamp"] = pd.to_datetime(msgs["timestamp"], format=TS_FMT, errors="coerce")
+        msgs["hour"]      = msgs["timestamp"].dt.hour
+        msgs["date"]      = msgs["timestamp"].dt.date
+    if not calls.empty:
+        calls["timestamp"] = pd.to_datetime(calls["timestamp"], format=TS_FMT, errors="coerce")
+    rec = get_analysis(analysis_id) or {}
+    return {"messages": msgs, "calls": calls, "contacts": book,
+            "metadata": rec.get("metrics", {}).get("metadata", {}), "errors": []}
+
+def query_messages(analysis_id, contact=None, start=None, end=None, direction=None,
+                   keyword=None, after=None, limit=100):
+    """Drill-down over stored messages in (ts, id) order with keyset paging.
+    start/end are inclusive 'YYYY-MM-DD[ HH:MM:SS]' bounds. Returns
+    (rows, next_cursor) where rows are dicts and next_cursor feeds `after`."""
+    _ensure_hot(analysis_id)
+    where, args = ["m.analysis_id=?"], [analysis_id]
+    if contact:
+        where.append("m.contact_id=(SELECT id FROM contacts WHERE analysis_id=? AND name=?)")
+        args += [analysis_id, contact]
+    if start:     where.append("m.ts >= ?");  args.append(str(start))
+    if end:       where.append(_end_clause("m.ts", end)); args.append(str(end))
+    if direction: where.append("m.direction=?"); args.append(direction)
+    if keyword:   where.append("m.body LIKE ?"); args.append(f"%{keyword}%")
+    if after:     where.append("(m.ts, m.id) > (?, ?)"); args += list(after)
+    rows = _conn().execute(f"""SELECT m.id, m.ts, c.name, m.direction, m.type, m.body
+        FROM messages m JOIN contacts c ON c.id=m.contact_id
+        WHERE {' AND '.join(where)} ORDER BY m.ts, m.id LIMIT ?""", args + [limit + 1]).fetchall()
+    out = [{"id":r[0],"timestamp":r[1],"contact_name":r[2],"direction":r[3],
+            "type":r[4],"body":r[5]} for r in rows[:limit]]
+    nxt = (out[-1]["timestamp"], out[-1]["id"]) if len(rows) > limit else None
+    return out, nxt
+
+def message_directions(analysis_id):
+    """Distinct direction values stored for a case (parsers vary: sent/outgoing/...).
+    Loose index scan: one index seek per distinct value, not one row per message."""
+    _ensure_hot(analysis_id)
+    return [r[0] for r in _conn().execute("""WITH RECURSIVE d(v) AS (
+        SELECT MIN(direction) FROM messages WHERE analysis_id=?1
+        UNION ALL
+        SELECT (SELECT MIN(direction) FROM messages WHERE analysis_id=?1 AND direction > d.v)
+        FROM d WHERE d.v IS NOT NULL)
+        SELECT v FROM d WHERE v IS NOT NULL""", (analysis_id,))]
+
+def _end_clause(col, end):
+    # a bare date includes that whole day
+    return f"{col} < date(?, '+1 day')" if len(str(end)) == 10 else f"{col} <= ?"
+
+def contact_activity(analysis_id):
+    """Per-contact message/call counts and first/last contact for a stored case."""
+    _ensure_hot(analysis_id)
+    return _conn().execute("""SELECT c.name,
+        (SELECT COUNT(*) FROM messages m WHERE m.analysis_id=c.analysis_id AND m.contact_id=c.id),
+        (SELECT COUNT(*) FROM calls k    WHERE k.analysis_id=c.analysis_id AND k.contact_id=c.id),
+        (SELECT MIN(ts) FROM messages m  WHERE m.analysis_id=c.analysis_id AND m.contact_id=c.id),
+        (SELECT MAX(ts) FROM messages m  WHERE m.analysis_id=c.analysis_id AND m.contact_id=c.id)
+        FROM contacts c WHERE c.analysis_id=? ORDER BY 2 DESC""", (analysis_id,)).fetchall()
+
+def iter_evidence(analysis_id, batch=5000):
+    """Chronological (ts, kind, contact, direction, detail) rows streamed from
+    the store — same shape as pdf_generator.evidence_rows for the appendix."""
+    _ensure_hot(analysis_id)
+    cur = _connect().execute("""
+        SELECT m.ts, 'SMS', c.name, m.direction, m.body FROM messages m
+          JOIN contacts c ON c.id=m.contact_id WHERE m.analysis_id=?
+        UNION ALL
+        SELECT k.ts, 'CALL', c.name, k.type, k.duration || 's' FROM calls k
+          JOIN contacts c ON c.id=k.contact_id WHERE k.analysis_id=?
+        ORDER BY 1""", (analysis_id, analysis_id))
+    try:
+        while True:
+            rows = cur.fetchmany(batch)
+            if not rows: return
+            yield from rows
+    finally:
+        cur.connection.close()
 
 def delete_analysis(analysis_id):
-    con = sqlite3.connect(DB)
-    con.execute("DELETE FROM analyses WHERE id=?", (analysis_id,))
-    con.commit(); con.close()
+    with transaction() as con:
+        row = con.execute("SELECT pdf_sha256 FROM analyses WHERE id=?", (analysis_id,)).fetchone()
+        con.execute("DELETE FROM analyses WHERE id=?", (analysis_id,))
+        sha = row[0] if row else None
+        orphan = sha and not con.execute("SELECT 1 FROM analyses WHERE pdf_sha256=? LIMIT 1",
+                                         (sha,)).fetchone()
+    if orphan:
+        blobstore.delete(sha)
+    import retention
+    retention.discard(analysis_id)
+
+def _drop_report(con, analysis_id):
+    """Detaches a row's rendered PDF so the next download rebuilds it; returns
+    the blob's sha when no other row shares it (delete it after commit)."""
+    row = con.execute("SELECT pdf_sha256 FROM analyses WHERE id=?", (analysis_id,)).fetchone()
+    con.execute("UPDATE analyses SET pdf_sha256=NULL, pdf_size=NULL, "
+                "pdf_status=CASE WHEN pdf_status='failed' OR pdf_sha256 IS NOT NULL "
+                "THEN 'pending' ELSE pdf_status END WHERE id=?", (analysis_id,))
+    sha = row[0] if row else None
+    orphan = sha and not con.execute("SELECT 1 FROM analyses WHERE pdf_sha256=? LIMIT 1",
+                                     (sha,)).fetchone()
+    return sha if orphan else None
+
+def update_summary(analysis_id, summary):
+    """Replaces a row's summary. A report rendered with the old text is
+    dropped so the next download rebuilds it."""
+    with transaction() as con:
+        con.execute("UPDATE analyses SET summary=? WHERE id=?", (summary, analysis_id))
+        orphan = _drop_report(con, analysis_id)
+    if orphan:
+        blobstore.delete(orphan)
+
+def update_analysis(analysis_id, metrics, summary, risks, file_name=None, description=None,
+                    archive_sha256=None):
+    """Rewrites an analysis in place — a follow-up extraction folded into it:
+    new metrics, summary, risks and stats, stamped now. archive_sha256 is
+    added to the case's archives. The old report is dropped; stored evidence
+    is left to the caller (store_parsed appends)."""
+    _ensure_hot(analysis_id)
+    analyzed_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    with transaction() as con:
+        con.execute("""UPDATE analyses SET metrics_json=?, summary=?, risks_json=?, analyzed_at=?,
+            file_name=COALESCE(?, file_name), description=COALESCE(?, description) WHERE id=?""",
+            (json.dumps(metrics), summary, json.dumps(risks), analyzed_at, file_name,
+             description, analysis_id))
+        if archive_sha256:
+            con.execute("INSERT OR IGNORE INTO case_archives(analysis_id, sha256) VALUES(?,?)",
+                        (analysis_id, archive_sha256))
+        user = con.execute("SELECT username FROM analyses WHERE id=?", (analysis_id,)).fetchone()[0]
+        _write_stats(con, analysis_id, user, analyzed_at, metrics, risks)
+        orphan = _drop_report(con, analysis_id)
+    if orphan:
+        blobstore.delete(orphan)
+
+# ── Device state (incremental re-analysis) ────────────
+
+def get_device_state(username, device_key):
+    r = _conn().execute("""SELECT analysis_id, version, high_water, state, hashes
+        FROM device_state WHERE username=? AND device_key=?""", (username, device_key)).fetchone()
+    if not r:
+        return None
+    return {"analysis_id": r[0], "version": r[1], "high_water": r[2],
+            "state": json.loads(r[3]), "hashes": bytes(r[4])}
+
+def device_version(username, device_key):
+    r = _conn().execute("SELECT version FROM device_state WHERE username=? AND device_key=?",
+                        (username, device_key)).fetchone()
+    return r[0] if r else None
+
+def save_device_state(username, device_key, analysis_id, high_water, state, hashes):
+    """Points a device at analysis_id with its new running state; returns the
+    new version (bumped on every write so a stale delta can be refused)."""
+    with transaction() as con:
+        con.execute("""INSERT INTO device_state
+            (username,device_key,analysis_id,version,high_water,state,hashes,updated_at)
+            VALUES(?,?,?,1,?,?,?,?)
+            ON CONFLICT(username, device_key) DO UPDATE SET analysis_id=excluded.analysis_id,
+              version=version+1, high_water=excluded.high_water, state=excluded.state,
+              hashes=excluded.hashes, updated_at=excluded.updated_at""",
+            (username, device_key, analysis_id, high_water, json.dumps(state), hashes,
+             datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+        return con.execute("SELECT version FROM device_state WHERE username=? AND device_key=?",
+                           (username, device_key)).fetchone()[0]
+
+# ── AI summary cache ──────────────────────────────────
+
+def summary_cache_get(keys, ttl):
+    """First fresh (key, model, summary) among keys, or None. Bumps last_used
+    so eviction is least-recently-used; expired rows are ignored."""
+    now = time.time()
+    for k in keys:
+        r = _conn().execute("SELECT model, summary FROM summary_cache WHERE key=? AND created > ?",
+                            (k, now - ttl)).fetchone()
+        if r:
+            with transaction() as con:
+                con.execute("UPDATE summary_cache SET last_used=? WHERE key=?", (now, k))
+            return k, r[0], r[1]
+    return None
+
+def summary_cache_put(key, model, summary, max_rows):
+    now = time.time()
+    with transaction() as con:
+        con.execute("INSERT OR REPLACE INTO summary_cache(key,model,summary,created,last_used) "
+                    "VALUES(?,?,?,?,?)", (key, model, summary, now, now))
+        con.execute("""DELETE FROM summary_cache WHERE key IN (SELECT key FROM summary_cache
+                       ORDER BY last_used DESC LIMIT -1 OFFSET ?)""", (max_rows,))
+
+# ── Stage timings ─────────────────────────────────────
+
+TIMING_COLS = ("stage", "start_s", "wall_s", "cpu_s", "rss_mb", "alloc_mb", "attrs")
+
+def save_timings(analysis_id, spans, profile=None):
+    """Stores instrument.Trace.rows() for an analysis; a stage recorded again
+    (a rebuilt report) replaces its earlier row."""
+    if not spans and not profile:
+        return
+    with transaction() as con:
+        con.executemany(f"INSERT OR REPLACE INTO analysis_timings(analysis_id,{','.join(TIMING_COLS)}) "
+                        f"VALUES(?,{','.join('?' * len(TIMING_COLS))})",
+                        [(analysis_id, *(r.get(c) for c in TIMING_COLS)) for r in spans or []])
+        if profile:
+            con.execute("INSERT OR REPLACE INTO analysis_profiles(analysis_id, profile) VALUES(?,?)",
+                        (analysis_id, profile))
+
+def get_timings(analysis_id):
+    """(span rows in start order, cProfile text or None) for one analysis."""
+    con  = _conn()
+    rows = con.execute(f"SELECT {','.join(TIMING_COLS)} FROM analysis_timings WHERE analysis_id=? "
+                       "ORDER BY start_s, stage", (analysis_id,)).fetchall()
+    prof = con.execute("SELECT profile FROM analysis_profiles WHERE analysis_id=?",
+                       (analysis_id,)).fetchone()
+    return [dict(zip(TIMING_COLS, r)) for r in rows], prof[0] if prof else None
+
+def slowest_analyses(stage="total", limit=20):
+    """Cases with the longest wall time for a stage, slowest first."""
+    rows = _conn().execute("""SELECT t.analysis_id, a.file_name, a.username, a.analyzed_at,
+            s.total_messages, t.wall_s, t.cpu_s, t.rss_mb
+        FROM analysis_timings t JOIN analyses a ON a.id = t.analysis_id
+        LEFT JOIN analysis_stats s ON s.analysis_id = t.analysis_id
+        WHERE t.stage = ? ORDER BY t.wall_s DESC LIMIT ?""", (stage, limit)).fetchall()
+    keys = ("id", "file_name", "username", "analyzed_at", "messages", "wall_s", "cpu_s", "rss_mb")
+    return [dict(zip(keys, r)) for r in rows]
+
+def stage_breakdown():
+    """Per top-level stage: runs, mean/max wall seconds, mean CPU seconds,
+    seconds per 1k messages and the highest peak RSS seen."""
+    rows = _conn().execute("""SELECT t.stage, COUNT(*), AVG(t.wall_s), MAX(t.wall_s), AVG(t.cpu_s),
+            SUM(t.wall_s) * 1000.0 / NULLIF(SUM(s.total_messages), 0), MAX(t.rss_mb)
+        FROM analysis_timings t LEFT JOIN analysis_stats s ON s.analysis_id = t.analysis_id
+        WHERE instr(t.stage, '/') = 0 GROUP BY t.stage ORDER BY AVG(t.wall_s) DESC""").fetchall()
+    keys = ("stage", "runs", "avg_wall_s", "max_wall_s", "avg_cpu_s", "s_per_1k_msgs", "max_rss_mb")
+    return [{k: round(v, 4) if isinstance(v, float) else v for k, v in zip(keys, r)} for r in rows]
 
-init_db()
+if __name__ == "__main__":
+    import sys
+    if sys.argv[1:] == ["backfill"]:
+        print(f"[DB] {backfill_stats()} analyses backfilled")
+    else:
+        print("usage: python database.py backfill")
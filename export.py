@@ -0,0 +1,196 @@
+"""
+export.py — Parquet export of a case's evidence and metrics for other tools.
+Writes one directory per analysis:
+
+    messages/month=2024-01/part-0.parquet   partitioned, zstd-compressed
+    calls/month=2024-01/part-0.parquet
+    contacts.parquet
+    daily.parquet                            messages per day (zero days included)
+    hourly.parquet                           messages per hour of day
+    manifest.json                            tables, schemas, row counts, files
+
+Partitions are Hive-style, so pyarrow.dataset / DuckDB / Spark / Polars
+prune months a query doesn't touch and read only the columns it names:
+
+    pyarrow.dataset.dataset("case_12/messages", partitioning="hive")
+
+--partition day gives one directory per day (small files for sparse cases),
+none a single file. Undated records land in month=undated.
+
+Run: python export.py 12 --out exports/            (analysis #12 from the database)
+     python export.py sample_ufdr.zip --out exports/ (parse an archive directly)
+"""
+import argparse, io, json, os, shutil, sys, zipfile
+from datetime import datetime
+
+FORMAT_VERSION = 1
+COMPRESSION    = "zstd"
+PARTITIONS     = {"month": "%Y-%m", "day": "%Y-%m-%d", "none": None}
+
+def _pa():
+    try:
+        import pyarrow as pa, pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet export needs pyarrow: pip install pyarrow")
+    return pa, pq
+
+def schemas():
+    pa, _ = _pa()
+    label = pa.dictionary(pa.int32(), pa.string())
+    return {
+        "messages": pa.schema([("timestamp", pa.timestamp("us")), ("contact_name", pa.string()),
+                               ("direction", label), ("type", label), ("body", pa.string()),
+                               ("device", pa.string())]),
+        "calls":    pa.schema([("timestamp", pa.timestamp("us")), ("contact_name", pa.string()),
+                               ("duration", pa.int32()), ("type", label), ("device", pa.string())]),
+        "contacts": pa.schema([("name", pa.string()), ("phone", pa.string())]),
+        "daily":    pa.schema([("date", pa.date32()), ("messages", pa.int64())]),
+        "hourly":   pa.schema([("hour", pa.int8()), ("messages", pa.int64())]),
+    }
+
+def _table(df, schema):
+    """df → Arrow table in schema's column order; missing columns become nulls."""
+    pa, _ = _pa()
+    import pandas as pd
+    cols = []
+    for f in schema:
+        s = df[f.name] if f.name in df else pd.Series([None] * len(df), dtype=object)
+        if pa.types.is_timestamp(f.type):
+            s = pd.to_datetime(s, errors="coerce")
+        elif pa.types.is_integer(f.type):
+            s = pd.to_numeric(s, errors="coerce").astype("Int64")
+        elif pa.types.is_date(f.type):
+            s = pd.to_datetime(s, errors="coerce").dt.date
+        elif pa.types.is_dictionary(f.type) or pa.types.is_string(f.type):
+            s = s.astype("string")
+        arr = pa.array(s, from_pandas=True)
+        if pa.types.is_dictionary(f.type):
+            arr = arr.cast(pa.string()).dictionary_encode()
+        cols.append(arr.cast(f.type, safe=False))
+    return pa.Table.from_arrays(cols, schema=schema)
+
+def _write_partitioned(df, schema, root, partition, compression):
+    """Writes df under root/<key>=<value>/; returns [(relative path, rows)]."""
+    _, pq = _pa()
+    import pandas as pd
+    fmt  = PARTITIONS[partition]
+    ts   = pd.to_datetime(df["timestamp"], errors="coerce") if len(df) else pd.Series(dtype="datetime64[ns]")
+    keys = ts.dt.strftime(fmt).fillna("undated") if fmt else pd.Series("all", index=df.index)
+    files = []
+    os.makedirs(root, exist_ok=True)
+    for key, idx in sorted(keys.groupby(keys).groups.items()) if len(df) else []:
+        part = df.loc[idx].sort_values("timestamp", kind="stable")
+        rel  = f"{partition}={key}/part-0.parquet" if fmt else "part-0.parquet"
+        os.makedirs(os.path.dirname(os.path.join(root, rel)), exist_ok=True)
+        pq.write_table(_table(part, schema), os.path.join(root, rel), compression=compression)
+        files.append((rel, len(part)))
+    return files
+
+def _series(metrics):
+    import pandas as pd
+    from timeline import daily_series
+    days, counts = daily_series(metrics)
+    daily  = pd.DataFrame({"date": pd.to_datetime(days).date if len(days) else [], "messages": counts})
+    hours  = metrics.get("hourly_distribution") or {}
+    hourly = pd.DataFrame({"hour": range(24),
+                           "messages": [int(hours.get(h, hours.get(str(h), 0))) for h in range(24)]})
+    return daily, hourly
+
+def export(parsed, metrics, out_dir, analysis_id=None, source=None, partition="month",
+           compression=COMPRESSION):
+    """Writes parse_ufdr()-shaped evidence and its metrics to out_dir and
+    returns the manifest dict. An existing out_dir must be empty or a previous
+    export (it holds manifest.json), which is replaced; anything else is refused."""
+    pa, pq = _pa()
+    if partition not in PARTITIONS:
+        raise ValueError(f"partition must be one of {', '.join(PARTITIONS)}")
+    sch = schemas()
+    if os.path.exists(out_dir):
+        if not os.path.isdir(out_dir) or \
+           os.listdir(out_dir) and not os.path.isfile(os.path.join(out_dir, "manifest.json")):
+            raise ValueError(f"{out_dir} exists and is not a previous export; not replacing it")
+        shutil.rmtree(out_dir)
+    os.makedirs(out_dir)
+    daily, hourly = _series(metrics)
+    tables = {}
+    for name in ("messages", "calls"):
+        files = _write_partitioned(parsed[name], sch[name], os.path.join(out_dir, name),
+                                   partition, compression)
+        tables[name] = {"path": name + "/", "partitioning": None if partition == "none" else
+                        {"flavor": "hive", "field": partition}, "rows": sum(n for _, n in files),
+                        "files": [f for f, _ in files]}
+    for name, df in (("contacts", parsed["contacts"]), ("daily", daily), ("hourly", hourly)):
+        pq.write_table(_table(df, sch[name]), os.path.join(out_dir, name + ".parquet"),
+                       compression=compression)
+        tables[name] = {"path": name + ".parquet", "partitioning": None, "rows": len(df)}
+    size = 0
+    for name, t in tables.items():
+        t["schema"] = [{"name": f.name, "type": str(f.type), "nullable": f.nullable} for f in sch[name]]
+        p = os.path.join(out_dir, t["path"])
+        t["bytes"] = sum(os.path.getsize(os.path.join(r, f)) for r, _, fs in os.walk(p) for f in fs) \
+            if os.path.isdir(p) else os.path.getsize(p)
+        size += t["bytes"]
+    manifest = {"format_version": FORMAT_VERSION, "created": datetime.now().isoformat(timespec="seconds"),
+                "analysis_id": analysis_id, "source": source, "compression": compression,
+                "pyarrow": pa.__version__, "bytes": size, "tables": tables,
+                "metadata": metrics.get("metadata", {}),
+                "metrics": {k: v for k, v in metrics.items()
+                            if k not in ("metadata", "daily_series", "daily_volume", "hourly_distribution")}}
+    with open(os.path.join(out_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1, default=str)
+    print(f"[Export] {out_dir}: {tables['messages']['rows']} messages, {tables['calls']['rows']} calls, "
+          f"{size / 1024:.0f} KB")
+    return manifest
+
+def export_analysis(analysis_id, out_dir, **kw):
+    """export() for a stored analysis, read back from the evidence store."""
+    import database
+    rec = database.get_analysis(analysis_id)
+    if not rec:
+        raise ValueError(f"No analysis #{analysis_id}")
+    return export(database.load_parsed(analysis_id), rec["metrics"], out_dir,
+                  analysis_id=analysis_id, source=rec["file_name"], **kw)
+
+def export_zip(analysis_id, **kw):
+    """The export of a stored analysis as ZIP bytes (for a download button)."""
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp:
+        root = os.path.join(tmp, f"case_{analysis_id}")
+        export_analysis(analysis_id, root, **kw)
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, "w", zipfile.ZIP_STORED) as zf:   # parquet is already compressed
+            for r, _, fs in os.walk(root):
+                for f in sorted(fs):
+                    p = os.path.join(r, f)
+                    zf.write(p, os.path.relpath(p, tmp))
+    return buf.getvalue()
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("source", help="analysis id, or a UFDR .zip to parse")
+    ap.add_argument("--out", default="exports", help="parent directory of the export")
+    ap.add_argument("--partition", default="month", choices=list(PARTITIONS))
+    ap.add_argument("--compression", default=COMPRESSION, help="zstd, snappy, gzip, none")
+    args = ap.parse_args(argv)
+    kw = dict(partition=args.partition, compression=args.compression)
+    try:
+        if args.source.isdigit():
+            export_analysis(int(args.source), os.path.join(args.out, f"case_{args.source}"), **kw)
+        else:
+            from parser import parse_ufdr
+            from aggregator import aggregate
+            with open(args.source, "rb") as f:
+                parsed = parse_ufdr(f.read())
+            if parsed["messages"].empty:
+                print(f"[Export] FAILED: {'; '.join(parsed['errors']) or 'no messages'}")
+                return 1
+            name = os.path.splitext(os.path.basename(args.source))[0]
+            export(parsed, aggregate(parsed["messages"], parsed["calls"], parsed["metadata"]),
+                   os.path.join(args.out, name), source=os.path.basename(args.source), **kw)
+    except (RuntimeError, ValueError) as e:
+        print(f"[Export] FAILED: {e}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,84 @@
+"""
+import_budget.py — Startup import-cost report and budget check.
+Imports each entry point in a fresh interpreter under `python -X importtime`,
+reports its cumulative cost and the heaviest modules it pulled in, and exits
+non-zero when a budget is exceeded or the app's startup imports drag in a
+library that should load lazily.
+
+Run: python import_budget.py            (report + check)
+     python import_budget.py --top 12 --runs 5
+"""
+import argparse, ast, os, subprocess, sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Cumulative import budget per entry point, in ms (best of --runs), on top of
+# what a bare interpreter already imports (site, encodings, ...).
+# "app startup" is everything app.py imports at module level, streamlit included.
+BUDGET_MS = {
+    "app startup": 900,
+    "database":    40,
+    "pipeline":    40,
+    "pdf_jobs":    60,
+    "service":     150,
+    "startup":     20,
+}
+
+# Must not be imported before the first analysis — startup.prewarm() loads them.
+DEFERRED = ["pandas", "matplotlib", "networkx", "reportlab", "google.generativeai"]
+
+def app_imports():
+    """The module-level import statements of app.py, as one source string."""
+    tree = ast.parse(open(os.path.join(HERE, "app.py"), encoding="utf-8").read())
+    return "\n".join(ast.unparse(n) for n in tree.body if isinstance(n, (ast.Import, ast.ImportFrom)))
+
+def measure(code):
+    """({top-level module: cumulative_us}, all imported names) for one fresh
+    interpreter running `code`. Nesting shows as indentation in -X importtime."""
+    r = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=HERE,
+                       capture_output=True, text=True)
+    if r.returncode:
+        raise RuntimeError(r.stderr.strip().splitlines()[-1])
+    roots, names = {}, set()
+    for line in r.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cum, name = line[len("import time:"):].split("|")
+        if not cum.strip().isdigit():
+            continue
+        names.add(name.strip())
+        if len(name) - len(name.lstrip()) == 1:
+            roots[name.strip()] = int(cum)
+    return roots, names
+
+def report(label, code, runs, top, baseline):
+    roots, names = min((measure(code) for _ in range(runs)), key=lambda m: sum(m[0].values()))
+    roots = {k: v for k, v in roots.items() if k not in baseline}
+    total  = sum(roots.values()) / 1000
+    budget = BUDGET_MS.get(label)
+    ok     = budget is None or total <= budget
+    print(f"{label:<12} {total:>8.1f} ms  budget {budget or '-':>5}  {'OK' if ok else 'OVER'}")
+    for name, us in sorted(roots.items(), key=lambda kv: -kv[1])[:top]:
+        print(f"    {us / 1000:>8.1f} ms  {name}")
+    return ok, [m for m in DEFERRED if m in names]
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--runs", type=int, default=3, help="fresh interpreters per entry point")
+    ap.add_argument("--top",  type=int, default=6, help="heaviest top-level modules to list")
+    args = ap.parse_args()
+
+    failed, baseline = [], measure("pass")[0]
+    entries = [("app startup", app_imports())] + [(m, f"import {m}") for m in BUDGET_MS if m != "app startup"]
+    for label, code in entries:
+        ok, heavy = report(label, code, args.runs, args.top, baseline)
+        if not ok:
+            failed.append(f"{label} over budget")
+        if heavy:
+            failed.append(f"{label} imports deferred libraries: {', '.join(heavy)}")
+    for f in failed:
+        print(f"[Budget] FAIL {f}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
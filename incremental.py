@@ -0,0 +1,125 @@
+"""
+incremental.py — Follow-up extractions of a device analyzed before.
+A phone extracted again weeks later repeats nearly everything the first
+extraction held. The device is recognised by its metadata (IMEI or serial,
+plus model) and the new archive is cut down to the records the stored case
+has not seen: anything newer than the device's high-water mark, and older
+records whose hash is not among the stored ones (late-synced or restored
+messages). Only that delta is aggregated — folded into the aggregator state
+kept in device_state — stored as evidence and appended to the existing case,
+whose metrics, risks and summary are then rewritten.
+
+The archive is still read in full (the ZIP holds all of it), but
+aggregation, storage and risk scoring scale with the delta.
+"""
+import copy
+import numpy as np
+import pandas as pd
+from aggregator import STATE_VERSION, accumulate, finalize, new_state
+
+ID_KEYS   = ("imei", "serial", "serial_number", "meid")
+MSG_COLS  = ("contact_name", "timestamp", "body", "direction", "type")
+CALL_COLS = ("contact_name", "timestamp", "duration", "type")
+
+class StaleDelta(ValueError):
+    """The device's stored state changed after the delta was computed."""
+
+def device_key(meta):
+    """'<imei>|<model>' for a device, or None when metadata carries no IMEI/serial."""
+    ident = next((str(meta[k]).strip() for k in ID_KEYS if str(meta.get(k) or "").strip()), None)
+    if not ident:
+        return None
+    return f"{ident}|{str(meta.get('model') or '').strip().casefold()}"
+
+def record_hashes(df, cols):
+    """uint64 per record. Identical records within one archive are numbered
+    (first, second, ...) so a repeated "Ok" is two records, not one."""
+    if df.empty:
+        return np.empty(0, np.uint64)
+    h   = pd.util.hash_pandas_object(df[[c for c in cols if c in df]], index=False).to_numpy()
+    occ = pd.Series(h).groupby(h).cumcount().to_numpy()
+    return pd.util.hash_pandas_object(pd.DataFrame({"h": h, "o": occ}), index=False).to_numpy()
+
+def split(parsed, prior=None):
+    """(parsed with only unseen messages/calls, sorted hashes of everything
+    seen now, new high-water mark) against a device's stored state."""
+    seen = np.frombuffer(prior["hashes"], dtype=np.uint64) if prior else np.empty(0, np.uint64)
+    hw   = pd.Timestamp(prior["high_water"]) if prior and prior["high_water"] else None
+    out, fresh, marks = dict(parsed), [seen], [hw] if hw is not None else []
+    for kind, cols in (("messages", MSG_COLS), ("calls", CALL_COLS)):
+        df = parsed[kind]
+        if df.empty:
+            continue
+        h   = record_hashes(df, cols)
+        new = np.ones(len(h), bool)
+        if len(seen):
+            # at or below the mark (or undated): new only if its hash is unknown
+            check = ~(df["timestamp"] > hw).to_numpy() if hw is not None else new.copy()
+            pos   = np.minimum(np.searchsorted(seen, h[check]), len(seen) - 1)
+            new[check] = seen[pos] != h[check]
+        if not new.all():
+            out[kind] = df[new].reset_index(drop=True)
+        fresh.append(h[new])
+        if df["timestamp"].notna().any():
+            marks.append(df["timestamp"].max())
+    return out, np.union1d(seen, np.concatenate(fresh)), max(marks).isoformat() if marks else None
+
+def prepare(parsed, username):
+    """parsed cut to what username's stored case for this device lacks, plus
+    the device dict pipeline.analyze() returns as out["device"] (None when
+    the device can't be identified)."""
+    import database
+    key = device_key(parsed["metadata"])
+    if not key:
+        return parsed, None
+    prior = database.get_device_state(username, key)
+    if prior and prior["state"].get("v") != STATE_VERSION:
+        # stored by an older aggregator: rebuild from the case's evidence once
+        old = database.load_parsed(prior["analysis_id"])
+        prior["state"] = accumulate(new_state(), old["messages"], old["calls"])
+    delta, hashes, hw = split(parsed, prior)
+    dev = {"key": key, "user": username, "high_water": hw, "hashes": hashes.tobytes(),
+           "state": copy.deepcopy(prior["state"]) if prior else None,
+           "base": {"analysis_id": prior["analysis_id"], "version": prior["version"]} if prior else None,
+           "new_messages": len(delta["messages"]), "new_calls": len(delta["calls"])}
+    if prior:
+        print(f"[Delta] {key}: follow-up of analysis #{prior['analysis_id']} — "
+              f"{dev['new_messages']} of {len(parsed['messages'])} messages and "
+              f"{dev['new_calls']} of {len(parsed['calls'])} calls are new")
+    return delta, dev
+
+def aggregate(dev, messages, calls, metadata):
+    """Folds the delta into the device's running state (kept in dev) and
+    returns the metrics for the whole device history."""
+    dev["state"] = accumulate(dev["state"] or new_state(), messages, calls)
+    return finalize(dev["state"], metadata)
+
+def save(res, username, file_name, description, archive_sha256=None):
+    """Saves a pipeline result: a new analysis, or, when it is a follow-up of
+    a device already on file, folded into that case. Returns (id, folded).
+    Raises StaleDelta, before writing anything, when another save for the
+    same device got in first — analyze the archive again. The version check
+    runs under the write lock, so two processes can't both pass it."""
+    import database
+    dev  = res.get("device")
+    base = dev and dev["base"]
+    with database.transaction(immediate=bool(dev)):
+        if dev and database.device_version(username, dev["key"]) != (base and base["version"]):
+            raise StaleDelta(f"device {dev['key']} changed since this archive was analyzed")
+        if base:
+            aid = base["analysis_id"]
+            database.update_analysis(aid, res["metrics"], res["summary"], res["risks"],
+                                     file_name, description, archive_sha256)
+            if res.get("pdf"):
+                database.attach_pdf(aid, res["pdf"])
+        else:
+            aid = database.save_analysis(username, file_name, description, res["metrics"],
+                                         res["summary"], res["risks"], res.get("pdf") or None,
+                                         archive_sha256=archive_sha256)
+        if "parsed" in res:
+            database.store_parsed(aid, res["parsed"])
+        database.save_timings(aid, res.get("spans"), res.get("profile"))
+        if dev:
+            database.save_device_state(username, dev["key"], aid, dev["high_water"],
+                                       dev["state"], dev["hashes"])
+    return aid, bool(base)
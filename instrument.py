@@ -0,0 +1,159 @@
+"""
+instrument.py — Timing spans for the analysis pipeline.
+trace() opens the root span of one analysis; span() nests under whichever
+span is current. The current span lives in a contextvar, so stages submitted
+with contextvars.copy_context().run (pipeline.run_stages does) keep their
+parent across threads. Each span records wall and thread-CPU seconds, its
+start offset in the trace and the process's peak RSS when it closed. Outside
+a trace, span() does next to nothing.
+
+UFDR_PROFILE turns on the expensive extras for every trace:
+    cpu      cProfile of each top-level stage, merged (top functions by cumulative time)
+    mem      tracemalloc peak per span (stages running at once share one peak)
+    cpu,mem  both
+Rows are persisted with database.save_timings() and shown on the admin page.
+"""
+import contextvars, io, json, os, sys, threading, time
+from contextlib import contextmanager
+
+PROFILE_TOP = 40
+_current = contextvars.ContextVar("ufdr_span", default=None)
+_local   = threading.local()          # cProfile already running on this thread
+_mem_lock = threading.Lock()
+
+try:
+    import resource
+    def _rss_mb():
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round(peak / (1 << 20) if sys.platform == "darwin" else peak / 1024, 1)
+except ImportError:                    # Windows
+    def _rss_mb():
+        return None
+
+def modes():
+    return {m.strip() for m in os.getenv("UFDR_PROFILE", "").lower().split(",") if m.strip()}
+
+class Span:
+    __slots__ = ("name", "attrs", "children", "trace", "parent", "start", "wall", "cpu",
+                 "rss_mb", "alloc_mb", "mem0", "mem_peak")
+
+    def __init__(self, name, attrs=None, trace=None, parent=None):
+        self.name, self.attrs, self.children = name, attrs or {}, []
+        self.trace, self.parent = trace, parent
+        self.start = self.wall = self.cpu = self.rss_mb = self.alloc_mb = None
+        self.mem0 = self.mem_peak = 0
+
+class Trace:
+    def __init__(self, name, modes):
+        self.modes, self.t0 = modes, time.perf_counter()
+        self.root  = Span(name, trace=self)
+        self.stats, self.lock = None, threading.Lock()
+
+    def rows(self):
+        """Flat, picklable span rows; stage is the '/'-joined path below the root."""
+        out = []
+        def walk(s, path):
+            for c in s.children:
+                p = f"{path}/{c.name}" if path else c.name
+                out.append({"stage": p, "start_s": c.start, "wall_s": c.wall, "cpu_s": c.cpu,
+                            "rss_mb": c.rss_mb, "alloc_mb": c.alloc_mb,
+                            "attrs": json.dumps(c.attrs, default=str) if c.attrs else None})
+                walk(c, p)
+        out.append({"stage": "total", "start_s": 0.0, "wall_s": self.root.wall,
+                    "cpu_s": self.root.cpu, "rss_mb": self.root.rss_mb,
+                    "alloc_mb": self.root.alloc_mb, "attrs": None})
+        walk(self.root, "")
+        return out
+
+    def profile_text(self):
+        if self.stats is None:
+            return None
+        buf = io.StringIO()
+        self.stats.stream = buf
+        self.stats.sort_stats("cumulative").print_stats(PROFILE_TOP)
+        return buf.getvalue()
+
+    def _merge(self, prof):
+        import pstats
+        with self.lock:
+            if self.stats is None: self.stats = pstats.Stats(prof)
+            else:                  self.stats.add(prof)
+
+def _mem_enter(s):
+    import tracemalloc
+    with _mem_lock:
+        cur, peak = tracemalloc.get_traced_memory()
+        if s.parent is not None:
+            s.parent.mem_peak = max(s.parent.mem_peak, peak)
+        tracemalloc.reset_peak()
+        s.mem0 = cur
+
+def _mem_exit(s):
+    import tracemalloc
+    with _mem_lock:
+        peak = max(s.mem_peak, tracemalloc.get_traced_memory()[1])
+        s.alloc_mb = round(max(peak - s.mem0, 0) / (1 << 20), 2)
+        if s.parent is not None:
+            s.parent.mem_peak = max(s.parent.mem_peak, peak)
+
+def _open(s):
+    s.start = round(time.perf_counter() - s.trace.t0, 4)
+    if "mem" in s.trace.modes: _mem_enter(s)
+    return time.perf_counter(), time.thread_time()
+
+def _close(s, t0, c0):
+    s.wall   = round(time.perf_counter() - t0, 4)
+    s.cpu    = round(time.thread_time() - c0, 4)
+    s.rss_mb = _rss_mb()
+    if "mem" in s.trace.modes: _mem_exit(s)
+
+@contextmanager
+def span(name, **attrs):
+    """Times a block under the current span; yields the Span so callers can
+    add attrs (rows, bytes, ...) once they know them."""
+    parent = _current.get()
+    if parent is None:
+        yield Span(name, attrs)
+        return
+    s = Span(name, attrs, parent.trace, parent)
+    parent.children.append(s)
+    token = _current.set(s)
+    prof  = None
+    if "cpu" in s.trace.modes and parent is s.trace.root and not getattr(_local, "on", False):
+        import cProfile
+        prof = cProfile.Profile()
+        try:
+            prof.enable(); _local.on = True
+        except ValueError:             # another profiler owns this interpreter
+            prof = None
+    t0, c0 = _open(s)
+    try:
+        yield s
+    finally:
+        _close(s, t0, c0)
+        if prof is not None:
+            prof.disable(); _local.on = False
+            s.trace._merge(prof)
+        _current.reset(token)
+
+@contextmanager
+def trace(name="analysis", profile=None):
+    """Root span for one analysis. profile: set of modes, default UFDR_PROFILE."""
+    tr = Trace(name, modes() if profile is None else set(profile))
+    started = False
+    if "mem" in tr.modes:
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(); started = True
+    token = _current.set(tr.root)
+    t0, c0 = _open(tr.root)
+    p0 = time.process_time()
+    try:
+        yield tr
+    finally:
+        _close(tr.root, t0, c0)
+        tr.root.cpu = round(time.process_time() - p0, 4)    # all threads, not just this one
+        _current.reset(token)
+        if started:
+            import tracemalloc
+            tracemalloc.stop()
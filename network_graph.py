@@ -1,9 +1,14 @@
-"""network_graph.py — Generates communication network as base64 PNG."""
+"""network_graph.py — Generates communication network as base64 PNG.
+Uses the object-oriented Figure API (no pyplot global state), so graphs can be
+rendered from worker threads alongside other pipeline stages.
+Solid edges: subject ↔ contact message volume. Dashed edges: contacts active
+within the same few minutes (metrics["coactivity"], coactivity.py)."""
 import io, base64
-import matplotlib
-matplotlib.use("Agg")
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 import matplotlib.patches as mpatches
+from matplotlib.lines import Line2D
+
+CO_EDGES = 8      # strongest co-activity pairs drawn
 
 def generate_network_graph(metrics: dict) -> str:
     edges = metrics.get("network_edges", [])
@@ -16,6 +21,10 @@ def generate_network_graph(metrics: dict) -> str:
         for e in edges:
             G.add_node(e["target"], w=e["weight"], subj=False)
             G.add_edge("Subject", e["target"], weight=e["weight"])
+        co = metrics.get("coactivity", {})
+        co_edges = [p for p in co.get("pairs", [])[:CO_EDGES] if p["a"] in G and p["b"] in G]
+        for p in co_edges:
+            G.add_edge(p["a"], p["b"], weight=p["count"], co=True)
 
         pos = nx.spring_layout(G, seed=42, k=2.5)
         pos["Subject"] = (0, 0)
@@ -36,12 +45,20 @@ def generate_network_graph(metrics: dict) -> str:
                 else:
                     colors.append("#2ed573")
 
-        max_ew = max(d["weight"] for _,_,d in G.edges(data=True))
-        ewidths = [1+(d["weight"]/max_ew)*8 for _,_,d in G.edges(data=True)]
+        primary = [(u,v,d) for u,v,d in G.edges(data=True) if not d.get("co")]
+        max_ew  = max(d["weight"] for _,_,d in primary)
+        ewidths = [1+(d["weight"]/max_ew)*8 for _,_,d in primary]
 
-        fig, ax = plt.subplots(figsize=(10,8))
+        fig = Figure(figsize=(10,8))
+        ax  = fig.subplots()
         fig.patch.set_facecolor("#0a0e27"); ax.set_facecolor("#0a0e27")
-        nx.draw_networkx_edges(G, pos, edge_color="#00d9ff", alpha=0.4, width=ewidths, ax=ax)
+        nx.draw_networkx_edges(G, pos, edgelist=[(u,v) for u,v,_ in primary], edge_color="#00d9ff",
+                               alpha=0.4, width=ewidths, ax=ax)
+        if co_edges:
+            max_co = max(p["count"] for p in co_edges)
+            nx.draw_networkx_edges(G, pos, edgelist=[(p["a"],p["b"]) for p in co_edges],
+                                   edge_color="#a55eea", style="dashed", alpha=0.7,
+                                   width=[1+(p["count"]/max_co)*4 for p in co_edges], ax=ax)
         nx.draw_networkx_nodes(G, pos, node_size=sizes, node_color=colors, alpha=0.9, ax=ax)
         nx.draw_networkx_labels(G, pos, font_color="white", font_size=9, font_weight="bold", ax=ax)
         edge_labels = {(e["source"],e["target"]):str(e["weight"]) for e in edges}
@@ -51,14 +68,16 @@ def generate_network_graph(metrics: dict) -> str:
                   mpatches.Patch(color="#ff4757",label="Primary Contact"),
                   mpatches.Patch(color="#ffa502",label="Unknown"),
                   mpatches.Patch(color="#2ed573",label="Others")]
+        if co_edges:
+            legend.append(Line2D([], [], color="#a55eea", linestyle="--",
+                                 label=f"Co-active (≤{co.get('window_s', 300)//60} min)"))
         ax.legend(handles=legend, loc="lower right", facecolor="#111936",
                   labelcolor="white", edgecolor="#00d9ff", fontsize=8)
         ax.set_title("Communication Network", color="#00d9ff", fontsize=14, fontweight="bold")
-        ax.axis("off"); plt.tight_layout()
+        ax.axis("off"); fig.tight_layout()
 
         buf = io.BytesIO()
-        plt.savefig(buf, format="png", dpi=120, bbox_inches="tight", facecolor="#0a0e27")
-        plt.close()
+        fig.savefig(buf, format="png", dpi=120, bbox_inches="tight", facecolor="#0a0e27")
         buf.seek(0)
         return base64.b64encode(buf.read()).decode()
     except Exception as e:
@@ -5,6 +5,7 @@ Handles multiple XML structures including our generated format.
 import zipfile, io, xml.etree.ElementTree as ET
 import pandas as pd
 from datetime import datetime
+from instrument import span
 
 def parse_ufdr(file_bytes: bytes) -> dict:
     result = {"messages": pd.DataFrame(), "calls": pd.DataFrame(),
@@ -17,40 +18,47 @@ def parse_ufdr(file_bytes: bytes) -> dict:
             for fname in names:
                 if not fname.lower().endswith(".xml"):
                     continue
-                data = zf.read(fname)
-                fl   = fname.lower()
-                if any(k in fl for k in ["message","sms","chat","whatsapp"]):
-                    m = _parse_messages(data)
-                    msgs.extend(m)
-                    print(f"[Parser] {fname}: {len(m)} messages")
-                elif any(k in fl for k in ["call","phone"]):
-                    c = _parse_calls(data)
-                    calls.extend(c)
-                    print(f"[Parser] {fname}: {len(c)} calls")
-                elif any(k in fl for k in ["contact","address"]):
-                    contacts.extend(_parse_contacts(data))
-                elif any(k in fl for k in ["meta","device"]):
-                    result["metadata"] = _parse_meta(data)
-                else:
-                    # Try as messages anyway
-                    m = _parse_messages(data)
-                    if m:
+                with span(fname) as sp:
+                    data = zf.read(fname)
+                    fl   = fname.lower()
+                    sp.attrs["bytes"] = len(data)
+                    if any(k in fl for k in ["message","sms","chat","whatsapp"]):
+                        m = _parse_messages(data)
                         msgs.extend(m)
-                        print(f"[Parser] {fname} auto-detected: {len(m)} messages")
-            if msgs:
-                df = pd.DataFrame(msgs)
-                df["timestamp"] = pd.to_datetime(df["timestamp"], errors="coerce")
-                df["hour"]      = df["timestamp"].dt.hour
-                df["date"]      = df["timestamp"].dt.date
-                result["messages"] = df
-            else:
-                result["errors"].append("No messages found in ZIP")
-            if calls:
-                df = pd.DataFrame(calls)
-                df["timestamp"] = pd.to_datetime(df["timestamp"], errors="coerce")
-                result["calls"] = df
-            if contacts:
-                result["contacts"] = pd.DataFrame(contacts)
+                        sp.attrs["messages"] = len(m)
+                        print(f"[Parser] {fname}: {len(m)} messages")
+                    elif any(k in fl for k in ["call","phone"]):
+                        c = _parse_calls(data)
+                        calls.extend(c)
+                        sp.attrs["calls"] = len(c)
+                        print(f"[Parser] {fname}: {len(c)} calls")
+                    elif any(k in fl for k in ["contact","address"]):
+                        contacts.extend(_parse_contacts(data))
+                    elif any(k in fl for k in ["meta","device"]):
+                        result["metadata"] = _parse_meta(data)
+                    else:
+                        # Try as messages anyway
+                        m = _parse_messages(data)
+                        if m:
+                            msgs.extend(m)
+                            sp.attrs["messages"] = len(m)
+                            print(f"[Parser] {fname} auto-detected: {len(m)} messages")
+                    del data
+            with span("frames"):
+                if msgs:
+                    df = pd.DataFrame(msgs)
+                    df["timestamp"] = pd.to_datetime(df["timestamp"], errors="coerce")
+                    df["hour"]      = df["timestamp"].dt.hour
+                    df["date"]      = df["timestamp"].dt.date
+                    result["messages"] = df
+                else:
+                    result["errors"].append("No messages found in ZIP")
+                if calls:
+                    df = pd.DataFrame(calls)
+                    df["timestamp"] = pd.to_datetime(df["timestamp"], errors="coerce")
+                    result["calls"] = df
+                if contacts:
+                    result["contacts"] = pd.DataFrame(contacts)
     except zipfile.BadZipFile:
         result["errors"].append("Not a valid ZIP file.")
     except Exception as e:
@@ -86,10 +94,13 @@ def _msg_row(el):
         return None
     contact = (_get(el,"contact_name") or _get(el,"contact") or _get(el,"name")
                or _get(el,"from") or _get(el,"sender") or _get(el,"party")
-               or _get(el,"address") or el.get("address") or "Unknown")
-    body    = (_get(el,"body") or _get(el,"text") or _get(el,"content") or "")
-    dirn    = (_get(el,"direction") or _get(el,"type") or el.get("type") or "unknown").lower()
-    if any(k in dirn for k in ["sent","out","1"]): dirn = "outgoing"
+               or _get(el,"address") or el.get("address") or _get(el,"Party") or "Unknown")
+    body    = (_get(el,"body") or _get(el,"text") or _get(el,"content") or _get(el,"Body") or "")
+    dirn    = (_get(el,"direction") or _get(el,"Direction") or _get(el,"type")
+               or el.get("type") or "unknown").lower()
+    if el.tag == "sms" and dirn in ("1","2"):      # Android backup: 1 inbox, 2 sent
+        dirn = "incoming" if dirn == "1" else "outgoing"
+    elif any(k in dirn for k in ["sent","out","1"]): dirn = "outgoing"
     elif any(k in dirn for k in ["recv","in","0"]): dirn = "incoming"
     return {"contact_name": contact, "timestamp": ts, "body": body,
             "direction": dirn, "type": _get(el,"type","SMS")}
@@ -142,6 +153,7 @@ def _parse_ts(s):
         except: pass
     try:
         t = float(s.strip())
+        if t > 1e11: t /= 1000                      # epoch milliseconds
         if t > 1e9: return datetime.fromtimestamp(t)
     except: pass
     return None
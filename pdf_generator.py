@@ -1,39 +1,159 @@
 """pdf_generator.py — Generates professional forensic PDF report."""
-import io, base64
+import io, base64, heapq, textwrap
+from collections import deque
 from datetime import datetime
+from functools import lru_cache
+from itertools import islice
+from types import SimpleNamespace
 
-def generate_pdf(metrics: dict, summary: str, risks: list, graph_b64: str) -> bytes:
+APPENDIX_ROWS_PER_TABLE = 40   # one chunk ≈ one A4 page of evidence rows
+APPENDIX_WRAP           = 62   # characters per line in the detail column
+
+@lru_cache(maxsize=1)
+def _theme():
+    """Colours, paragraph and table styles — built once per process, not per report."""
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib import colors
+    from reportlab.lib.styles import ParagraphStyle
+    from reportlab.lib.enums import TA_CENTER
+    from reportlab.platypus import TableStyle
+
+    t = SimpleNamespace(
+        NAVY  = colors.HexColor("#0a0e27"), PANEL = colors.HexColor("#111936"),
+        ALT   = colors.HexColor("#151c40"), CYAN  = colors.HexColor("#00d9ff"),
+        RED   = colors.HexColor("#ff4757"), AMBER = colors.HexColor("#ffa502"),
+        GREEN = colors.HexColor("#2ed573"), MUTED = colors.HexColor("#8892b0"),
+        WHITE = colors.white, A4 = A4)
+
+    def S(name, **kw): return ParagraphStyle(name, **kw)
+    t.title_s = S("T", fontSize=18, textColor=t.CYAN,  alignment=TA_CENTER, fontName="Helvetica-Bold", spaceAfter=4)
+    t.sub_s   = S("S", fontSize=9,  textColor=t.MUTED, alignment=TA_CENTER, spaceAfter=2)
+    t.h2_s    = S("H", fontSize=12, textColor=t.CYAN,  fontName="Helvetica-Bold", spaceAfter=4)
+    t.body_s  = S("B", fontSize=8,  textColor=t.WHITE, leading=13, spaceAfter=3)
+    t.muted_s = S("M", fontSize=7,  textColor=t.MUTED, leading=10)
+    t.sev_col = {"HIGH":t.RED,"MEDIUM":t.AMBER,"INFO":t.CYAN}
+    t.risk_s  = {k: S("rh"+k, fontSize=9, textColor=c, fontName="Helvetica-Bold")
+                 for k, c in t.sev_col.items()}
+    t.appendix_ts = TableStyle([
+        ("BACKGROUND",(0,0),(-1,0),t.CYAN),("TEXTCOLOR",(0,0),(-1,0),t.NAVY),
+        ("FONTNAME",(0,0),(-1,0),"Helvetica-Bold"),("FONTSIZE",(0,0),(-1,-1),6.5),
+        ("LEADING",(0,0),(-1,-1),8),("TEXTCOLOR",(0,1),(-1,-1),t.WHITE),
+        ("ROWBACKGROUNDS",(0,1),(-1,-1),[t.PANEL,t.ALT]),("VALIGN",(0,0),(-1,-1),"TOP"),
+        ("GRID",(0,0),(-1,-1),0.25,colors.HexColor("#1a2040")),
+        ("TOPPADDING",(0,0),(-1,-1),2),("BOTTOMPADDING",(0,0),(-1,-1),2),
+    ])
+    return t
+
+def evidence_rows(messages, calls):
+    """Chronological (timestamp, kind, contact, direction, detail) rows merging the
+    parsed message and call frames — a lazy iterator suitable for `appendix`."""
+    def msgs():
+        if messages is None or messages.empty: return
+        df = messages.sort_values("timestamp", kind="stable")
+        for ts, c, d, b in zip(df["timestamp"], df["contact_name"], df["direction"], df["body"]):
+            yield (ts, "SMS", c, d, b)
+    def calls_():
+        if calls is None or calls.empty: return
+        df = calls.sort_values("timestamp", kind="stable")
+        for ts, c, dur, typ in zip(df["timestamp"], df["contact_name"], df["duration"], df["type"]):
+            yield (ts, "CALL", c, typ, f"{dur}s")
+    return heapq.merge(msgs(), calls_(), key=lambda r: r[0])
+
+class _FlowableStream:
+    """Just enough of the list protocol for platypus' build loop (which only
+    touches the head of the story) so appendix tables are created on demand
+    and released once drawn instead of living in one giant story list."""
+    def __init__(self, head, tail):
+        self._buf  = deque(head)
+        self._tail = iter(tail)
+
+    def _fill(self, n):
+        while len(self._buf) < n and self._tail is not None:
+            try: self._buf.append(next(self._tail))
+            except StopIteration: self._tail = None
+
+    def __len__(self):
+        self._fill(2)   # lookahead so keepWithNext sees its successor
+        return len(self._buf)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            self._fill(i.stop or 0)
+            return list(islice(self._buf, i.start or 0, i.stop))
+        self._fill(i + 1)
+        return self._buf[i]
+
+    @staticmethod
+    def _head(i, what):
+        # platypus only edits the head of the story; anything else would be
+        # silently misapplied here, so fail loudly (e.g. after a ReportLab upgrade)
+        if isinstance(i, slice):
+            if i.start not in (None, 0) or i.step not in (None, 1):
+                raise NotImplementedError(f"_FlowableStream: {what} [{i.start}:{i.stop}:{i.step}]")
+            return i.stop or 0
+        if i != 0:
+            raise NotImplementedError(f"_FlowableStream: {what} at index {i}")
+        return 1
+
+    def __delitem__(self, i):
+        n = self._head(i, "delete")
+        self._fill(n)
+        for _ in range(n): self._buf.popleft()
+
+    def __setitem__(self, i, items):
+        # only flowables[0:0] = S, pushing split parts back
+        if not (isinstance(i, slice) and self._head(i, "assign") == 0):
+            raise NotImplementedError(f"_FlowableStream: assign to {i!r}")
+        self._buf.extendleft(reversed(list(items)))
+
+    def insert(self, i, f):
+        if i != 0:
+            raise NotImplementedError(f"_FlowableStream: insert at index {i}")
+        self._buf.appendleft(f)
+
+def _appendix_tables(rows):
+    from reportlab.lib.units import mm
+    from reportlab.platypus import Table
+    T   = _theme()
+    hdr = ["Timestamp","Kind","Contact","Direction","Detail"]
+    cw  = [30*mm,12*mm,40*mm,18*mm,80*mm]
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, APPENDIX_ROWS_PER_TABLE))
+        if not chunk: return
+        data = [hdr]
+        for ts, kind, contact, dirn, detail in chunk:
+            ts = ts.strftime("%Y-%m-%d %H:%M:%S") if hasattr(ts, "strftime") else str(ts)
+            detail = str(detail or "")
+            if len(detail) > APPENDIX_WRAP:
+                detail = "\n".join(textwrap.wrap(detail, APPENDIX_WRAP)) or detail
+            data.append([ts, kind, str(contact)[:32], str(dirn), detail])
+        t = Table(data, colWidths=cw)
+        t.setStyle(T.appendix_ts)
+        yield t
+
+def generate_pdf(metrics: dict, summary: str, risks: list, graph_b64: str,
+                 appendix=None) -> bytes:
+    """appendix: optional iterable of evidence rows (see evidence_rows) written as a
+    full chronological log. Rows are consumed lazily in page-sized tables."""
     try:
-        from reportlab.lib.pagesizes import A4
         from reportlab.lib import colors
         from reportlab.lib.units import mm
-        from reportlab.lib.styles import ParagraphStyle
-        from reportlab.lib.enums import TA_CENTER, TA_LEFT
         from reportlab.platypus import (SimpleDocTemplate, Paragraph, Spacer,
             Table, TableStyle, HRFlowable, Image as RLImage, PageBreak)
 
-        NAVY  = colors.HexColor("#0a0e27")
-        PANEL = colors.HexColor("#111936")
-        CYAN  = colors.HexColor("#00d9ff")
-        RED   = colors.HexColor("#ff4757")
-        AMBER = colors.HexColor("#ffa502")
-        GREEN = colors.HexColor("#2ed573")
-        MUTED = colors.HexColor("#8892b0")
-        WHITE = colors.white
-        W, H  = A4
+        T = _theme()
+        NAVY, PANEL, CYAN, MUTED, WHITE = T.NAVY, T.PANEL, T.CYAN, T.MUTED, T.WHITE
+        RED, AMBER, GREEN = T.RED, T.AMBER, T.GREEN
+        W, H  = T.A4
+        title_s, sub_s, h2_s, body_s, muted_s = T.title_s, T.sub_s, T.h2_s, T.body_s, T.muted_s
 
         buf = io.BytesIO()
-        doc = SimpleDocTemplate(buf, pagesize=A4,
+        doc = SimpleDocTemplate(buf, pagesize=T.A4,
               topMargin=18*mm, bottomMargin=15*mm,
               leftMargin=15*mm, rightMargin=15*mm)
 
-        def S(name, **kw): return ParagraphStyle(name, **kw)
-        title_s  = S("T", fontSize=18, textColor=CYAN,  alignment=TA_CENTER, fontName="Helvetica-Bold", spaceAfter=4)
-        sub_s    = S("S", fontSize=9,  textColor=MUTED, alignment=TA_CENTER, spaceAfter=2)
-        h2_s     = S("H", fontSize=12, textColor=CYAN,  fontName="Helvetica-Bold", spaceAfter=4)
-        body_s   = S("B", fontSize=8,  textColor=WHITE, leading=13, spaceAfter=3)
-        muted_s  = S("M", fontSize=7,  textColor=MUTED, leading=10)
-
+        generated = datetime.now().strftime('%Y-%m-%d %H:%M')
         def bg(canvas, doc):
             canvas.saveState()
             canvas.setFillColor(NAVY);  canvas.rect(0,0,W,H,fill=1,stroke=0)
@@ -41,7 +161,7 @@ def generate_pdf(metrics: dict, summary: str, risks: list, graph_b64: str) -> by
             canvas.setFillColor(CYAN);  canvas.setFont("Helvetica-Bold",8)
             canvas.drawString(15*mm, H-8*mm, "⚠ CONFIDENTIAL — RESTRICTED FORENSIC DOCUMENT")
             canvas.setFillColor(MUTED); canvas.setFont("Helvetica",7)
-            canvas.drawRightString(W-15*mm,H-8*mm,f"Generated: {datetime.now().strftime('%Y-%m-%d %H:%M')}")
+            canvas.drawRightString(W-15*mm,H-8*mm,f"Generated: {generated}")
             canvas.setFillColor(PANEL); canvas.rect(0,0,W,10*mm,fill=1,stroke=0)
             canvas.setFillColor(MUTED); canvas.setFont("Helvetica",7)
             canvas.drawString(15*mm,3.5*mm,"UFDRINSIGHT Forensic Intelligence Platform | Authorized Use Only")
@@ -60,7 +180,7 @@ def generate_pdf(metrics: dict, summary: str, risks: list, graph_b64: str) -> by
         meta_data = [
             ["Case ID", meta.get("case_id","CASE-001"), "Device", meta.get("model","Unknown")],
             ["Date Range", metrics.get("date_range","—"), "Extraction", meta.get("extraction_date","—")],
-            ["Generated", datetime.now().strftime("%Y-%m-%d %H:%M"), "Platform", "UFDRINSIGHT"],
+            ["Generated", generated, "Platform", "UFDRINSIGHT"],
         ]
         mt = Table(meta_data, colWidths=[35*mm,60*mm,35*mm,50*mm])
         mt.setStyle(TableStyle([
@@ -69,7 +189,7 @@ def generate_pdf(metrics: dict, summary: str, risks: list, graph_b64: str) -> by
             ("TEXTCOLOR",(1,0),(1,-1),WHITE),("TEXTCOLOR",(3,0),(3,-1),WHITE),
             ("FONTNAME",(0,0),(0,-1),"Helvetica-Bold"),("FONTNAME",(2,0),(2,-1),"Helvetica-Bold"),
             ("FONTSIZE",(0,0),(-1,-1),8),("GRID",(0,0),(-1,-1),0.3,CYAN),("PADDING",(0,0),(-1,-1),5),
-            ("ROWBACKGROUNDS",(0,0),(-1,-1),[PANEL,colors.HexColor("#151c40")]),
+            ("ROWBACKGROUNDS",(0,0),(-1,-1),[PANEL,T.ALT]),
         ]))
         story.append(mt); story.append(Spacer(1,4*mm))
 
@@ -81,7 +201,7 @@ def generate_pdf(metrics: dict, summary: str, risks: list, graph_b64: str) -> by
                       f"{metrics.get('night_activity_pct',0)}%", str(metrics.get("avg_daily_messages",0))]
         kpi_tbl = Table([kpi_vals, kpi_data_v], colWidths=[30*mm]*6)
         kpi_tbl.setStyle(TableStyle([
-            ("BACKGROUND",(0,0),(-1,0),PANEL),("BACKGROUND",(0,1),(-1,1),colors.HexColor("#151c40")),
+            ("BACKGROUND",(0,0),(-1,0),PANEL),("BACKGROUND",(0,1),(-1,1),T.ALT),
             ("TEXTCOLOR",(0,0),(-1,0),CYAN),("TEXTCOLOR",(0,1),(-1,1),WHITE),
             ("FONTNAME",(0,1),(-1,1),"Helvetica-Bold"),("FONTSIZE",(0,0),(-1,0),7),
             ("FONTSIZE",(0,1),(-1,1),13),("ALIGN",(0,0),(-1,-1),"CENTER"),
@@ -89,6 +209,28 @@ def generate_pdf(metrics: dict, summary: str, risks: list, graph_b64: str) -> by
         ]))
         story.append(kpi_tbl); story.append(Spacer(1,4*mm))
 
+        # Devices (multi-device case)
+        if metrics.get("devices"):
+            story.extend(section("DEVICES"))
+            d = metrics.get("dedupe", {})
+            rows = [["Device","Model","Owner","Messages","Duplicates","Calls","Night %"]] + [
+                    [str(v["device"])[:28], str(v["model"])[:22], str(v["owner"])[:16],
+                     str(v["messages"]), str(v["duplicate_messages"] + v["duplicate_calls"]),
+                     str(v["calls"]), f"{v['night_pct']}%"] for v in metrics["devices"]]
+            dt = Table(rows, colWidths=[45*mm,35*mm,30*mm,20*mm,20*mm,15*mm,15*mm])
+            dt.setStyle(TableStyle([("BACKGROUND",(0,0),(-1,0),CYAN),("TEXTCOLOR",(0,0),(-1,0),NAVY),
+                   ("FONTNAME",(0,0),(-1,0),"Helvetica-Bold"),("FONTSIZE",(0,0),(-1,-1),8),
+                   ("ALIGN",(3,0),(-1,-1),"CENTER"),
+                   ("GRID",(0,0),(-1,-1),0.3,colors.HexColor("#1a2040")),
+                   ("ROWBACKGROUNDS",(0,1),(-1,-1),[PANEL,T.ALT]),
+                   ("TEXTCOLOR",(0,1),(-1,-1),WHITE),("ROWHEIGHT",(0,0),(-1,-1),7*mm)]))
+            story.append(dt); story.append(Spacer(1,2*mm))
+            story.append(Paragraph(f"{d.get('messages_in',0)} messages and {d.get('calls_in',0)} calls "
+                f"across {len(metrics['devices'])} extractions; {d.get('messages_out',0)} messages and "
+                f"{d.get('calls_out',0)} calls remain after merging records present on more than one "
+                f"device (clock-skew window {d.get('window_s')}s).", muted_s))
+            story.append(Spacer(1,4*mm))
+
         # Summary
         story.extend(section("EXECUTIVE SUMMARY"))
         for para in summary.split("\n\n"):
@@ -106,7 +248,7 @@ def generate_pdf(metrics: dict, summary: str, risks: list, graph_b64: str) -> by
                    ("FONTNAME",(0,0),(-1,0),"Helvetica-Bold"),("FONTSIZE",(0,0),(-1,-1),8),
                    ("ALIGN",(0,0),(-1,-1),"CENTER"),("ALIGN",(1,0),(1,-1),"LEFT"),
                    ("GRID",(0,0),(-1,-1),0.3,colors.HexColor("#1a2040")),
-                   ("ROWBACKGROUNDS",(0,1),(-1,-1),[PANEL,colors.HexColor("#151c40")]),
+                   ("ROWBACKGROUNDS",(0,1),(-1,-1),[PANEL,T.ALT]),
                    ("TEXTCOLOR",(0,1),(-1,-1),WHITE),("ROWHEIGHT",(0,0),(-1,-1),7*mm)]
         for i, c in enumerate(contacts,1):
             ts_list.append(("TEXTCOLOR",(5,i),(5,i),pc.get(c["priority"],GREEN)))
@@ -116,12 +258,11 @@ def generate_pdf(metrics: dict, summary: str, risks: list, graph_b64: str) -> by
         # Risks
         story.append(PageBreak())
         story.extend(section("RISK SIGNALS"))
-        sc = {"HIGH":RED,"MEDIUM":AMBER,"INFO":CYAN}
         for risk in risks:
-            col = sc.get(risk["severity"],CYAN)
+            sev = risk["severity"] if risk["severity"] in T.sev_col else "INFO"
+            col = T.sev_col[sev]
             row_data = [[
-                Paragraph(f"<b>{risk['icon']} {risk['flag']}  [{risk['severity']}]</b>",
-                          S("rh",fontSize=9,textColor=col,fontName="Helvetica-Bold")),
+                Paragraph(f"<b>{risk['icon']} {risk['flag']}  [{risk['severity']}]</b>", T.risk_s[sev]),
                 Paragraph(risk["detail"], body_s),
             ]]
             t = Table(row_data, colWidths=[55*mm,115*mm])
@@ -145,7 +286,14 @@ def generate_pdf(metrics: dict, summary: str, risks: list, graph_b64: str) -> by
             "Not court-admissible without qualified forensic examiner review. Unauthorized distribution prohibited.",
             muted_s))
 
-        doc.build(story, onFirstPage=bg, onLaterPages=bg)
+        # Evidence appendix — streamed, never materialised as one story
+        tail = ()
+        if appendix is not None:
+            story.append(PageBreak())
+            story.extend(section("APPENDIX — CHRONOLOGICAL EVIDENCE LOG"))
+            tail = _appendix_tables(appendix)
+
+        doc.build(_FlowableStream(story, tail), onFirstPage=bg, onLaterPages=bg)
         buf.seek(0)
         return buf.read()
     except Exception as e:
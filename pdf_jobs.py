@@ -0,0 +1,75 @@
+"""
+pdf_jobs.py — Background PDF generation off the analyze request path.
+Job state is persisted in analyses.pdf_status so a restart never loses track:
+anything not 'done' is rebuilt lazily the first time the report is downloaded.
+"""
+import os, threading
+from concurrent.futures import ThreadPoolExecutor
+from database import attach_pdf, set_pdf_status, get_pdf, get_analysis, save_timings
+import instrument
+
+_pool    = ThreadPoolExecutor(max_workers=int(os.getenv("UFDR_PDF_WORKERS", "2")),
+                              thread_name_prefix="pdf")
+_lock    = threading.Lock()
+_running = {}   # analysis_id -> Future
+
+def submit_pdf(analysis_id, metrics, summary, risks, graph_b64="", appendix=None):
+    """Queues the report for analysis_id and returns its Future. A job that is
+    already in flight for the same row is reused instead of duplicated.
+    appendix: optional evidence row iterator (pdf_generator.evidence_rows)."""
+    with _lock:
+        fut = _running.get(analysis_id)
+        if fut is not None:
+            return fut
+        set_pdf_status(analysis_id, "queued")
+        fut = _pool.submit(_build, analysis_id, metrics, summary, risks, graph_b64, appendix)
+        _running[analysis_id] = fut
+    return fut
+
+def ensure_pdf(analysis_id):
+    """Returns an open file handle on the report, waiting on an in-flight job
+    or building it now (also when its blob has gone missing); None on failure.
+    The caller closes it — for streaming (service.py /pdf); use pdf_bytes() otherwise."""
+    pdf = get_pdf(analysis_id)
+    if pdf:
+        return pdf
+    with _lock:
+        fut = _running.get(analysis_id)
+    if fut is None:
+        rec = get_analysis(analysis_id)
+        if not rec:
+            return None
+        fut = submit_pdf(analysis_id, rec["metrics"], rec["summary"], rec["risks"])
+    fut.result()
+    return get_pdf(analysis_id)
+
+def pdf_bytes(analysis_id):
+    """The report as bytes (b"" on failure), e.g. for st.download_button."""
+    fh = ensure_pdf(analysis_id)
+    if not fh:
+        return b""
+    with fh:
+        return fh.read()
+
+def _build(analysis_id, metrics, summary, risks, graph_b64, appendix=None):
+    try:
+        set_pdf_status(analysis_id, "running")
+        with instrument.trace("pdf_job") as tr, instrument.span("pdf") as sp:
+            if not graph_b64:
+                from network_graph import generate_network_graph
+                with instrument.span("graph"):
+                    graph_b64 = generate_network_graph(metrics)
+            from pdf_generator import generate_pdf
+            pdf = generate_pdf(metrics, summary, risks, graph_b64, appendix=appendix)
+            sp.attrs["bytes"] = len(pdf)
+        attach_pdf(analysis_id, pdf)
+        save_timings(analysis_id, [r for r in tr.rows() if r["stage"] != "total"])
+        print(f"[PDF] analysis {analysis_id}: {len(pdf)} bytes")
+        return pdf
+    except Exception as e:
+        print(f"[PDF] analysis {analysis_id} failed: {e}")
+        attach_pdf(analysis_id, b"")
+        return b""
+    finally:
+        with _lock:
+            _running.pop(analysis_id, None)
@@ -0,0 +1,131 @@
+"""
+pipeline.py — The UFDR analysis pipeline without any UI:
+parse → aggregate → {risks, summary, graph} → PDF.
+Used by the app, the batch CLI and the analysis service; every stage is timed
+and traced (instrument.py), and the spans come back with the results.
+Stages after aggregation depend only on metrics, so they run concurrently —
+the network-bound Gemini call overlaps the CPU-bound graph render.
+"""
+import contextvars, time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import instrument
+
+STAGE_WORKERS = 3
+PIPELINE_VERSION = "7"   # bump when stage outputs change; invalidates app caches
+
+def run_stages(stages: dict, values: dict, timings: dict, on_done=None,
+               workers=STAGE_WORKERS) -> dict:
+    """Runs a DAG of stages on a thread pool. `stages` maps name → (deps, fn);
+    fn receives the values of its deps in order and its result is stored in
+    values[name]. A stage starts as soon as its deps exist in `values`.
+    on_done(name) is called from the calling thread after each stage, so it
+    may touch UI state. The first stage error cancels the rest and is raised."""
+    pending, running = dict(stages), {}
+    def timed(name, fn, args):
+        t0 = time.perf_counter()
+        try:
+            with instrument.span(name): return fn(*args)
+        finally: timings[name] = round(time.perf_counter() - t0, 4)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="stage") as pool:
+        while pending or running:
+            for name, (deps, fn) in list(pending.items()):
+                if all(d in values for d in deps):
+                    ctx = contextvars.copy_context()      # keeps the caller's span as parent
+                    running[pool.submit(ctx.run, timed, name, fn, [values[d] for d in deps])] = name
+                    del pending[name]
+            if not running:
+                raise ValueError(f"Unsatisfiable stage dependencies: {sorted(pending)}")
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in done:
+                name = running.pop(fut)
+                try:
+                    values[name] = fut.result()
+                except Exception:
+                    for f in running: f.cancel()
+                    raise
+                if on_done: on_done(name)
+    return values
+
+def analyze(file_bytes: bytes, with_pdf=True, appendix=False, progress=None, ai=True,
+            user=None, parsed=None, keep_archive=False) -> dict:
+    """Runs the full pipeline on one archive. Returns parsed, metrics, summary,
+    risks, graph, pdf, per-stage timings (seconds), the trace's span rows and
+    its cProfile text (None unless UFDR_PROFILE has cpu); 'error' is set and
+    the later stages are skipped when the archive holds no messages.
+    progress(stage, done, total) is called as each stage completes.
+    ai=False writes the template summary (bulk runs queue the model call).
+    user: when this device is already on file for user, only the records the
+    stored case lacks are aggregated (incremental.py); out["parsed"] is then
+    that delta and out["device"] says which case to fold it into.
+    parsed: parse_ufdr(file_bytes) already at hand (the app caches it), so
+    the parse stage is skipped; keep_archive=True returns that full parse as
+    out["archive"] when out["parsed"] is a device delta."""
+    from parser import parse_ufdr
+    parse = (lambda: parsed) if parsed is not None else (lambda: parse_ufdr(file_bytes))
+    with instrument.trace("analyze") as tr:
+        out = _analyze(parse, with_pdf, appendix, progress, ai, user, keep_archive)
+    out["spans"], out["profile"] = tr.rows(), tr.profile_text()
+    return out
+
+def analyze_case(files, owners=None, with_pdf=True, appendix=False, progress=None, ai=True,
+                 window=None) -> dict:
+    """analyze() over several extractions of one case: files is [(label, zip
+    bytes)]; duplicate records across them are merged (case_merge.py) and the
+    metrics gain 'devices' and 'dedupe'."""
+    import case_merge
+    window = window or case_merge.WINDOW
+    with instrument.trace("analyze_case") as tr:
+        out = _analyze(lambda: case_merge.parse_and_merge(files, owners, window),
+                       with_pdf, appendix, progress, ai)
+    out["spans"], out["profile"] = tr.rows(), tr.profile_text()
+    return out
+
+def _analyze(parse, with_pdf, appendix, progress, ai, user=None, keep_archive=False):
+    from aggregator import aggregate
+    from risk_detector import detect_risks
+    from ai_summary import generate_summary, template_summary
+    from network_graph import generate_network_graph
+    from pdf_generator import generate_pdf, evidence_rows
+
+    timings = {}
+    out = {"timings": timings}
+    total = (6 if with_pdf else 5) + (user is not None)
+    def done(name):
+        if progress: progress(name, len(timings), total)
+    def timed(name, fn, *a):
+        t0 = time.perf_counter()
+        try:
+            with instrument.span(name): return fn(*a)
+        finally: timings[name] = round(time.perf_counter() - t0, 4); done(name)
+
+    parsed = out["parsed"] = timed("parse", parse)
+    if parsed["messages"].empty:
+        out["error"] = "; ".join(parsed["errors"]) or "No messages found"
+        return out
+    whole, dev = parsed, None
+    if user is not None:
+        import incremental
+        parsed, dev = timed("delta", incremental.prepare, parsed, user)
+        out["parsed"], out["device"] = parsed, dev
+        if dev and keep_archive:
+            out["archive"] = whole
+    if dev:
+        out["metrics"] = timed("aggregate", incremental.aggregate, dev, parsed["messages"],
+                               parsed["calls"], parsed["metadata"])
+    else:
+        out["metrics"] = timed("aggregate", aggregate, parsed["messages"],
+                               parsed["calls"], parsed["metadata"])
+    out["metrics"].update(parsed.get("case", {}))
+    stages = {
+        "risks":   (("metrics",), detect_risks),
+        "summary": (("metrics",), generate_summary if ai else template_summary),
+        "graph":   (("metrics",), generate_network_graph),
+    }
+    if with_pdf:
+        rows = evidence_rows(whole["messages"], whole["calls"]) if appendix else None
+        stages["pdf"] = (("metrics", "summary", "risks", "graph"),
+                         lambda m, s, r, g: generate_pdf(m, s, r, g, appendix=rows))
+    run_stages(stages, out, timings, done)
+    out.setdefault("pdf", b"")
+    return out
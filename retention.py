@@ -0,0 +1,244 @@
+"""
+retention.py — Tiered storage: old analyses move to a compressed cold store.
+An analysis nobody has opened for MAX_AGE_DAYS is archived: its full metrics
+JSON and its stored evidence (contacts, messages, calls) are written as one
+compressed JSON document (zstd when available, else gzip) to a separate
+SQLite file next to the main database, then removed from the hot tables.
+
+The hot row stays as a stub — file name, description, summary, risks, the
+card scalars of its metrics, its analysis_stats/analysis_flags rows and its
+PDF (already in blobstore) — so history, cross-case statistics and report
+downloads never touch the cold file. Anything that reads the case in full
+(get_analysis, load_parsed, the message browser, a follow-up extraction)
+goes through database._ensure_hot(), which restores it first. A restored
+case is archived again once it sits unopened for MAX_AGE_DAYS; until then
+its cold copy is kept (a restore inside a transaction that rolls back must
+not lose it) and the next sweep drops it.
+
+Run: python retention.py --days 180 [--vacuum]   (archive cases older than 180 days)
+     python retention.py --restore 12
+     python retention.py --status
+"""
+import argparse, gzip, json, os, sqlite3, sys
+from datetime import datetime, timedelta
+import database
+
+MAX_AGE_DAYS   = int(os.getenv("UFDR_RETENTION_DAYS", "180"))
+FORMAT_VERSION = 1
+STUB_KEEP      = ("metadata", "top_contact")   # small dicts kept with the stub's scalars
+TS_FMT         = "%Y-%m-%d %H:%M:%S"
+
+def cold_path():
+    """UFDR_COLD_DB, or '<main db>_cold.db' beside the main database."""
+    return os.getenv("UFDR_COLD_DB") or os.path.splitext(database.DB)[0] + "_cold.db"
+
+def _cold():
+    con = sqlite3.connect(cold_path(), timeout=10)
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute("PRAGMA busy_timeout=10000")
+    con.execute("""CREATE TABLE IF NOT EXISTS cold_analyses(
+        analysis_id INTEGER PRIMARY KEY,
+        username    TEXT NOT NULL,
+        archived_at TEXT NOT NULL,
+        codec       TEXT NOT NULL,
+        raw_bytes   INTEGER NOT NULL,
+        payload     BLOB NOT NULL)""")
+    return con
+
+# ── Codecs ────────────────────────────────────────────
+
+def _zstd():
+    """(compress, decompress) from zstandard or pyarrow's bundled zstd, or None."""
+    try:
+        import zstandard
+        return (lambda b: zstandard.ZstdCompressor(level=10).compress(b),
+                lambda b, n: zstandard.ZstdDecompressor().decompress(b, max_output_size=n))
+    except ImportError:
+        pass
+    try:
+        import pyarrow as pa
+        if pa.Codec.is_available("zstd"):
+            codec = pa.Codec("zstd", compression_level=10)
+            return (lambda b: codec.compress(b, asbytes=True),
+                    lambda b, n: codec.decompress(b, decompressed_size=n, asbytes=True))
+    except ImportError:
+        pass
+    return None
+
+def default_codec():
+    return "zstd" if _zstd() else "gzip"
+
+def _compress(raw, codec):
+    if codec == "zstd":
+        return _zstd()[0](raw)
+    return gzip.compress(raw, compresslevel=6)
+
+def _decompress(blob, codec, size):
+    if codec == "zstd":
+        z = _zstd()
+        if not z:
+            raise RuntimeError("Archived with zstd: pip install zstandard")
+        return z[1](blob, size)
+    return gzip.decompress(blob)
+
+# ── Archive / restore ─────────────────────────────────
+
+def _stub(metrics):
+    """The card-sized part of metrics that stays hot."""
+    return {k: v for k, v in metrics.items() if k in STUB_KEEP or not isinstance(v, (dict, list))}
+
+def archive(analysis_id, codec=None):
+    """Moves one analysis to cold storage. Returns (raw bytes, stored bytes),
+    or None when it is missing or already archived."""
+    codec = codec or default_codec()
+    now   = datetime.now().strftime(TS_FMT)
+    with database.transaction() as con:
+        # claims the row (and the write lock) first: nothing changes it while we copy
+        if not con.execute("UPDATE analyses SET archived_at=? WHERE id=? AND archived_at IS NULL",
+                           (now, analysis_id)).rowcount:
+            return None
+        user, metrics = con.execute("SELECT username, metrics_json FROM analyses WHERE id=?",
+                                    (analysis_id,)).fetchone()
+        doc = {"format": FORMAT_VERSION, "analysis_id": analysis_id, "metrics_json": metrics,
+               "contacts": con.execute("SELECT name, phone FROM contacts WHERE analysis_id=? "
+                                       "ORDER BY id", (analysis_id,)).fetchall(),
+               "messages": con.execute("""SELECT m.ts, c.name, m.direction, m.type, m.body
+                   FROM messages m LEFT JOIN contacts c ON c.id=m.contact_id
+                   WHERE m.analysis_id=? ORDER BY m.id""", (analysis_id,)).fetchall(),
+               "calls":    con.execute("""SELECT k.ts, c.name, k.duration, k.type
+                   FROM calls k LEFT JOIN contacts c ON c.id=k.contact_id
+                   WHERE k.analysis_id=? ORDER BY k.id""", (analysis_id,)).fetchall()}
+        raw  = json.dumps(doc, separators=(",", ":")).encode()
+        blob = _compress(raw, codec)
+        cold = _cold()
+        try:
+            with cold:
+                cold.execute("INSERT OR REPLACE INTO cold_analyses VALUES(?,?,?,?,?,?)",
+                             (analysis_id, user, now, codec, len(raw), blob))
+        finally:
+            cold.close()
+        for t in ("messages", "calls", "contacts"):
+            con.execute(f"DELETE FROM {t} WHERE analysis_id=?", (analysis_id,))
+        try: stub = _stub(json.loads(metrics)) if metrics else {}
+        except: stub = {}
+        con.execute("UPDATE analyses SET metrics_json=? WHERE id=?", (json.dumps(stub), analysis_id))
+    return len(raw), len(blob)
+
+def restore(analysis_id):
+    """Brings an archived analysis back into the hot tables. Returns False
+    when it was not archived."""
+    with database.transaction() as con:
+        if not con.execute("UPDATE analyses SET archived_at=NULL, restored_at=? "
+                           "WHERE id=? AND archived_at IS NOT NULL",
+                           (datetime.now().strftime(TS_FMT), analysis_id)).rowcount:
+            return False
+        cold = _cold()
+        try:
+            row = cold.execute("SELECT codec, raw_bytes, payload FROM cold_analyses "
+                               "WHERE analysis_id=?", (analysis_id,)).fetchone()
+        finally:
+            cold.close()
+        if not row:
+            raise RuntimeError(f"Analysis #{analysis_id} is archived but missing from {cold_path()}")
+        doc = json.loads(_decompress(row[2], row[0], row[1]))
+        con.executemany("INSERT OR IGNORE INTO contacts(analysis_id,name,phone) VALUES(?,?,?)",
+                        ((analysis_id, n, p) for n, p in doc["contacts"]))
+        cid = dict(con.execute("SELECT name, id FROM contacts WHERE analysis_id=?", (analysis_id,)))
+        con.executemany("INSERT INTO messages(analysis_id,ts,contact_id,direction,type,body) "
+                        "VALUES(?,?,?,?,?,?)",
+                        ((analysis_id, ts, cid.get(n), d, t, b) for ts, n, d, t, b in doc["messages"]))
+        con.executemany("INSERT INTO calls(analysis_id,ts,contact_id,duration,type) VALUES(?,?,?,?,?)",
+                        ((analysis_id, ts, cid.get(n), d, t) for ts, n, d, t in doc["calls"]))
+        con.execute("UPDATE analyses SET metrics_json=? WHERE id=?", (doc["metrics_json"], analysis_id))
+    print(f"[Retention] Restored analysis #{analysis_id} ({len(doc['messages'])} messages, "
+          f"{len(doc['calls'])} calls)")
+    return True
+
+def discard(analysis_id):
+    """Deletes an analysis' cold copy, if any."""
+    if not os.path.exists(cold_path()):
+        return
+    cold = _cold()
+    try:
+        with cold:
+            cold.execute("DELETE FROM cold_analyses WHERE analysis_id=?", (analysis_id,))
+    finally:
+        cold.close()
+
+def prune():
+    """Drops cold copies of analyses that are hot again (restored) or gone;
+    returns how many. Holds the main database's write lock throughout, so no
+    archive() can write a fresh copy between the check and the delete."""
+    if not os.path.exists(cold_path()):
+        return 0
+    cold = _cold()
+    try:
+        with database.transaction(immediate=True) as con:
+            ids = [r[0] for r in cold.execute("SELECT analysis_id FROM cold_analyses")]
+            archived = {r[0] for r in con.execute("SELECT id FROM analyses WHERE archived_at IS NOT NULL")}
+            stale = [i for i in ids if i not in archived]
+            with cold:
+                cold.executemany("DELETE FROM cold_analyses WHERE analysis_id=?", ((i,) for i in stale))
+    finally:
+        cold.close()
+    return len(stale)
+
+def candidates(days=MAX_AGE_DAYS):
+    """Ids of hot analyses neither created nor restored within `days`, oldest first."""
+    cutoff = (datetime.now() - timedelta(days=days)).strftime(TS_FMT)
+    with database.transaction() as con:
+        return [r[0] for r in con.execute("""SELECT id FROM analyses WHERE archived_at IS NULL
+            AND COALESCE(restored_at, analyzed_at) < ? ORDER BY analyzed_at, id""", (cutoff,))]
+
+def sweep(days=MAX_AGE_DAYS, codec=None, vacuum=False):
+    """Archives every candidate and prunes stale cold copies; returns
+    {"archived", "raw_bytes", "stored_bytes", "pruned"}. vacuum=True then
+    compacts the hot file (it rewrites the whole database)."""
+    codec = codec or default_codec()
+    pruned = prune()
+    done, raw, stored = 0, 0, 0
+    for aid in candidates(days):
+        r = archive(aid, codec)
+        if r:
+            done, raw, stored = done + 1, raw + r[0], stored + r[1]
+    print(f"[Retention] Archived {done} analyses older than {days} days: "
+          f"{raw / 1e6:.1f} MB JSON → {stored / 1e6:.1f} MB {codec}"
+          + (f", dropped {pruned} stale cold copies" if pruned else ""))
+    if vacuum and done:
+        database.vacuum()
+    return {"archived": done, "raw_bytes": raw, "stored_bytes": stored, "pruned": pruned}
+
+def status():
+    """Hot/archived counts and both files' sizes."""
+    with database.transaction() as con:
+        hot, cold_n = con.execute("SELECT SUM(archived_at IS NULL), SUM(archived_at IS NOT NULL) "
+                                  "FROM analyses").fetchone()
+    size = lambda p: sum(os.path.getsize(f) for f in (p, p + "-wal") if os.path.exists(f))
+    return {"hot": hot or 0, "archived": cold_n or 0, "hot_db_bytes": size(database.DB),
+            "cold_db_bytes": size(cold_path()), "cold_db": cold_path()}
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--days", type=int, default=MAX_AGE_DAYS, help="archive cases older than this")
+    ap.add_argument("--codec", choices=["zstd", "gzip"], help="default: zstd when available")
+    ap.add_argument("--vacuum", action="store_true", help="compact the main database afterwards")
+    ap.add_argument("--restore", type=int, metavar="ID", help="restore one analysis instead")
+    ap.add_argument("--status", action="store_true")
+    args = ap.parse_args(argv)
+    try:
+        if args.status:
+            print(json.dumps(status(), indent=1))
+        elif args.restore is not None:
+            if not restore(args.restore):
+                print(f"[Retention] Analysis #{args.restore} is not archived")
+        else:
+            if args.codec == "zstd" and not _zstd():
+                raise RuntimeError("zstd needs zstandard or pyarrow")
+            sweep(args.days, args.codec, args.vacuum)
+    except RuntimeError as e:
+        print(f"[Retention] FAILED: {e}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
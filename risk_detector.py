@@ -49,6 +49,37 @@ def detect_risks(metrics: dict) -> list:
                      f"({metrics.get('gap_start','')} to {metrics.get('gap_end','')}). "
                      f"Possible alternative device, deliberate blackout, or device seizure."})
 
+    # 6. Short calls repeated late at night
+    sn = metrics.get("call_stats", {}).get("top_short_night") or \
+         max(metrics.get("call_contacts", []), key=lambda c: c.get("short_night", 0), default={})
+    if sn.get("short_night", 0) >= 3:
+        sev = "HIGH" if sn["short_night"] >= 10 else "MEDIUM"
+        flags.append({"flag":"Repeated Short Late-Night Calls","severity":sev,
+            "icon":"🔴" if sev=="HIGH" else "🟡",
+            "detail":f"{sn.get('contact_name','Unknown')} had {sn['short_night']} calls of 30s or less "
+                     f"between 12AM–4AM ({sn.get('missed',0) + sn.get('unanswered',0)} missed or unanswered). "
+                     f"Brief repeated night calls suggest signalling or check-ins rather than conversation."})
+
+    # 7. Call burst
+    burst = metrics.get("call_stats", {}).get("longest_burst", {})
+    if burst.get("calls", 0) >= 5:
+        flags.append({"flag":"Call Burst","severity":"MEDIUM","icon":"🟡",
+            "detail":f"{burst['calls']} calls with {burst.get('contact_name','Unknown')} followed each other "
+                     f"less than 10 minutes apart. Rapid repeated calling often marks an urgent or "
+                     f"developing situation."})
+
+    # 8. Message relay (in from A, out to B within minutes, well above chance)
+    co = metrics.get("coactivity", {})
+    relay = next((r for r in co.get("relays", []) if r["count"] >= 5 and (r.get("lift") or 0) >= 3), None)
+    if relay:
+        sev = "HIGH" if relay["count"] >= 15 and relay["lift"] >= 5 else "MEDIUM"
+        flags.append({"flag":"Possible Message Relay","severity":sev,
+            "icon":"🔴" if sev=="HIGH" else "🟡",
+            "detail":f"{relay['count']} times a message from {relay['source']} was followed within "
+                     f"{co.get('window_s',300)//60} minutes by a message to {relay['target']} — "
+                     f"{relay['lift']}x what their volumes predict by chance. The subject may be "
+                     f"passing information or instructions between them."})
+
     if not flags:
         flags.append({"flag":"No High-Priority Signals Detected","severity":"INFO","icon":"🔵",
             "detail":"Communication patterns appear within normal parameters."})
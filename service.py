@@ -0,0 +1,307 @@
+"""
+service.py — Local HTTP analysis service with a bounded job queue.
+Wraps the pipeline (parse → aggregate → risks → summary → graph → PDF) behind
+submit / status / result endpoints so the Streamlit app, the batch CLI and
+other systems can queue extractions. Analysis runs in a process pool; results
+are saved to the shared database like any other analysis.
+
+Run: python service.py --port 8765 --workers 4 --queue 32
+
+  POST /jobs?user=&file_name=&description=&pdf=1&appendix=0   body: UFDR .zip
+       → 202 job {"id", "status"}   503 + Retry-After when the queue is full
+       (user is required: 400 without it)
+  GET  /jobs/<id>          → status: queued | running | done | failed
+  GET  /jobs/<id>/result   → metrics, summary, risks, graph, analysis_id
+  GET  /jobs/<id>/pdf      → the report (built lazily if needed)
+  GET  /health             → queue depth, running jobs, capacity
+"""
+import argparse, hashlib, json, os, queue, tempfile, threading, time, uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, urlencode
+from urllib.request import Request, urlopen
+from urllib.error import HTTPError, URLError
+import startup
+
+MAX_UPLOAD = 2 * 1024**3      # 2 GB per archive
+KEEP_JOBS  = 1000             # finished jobs remembered for status queries
+CHUNK      = 1 << 20          # upload bytes read per spool write
+STALE_RETRIES = 3             # re-analyses of a follow-up whose device case moved on meanwhile
+
+def _analyze_path(path, with_pdf, appendix, user=None):
+    """Pool-process entry point; the dispatcher removes the spooled archive."""
+    from pipeline import analyze
+    with open(path, "rb") as f:
+        return analyze(f.read(), with_pdf=with_pdf, appendix=appendix, user=user)
+
+class JobManager:
+    """Bounded FIFO of spooled archives drained by `workers` dispatcher threads
+    into a process pool of the same size. submit() refuses instead of blocking
+    when full — that refusal is the service's backpressure."""
+
+    def __init__(self, workers=2, max_queue=16, spool_dir=None):
+        self.workers   = workers
+        self.queue     = queue.Queue(maxsize=max_queue)
+        self.pool      = ProcessPoolExecutor(max_workers=workers, initializer=startup.warm,
+                                             initargs=(startup.WORKER_STEPS,))
+        self.spool_dir = spool_dir or tempfile.mkdtemp(prefix="ufdr_spool_")
+        self.jobs      = OrderedDict()
+        self.lock      = threading.Lock()
+        self.running   = 0
+        for i in range(workers):
+            threading.Thread(target=self._dispatch, name=f"dispatch-{i}", daemon=True).start()
+
+    def submit(self, body, size, user, file_name, description="", with_pdf=True, appendix=False):
+        """Spools `size` bytes of archive from the binary stream `body`, hashing
+        as it goes. Returns the job dict, or None when the queue is full."""
+        import database
+        fd, path = tempfile.mkstemp(dir=self.spool_dir, suffix=".zip")
+        h = hashlib.sha256()
+        try:
+            with os.fdopen(fd, "wb") as f:
+                while size > 0:
+                    chunk = body.read(min(size, CHUNK))
+                    if not chunk:
+                        raise ValueError("upload ended before Content-Length bytes")
+                    h.update(chunk); f.write(chunk); size -= len(chunk)
+        except BaseException:
+            os.remove(path)
+            raise
+        sha = h.hexdigest()
+        prior = database.analysis_for_archive(sha, user)
+        job = {"id": uuid.uuid4().hex, "status": "queued", "user": user, "file_name": file_name,
+               "description": description, "archive_sha256": sha, "submitted": time.time(),
+               "analysis_id": None, "error": None, "timings": {}}
+        if prior:   # same archive already analyzed → answer from the stored row
+            os.remove(path)
+            job.update(status="done", analysis_id=prior, skipped=True)
+            return self._remember(job)
+        try:
+            self.queue.put_nowait((job, path, with_pdf, appendix))
+        except queue.Full:
+            os.remove(path)
+            return None
+        return self._remember(job)
+
+    def _remember(self, job):
+        """Registers job and returns a copy taken under the lock (a dispatcher
+        may already be updating the original)."""
+        with self.lock:
+            self.jobs[job["id"]] = job
+            while len(self.jobs) > KEEP_JOBS:
+                oldest = next(iter(self.jobs))
+                if self.jobs[oldest]["status"] in ("queued", "running"): break
+                self.jobs.popitem(last=False)
+            return dict(job)
+
+    def get(self, job_id):
+        """A copy of the job dict (dispatchers update the original), or None."""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def update(self, job_id, **kw):
+        with self.lock:
+            if job_id in self.jobs:
+                self.jobs[job_id].update(kw)
+
+    def _dispatch(self):
+        import incremental
+        while True:
+            job, path, with_pdf, appendix = self.queue.get()
+            with self.lock:
+                job.update(status="running", started=time.time()); self.running += 1
+            try:
+                for attempt in range(STALE_RETRIES + 1):
+                    res = self.pool.submit(_analyze_path, path, with_pdf, appendix, job["user"]).result()
+                    if res.get("error"):
+                        raise ValueError(res["error"])
+                    try:
+                        aid, _ = incremental.save(res, job["user"], job["file_name"],
+                                                  job["description"], job["archive_sha256"])
+                        break
+                    except incremental.StaleDelta:
+                        # another extraction of this phone was saved first: redo the delta
+                        if attempt == STALE_RETRIES:
+                            raise
+                        print(f"[Service] job {job['id']}: device case changed, analyzing again")
+                with self.lock:
+                    job.update(status="done", analysis_id=aid, timings=res["timings"],
+                               graph=res.get("graph", ""))
+            except Exception as e:
+                with self.lock:
+                    job.update(status="failed", error=str(e))
+                print(f"[Service] job {job['id']} failed: {e}")
+            finally:
+                os.remove(path)
+                with self.lock:
+                    job["finished"] = time.time(); self.running -= 1
+                self.queue.task_done()
+
+    def health(self):
+        return {"queued": self.queue.qsize(), "running": self.running,
+                "workers": self.workers, "capacity": self.queue.maxsize}
+
+def _public(job):
+    return {k: v for k, v in job.items() if k not in ("graph",)}
+
+class Handler(BaseHTTPRequestHandler):
+    manager: JobManager = None
+    protocol_version = "HTTP/1.1"
+
+    def _json(self, code, obj, headers=None):
+        body = json.dumps(obj, default=str).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items(): self.send_header(k, v)
+        self.end_headers(); self.wfile.write(body)
+
+    def _busy(self):
+        self.close_connection = True
+        return self._json(503, {"error": "queue full", **self.manager.health()},
+                          {"Retry-After": "5", "Connection": "close"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/jobs":
+            return self._json(404, {"error": "not found"})
+        size = int(self.headers.get("Content-Length") or 0)
+        if not size:
+            return self._json(400, {"error": "empty body; POST the .zip archive"})
+        if size > MAX_UPLOAD:
+            return self._json(413, {"error": "archive too large"})
+        q = {k: v[0] for k, v in parse_qs(url.query).items()}
+        if not q.get("user", "").strip():
+            # no authentication here: never guess whose case this is
+            self.close_connection = True
+            return self._json(400, {"error": "user is required"}, {"Connection": "close"})
+        if self.manager.queue.full():
+            # refuse before reading the body; the unread upload ends the connection
+            return self._busy()
+        try:
+            job = self.manager.submit(self.rfile, size, q["user"].strip(),
+                                      q.get("file_name", "Service upload"), q.get("description", ""),
+                                      q.get("pdf", "1") != "0", q.get("appendix", "0") == "1")
+        except ValueError as e:
+            self.close_connection = True
+            return self._json(400, {"error": str(e)}, {"Connection": "close"})
+        if job is None:
+            return self._busy()
+        self._json(202 if job["status"] == "queued" else 200, _public(job))
+
+    def do_GET(self):
+        parts = [p for p in urlparse(self.path).path.split("/") if p]
+        if parts == ["health"]:
+            return self._json(200, self.manager.health())
+        if len(parts) < 2 or parts[0] != "jobs":
+            return self._json(404, {"error": "not found"})
+        job = self.manager.get(parts[1])
+        if not job:
+            return self._json(404, {"error": "unknown job"})
+        if len(parts) == 2:
+            return self._json(200, _public(job))
+        if job["status"] != "done":
+            return self._json(409, {"error": f"job is {job['status']}", "status": job["status"]})
+        if parts[2] == "result":
+            import database
+            rec = database.get_analysis(job["analysis_id"]) or {}
+            graph = job.get("graph")
+            if graph is None:
+                from network_graph import generate_network_graph
+                graph = generate_network_graph(rec.get("metrics", {}))
+                self.manager.update(job["id"], graph=graph)
+            return self._json(200, {"analysis_id": job["analysis_id"], "metrics": rec.get("metrics"),
+                                    "summary": rec.get("summary"), "risks": rec.get("risks"),
+                                    "graph": graph, "timings": job["timings"]})
+        if parts[2] == "pdf":
+            from pdf_jobs import ensure_pdf
+            fh = ensure_pdf(job["analysis_id"])
+            if not fh:
+                return self._json(500, {"error": "PDF generation failed"})
+            with fh:
+                size = os.fstat(fh.fileno()).st_size
+                self.send_response(200)
+                self.send_header("Content-Type", "application/pdf")
+                self.send_header("Content-Length", str(size))
+                self.end_headers()
+                while chunk := fh.read(1 << 16):
+                    self.wfile.write(chunk)
+            return
+        self._json(404, {"error": "not found"})
+
+    def log_message(self, fmt, *args):
+        print(f"[Service] {self.address_string()} {fmt % args}")
+
+def serve(host="127.0.0.1", port=8765, workers=2, max_queue=16):
+    Handler.manager = JobManager(workers=workers, max_queue=max_queue)
+    srv = ThreadingHTTPServer((host, port), Handler)
+    print(f"[Service] http://{host}:{srv.server_port} — {workers} workers, queue {max_queue}")
+    return srv
+
+# ── Client ────────────────────────────────────────────
+# Used by app.py (UFDR_SERVICE_URL) and batch.py (--service).
+
+def submit(base_url, data, user, file_name="Service upload", description="",
+           pdf=True, appendix=False, retry_for=600):
+    """POSTs an archive, waiting out 503 backpressure for up to retry_for seconds.
+    Returns the job dict."""
+    qs = urlencode({"user": user, "file_name": file_name, "description": description,
+                    "pdf": "1" if pdf else "0", "appendix": "1" if appendix else "0"})
+    deadline = time.time() + retry_for
+    while True:
+        req = Request(f"{base_url.rstrip('/')}/jobs?{qs}", data=data, method="POST",
+                      headers={"Content-Type": "application/zip"})
+        try:
+            with urlopen(req) as r:
+                return json.loads(r.read())
+        except HTTPError as e:
+            if e.code != 503 or time.time() > deadline:
+                raise
+            time.sleep(float(e.headers.get("Retry-After") or 5))
+        except (URLError, ConnectionError) as e:
+            # a full queue answers 503 without reading the upload and hangs up,
+            # which a large body being sent sees as a reset connection
+            if not isinstance(getattr(e, "reason", e), ConnectionError) or time.time() > deadline:
+                raise
+            time.sleep(5)
+
+def job_status(base_url, job_id):
+    with urlopen(f"{base_url.rstrip('/')}/jobs/{job_id}") as r:
+        return json.loads(r.read())
+
+def wait(base_url, job_id, poll=0.5, timeout=None, on_status=None):
+    """Polls until the job is done/failed and returns its final status."""
+    t0 = time.time()
+    while True:
+        st = job_status(base_url, job_id)
+        if on_status: on_status(st)
+        if st["status"] in ("done", "failed"):
+            return st
+        if timeout and time.time() - t0 > timeout:
+            raise TimeoutError(f"job {job_id} still {st['status']}")
+        time.sleep(poll)
+
+def job_result(base_url, job_id):
+    with urlopen(f"{base_url.rstrip('/')}/jobs/{job_id}/result") as r:
+        return json.loads(r.read())
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    ap.add_argument("--queue", type=int, default=16, help="max queued jobs before 503")
+    args = ap.parse_args()
+    srv = serve(args.host, args.port, args.workers, args.queue)
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        srv.server_close()
+        Handler.manager.pool.shutdown(cancel_futures=True)
+
+if __name__ == "__main__":
+    main()
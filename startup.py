@@ -0,0 +1,67 @@
+"""
+startup.py — Pre-warms the analysis stack after a deploy or restart.
+The app only imports what the login page needs; pandas, matplotlib, networkx,
+ReportLab and google-generativeai load lazily inside the pipeline modules.
+prewarm() loads and initializes them on a background thread while the user
+is still logging in, so the first analysis runs as fast as the rest.
+warm() is the synchronous form, used as the worker-pool initializer.
+
+Disable with UFDR_PREWARM=0.
+"""
+import os, threading, time
+
+def _data():
+    import parser, aggregator, risk_detector   # pandas + the XML parser
+    import pandas as pd
+    pd.to_datetime(["2024-01-01 00:00:00"])
+
+def _graph():
+    from network_graph import generate_network_graph   # matplotlib, networkx, font cache
+    generate_network_graph({"network_edges": [{"source": "Subject", "target": "A", "weight": 1}]})
+
+def _pdf():
+    import pdf_generator                                # ReportLab + cached styles
+    pdf_generator._theme()
+    import reportlab.platypus
+
+def _ai():
+    import ai_summary                                   # loads .env
+    key = os.getenv("GEMINI_API_KEY", "")
+    if key and key != "paste_your_key_here":
+        import google.generativeai
+
+def _db():
+    import database
+    database.init_db()
+
+STEPS        = [("database", _db), ("parser", _data), ("graph", _graph), ("pdf", _pdf), ("ai", _ai)]
+WORKER_STEPS = STEPS[1:]   # pool processes never touch the database
+
+_lock, _started = threading.Lock(), False
+
+def warm(steps=STEPS, log=True):
+    """Runs each warm-up step, logging its cost. Failures are reported and
+    skipped: the real call will raise them again where they can be handled."""
+    for name, fn in steps:
+        t0 = time.perf_counter()
+        try:
+            fn()
+            if log: print(f"[Startup] warmed {name} in {time.perf_counter() - t0:.2f}s")
+        except Exception as e:
+            print(f"[Startup] warm-up of {name} failed: {e}")
+
+def prewarm(background=True):
+    """Starts warm() once per process (daemon thread unless background=False).
+    Returns the thread, or None if disabled or already started."""
+    global _started
+    if os.getenv("UFDR_PREWARM", "1") == "0":
+        return None
+    with _lock:
+        if _started:
+            return None
+        _started = True
+    if not background:
+        warm(); return None
+    t = threading.Thread(target=warm, name="prewarm", daemon=True)
+    t.start()
+    return t
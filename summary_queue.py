@@ -0,0 +1,131 @@
+"""
+summary_queue.py — Rate-limited AI summarization for bulk analyses.
+Cases are saved with the template summary first; this queue then asks the
+model for each one under a requests-per-minute and tokens-per-minute budget
+(token buckets), with at most `concurrency` calls in flight and exponential
+backoff on 429/5xx, and writes each answer back to its analyses row.
+
+Used by batch.py (--ai-rpm/--ai-tpm/--ai-concurrency); testable offline
+against `python ai_stub.py --rpm 30` with GEMINI_API_BASE set.
+"""
+import queue, random, threading, time
+
+OUTPUT_TOKENS = 400          # budgeted per answer on top of the prompt estimate
+
+class TokenBucket:
+    """Refills `rate_per_min` tokens per minute up to `capacity`; take() blocks
+    until enough are available and returns the seconds it waited."""
+
+    def __init__(self, rate_per_min, capacity=None):
+        self.rate     = rate_per_min / 60.0
+        self.capacity = capacity or rate_per_min
+        self.tokens   = float(self.capacity)
+        self.stamp    = time.monotonic()
+        self.lock     = threading.Lock()
+
+    def take(self, n=1):
+        n, waited = min(n, self.capacity), 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+                self.stamp  = now
+                if self.tokens >= n:
+                    self.tokens -= n
+                    return waited
+                need = (n - self.tokens) / self.rate
+            time.sleep(need); waited += need
+
+    def drain(self):
+        """Empties the bucket — the server says we are over quota."""
+        with self.lock:
+            self.tokens, self.stamp = 0.0, time.monotonic()
+
+def _status(e):
+    code = getattr(e, "code", None)
+    return getattr(code, "value", code)          # grpc StatusCode → int-ish
+
+def _retryable(e):
+    """Quota, server and transport errors are worth another try; 4xx are not."""
+    code = _status(e)
+    return not isinstance(code, int) or code == 429 or code >= 500
+
+class SummaryQueue:
+    def __init__(self, rpm=60, tpm=250_000, concurrency=4, retries=5, backoff=2.0,
+                 model=None, timeout=60):
+        import ai_summary
+        self.ai       = ai_summary
+        self.requests = TokenBucket(rpm, capacity=max(1, min(rpm, concurrency)))
+        self.tokens   = TokenBucket(tpm)
+        self.retries, self.backoff, self.timeout = retries, backoff, timeout
+        self.model    = model or ai_summary.MODELS[0]
+        self.q        = queue.Queue()
+        self.stats    = {"done": 0, "cached": 0, "failed": 0, "retries": 0, "throttled_s": 0.0}
+        self.lock     = threading.Lock()
+        self.latest   = {}           # analysis id -> metrics to summarize, while queued
+        self.gen      = {}           # analysis id -> submissions so far
+        self.threads  = [threading.Thread(target=self._worker, name=f"summary-{i}", daemon=True)
+                         for i in range(concurrency)]
+        for t in self.threads: t.start()
+
+    def submit(self, analysis_id, metrics):
+        """Queues a case once: resubmitting one still waiting just swaps in the
+        newer metrics (a case folded again), and an answer for metrics that
+        were replaced meanwhile is dropped, so an older summary never lands last."""
+        with self.lock:
+            self.gen[analysis_id] = self.gen.get(analysis_id, 0) + 1
+            waiting = analysis_id in self.latest
+            self.latest[analysis_id] = metrics
+        if not waiting:
+            self.q.put(analysis_id)
+
+    def join(self):
+        """Blocks until every submitted case is summarized or given up on."""
+        self.q.join()
+        return dict(self.stats)
+
+    def _count(self, key, n=1):
+        with self.lock: self.stats[key] += n
+
+    def _worker(self):
+        import database
+        while True:
+            aid = self.q.get()
+            try:
+                with self.lock:
+                    metrics, gen = self.latest.pop(aid), self.gen[aid]
+                text = self._summarize(metrics)
+                with self.lock:
+                    if text and self.gen[aid] == gen:
+                        database.update_summary(aid, text)
+            except Exception as e:
+                self._count("failed")
+                print(f"[Summary] analysis {aid}: gave up ({e}); keeping template summary")
+            finally:
+                self.q.task_done()
+
+    def _summarize(self, metrics):
+        import database
+        prompt = self.ai.build_prompt(metrics)
+        key    = self.ai.cache_key(self.model, prompt)
+        hit = database.summary_cache_get([key], self.ai.CACHE_TTL)
+        if hit:
+            self._count("cached")
+            return hit[2]
+        for attempt in range(self.retries + 1):
+            waited  = self.requests.take(1)
+            waited += self.tokens.take(len(prompt) // 4 + OUTPUT_TOKENS)
+            self._count("throttled_s", waited)
+            try:
+                text = self.ai.ask(self.model, prompt, self.timeout)
+            except Exception as e:
+                if attempt == self.retries or not _retryable(e):
+                    raise
+                self._count("retries")
+                if _status(e) == 429:
+                    self.requests.drain()
+                time.sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1.0))
+                continue
+            database.summary_cache_put(key, self.model, text, self.ai.CACHE_ROWS)
+            self._count("done")
+            return text
@@ -0,0 +1,59 @@
+"""
+timeline.py — Compact daily message series and display downsampling.
+Metrics store the timeline as {"start": "YYYY-MM-DD", "counts": [...]}: one
+integer per calendar day from the first active day, zero days included,
+instead of a JSON key per date. Charts cut a window out of that series and
+min/max-bucket it to a fixed number of points, so render cost stays flat
+however many years an extraction covers.
+"""
+import numpy as np
+
+MAX_POINTS = 500
+
+def encode_daily(daily) -> dict:
+    """Series of counts indexed by date → compact series dict."""
+    if not len(daily):
+        return {"start": None, "counts": []}
+    days   = np.array([str(d) for d in daily.index], dtype="datetime64[D]")
+    start  = days.min()
+    counts = np.zeros(int((days.max() - start).astype(int)) + 1, dtype=np.int64)
+    counts[(days - start).astype(int)] = np.asarray(daily.values, dtype=np.int64)
+    return {"start": str(start), "counts": counts.tolist()}
+
+def daily_series(metrics: dict):
+    """(days as datetime64[D], counts) for an analysis. Reads the compact
+    series, or the per-date daily_volume dict stored by older analyses."""
+    s = metrics.get("daily_series") or {}
+    if s.get("counts"):
+        counts = np.asarray(s["counts"], dtype=np.int64)
+        return np.datetime64(s["start"], "D") + np.arange(len(counts)), counts
+    legacy = metrics.get("daily_volume") or {}
+    if not legacy:
+        return np.array([], dtype="datetime64[D]"), np.array([], dtype=np.int64)
+    days  = np.array(list(legacy), dtype="datetime64[D]")
+    order = np.argsort(days)
+    days, vals = days[order], np.fromiter(legacy.values(), np.int64, len(legacy))[order]
+    counts = np.zeros(int((days[-1] - days[0]).astype(int)) + 1, dtype=np.int64)
+    counts[(days - days[0]).astype(int)] = vals
+    return days[0] + np.arange(len(counts)), counts
+
+def window(days, counts, start=None, end=None):
+    """The [start, end] slice (inclusive, any date-like) of a series."""
+    lo = np.searchsorted(days, np.datetime64(start, "D")) if start is not None else 0
+    hi = np.searchsorted(days, np.datetime64(end, "D"), side="right") if end is not None else len(days)
+    return days[lo:hi], counts[lo:hi]
+
+def downsample(days, counts, max_points=MAX_POINTS):
+    """Min/max bucketing to at most max_points: each bucket keeps its lowest
+    and highest day in time order, so spikes and silent stretches survive."""
+    n = len(counts)
+    if n <= max_points:
+        return days, counts
+    edges = np.linspace(0, n, max_points // 2 + 1).astype(int)
+    keep  = []
+    for lo, hi in zip(edges[:-1], edges[1:]):
+        seg = counts[lo:hi]
+        a, b = lo + int(seg.argmin()), lo + int(seg.argmax())
+        keep += (a, b) if a < b else (b, a) if b < a else (a,)
+    keep = np.asarray(keep)
+    return days[keep], counts[keep]